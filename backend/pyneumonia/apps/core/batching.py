@@ -0,0 +1,63 @@
+"""
+Escrituras derivadas acumuladas por transacción
+
+Los receivers que mantienen contadores, sketches o invalidaciones no escriben en
+el momento: acumulan su aporte con `add()` y todo lo acumulado durante la
+transacción se aplica una sola vez al confirmarla (transaction.on_commit). Cada
+función de aplicación recibe la lista completa y puede resolverla con una
+consulta por tabla, de modo que varias escrituras en la misma transacción
+(altas en cascada, revisiones con varios campos) pagan una sola vez.
+
+Lo acumulado dentro de un savepoint se descarta si el savepoint se revierte, y
+lo de una transacción revertida nunca se aplica. Fuera de una transacción se
+aplica de inmediato.
+"""
+import logging
+import threading
+
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+class _Batch:
+    """Aportes pendientes de una transacción (o savepoint), agrupados por función de aplicación"""
+
+    def __init__(self):
+        self.items = {}
+        self.done = False
+
+    def pending(self, connection):
+        """Sigue registrado en on_commit (no se aplicó ni se revirtió)"""
+        return not self.done and any(callback == self.run for _, callback, _ in connection.run_on_commit)
+
+    def run(self):
+        if self.done:
+            return
+        self.done = True
+        for apply, items in self.items.items():
+            try:
+                apply(items)
+            except Exception:
+                logger.exception('Error al aplicar escrituras acumuladas (%s)', apply.__qualname__)
+
+
+def add(apply, *items):
+    """Acumula `items` para `apply(items)`, que se llama una vez al confirmar la transacción actual"""
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        apply(list(items))
+        return
+
+    key = tuple(connection.savepoint_ids)
+    batches = getattr(_local, 'batches', {})
+    batch = batches.get(key)
+    if batch is None or not batch.pending(connection):
+        # Descartar los lotes ya aplicados o revertidos junto con su savepoint
+        batches = {k: b for k, b in batches.items() if b.pending(connection)}
+        batch = batches[key] = _Batch()
+        _local.batches = batches
+        transaction.on_commit(batch.run)
+    batch.items.setdefault(apply, []).extend(items)
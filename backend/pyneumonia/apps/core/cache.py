@@ -0,0 +1,43 @@
+"""
+Caché compartida entre procesos
+
+Las entradas que se invalidan con versiones o generaciones (alcances de
+estadísticas, respuestas cacheadas, índice de autocompletado) solo son
+correctas si todos los workers leen la misma caché. En settings la caché es
+Redis si se define REDIS_URL y, si no, la local de cada proceso, con la que
+esos módulos no cachean.
+
+La tabla de caché de la base de datos es compartida pero cada lectura es una
+consulta SQL: solo conviene para entradas que ahorran más que eso (ver
+`is_fast_shared`).
+"""
+from django.core.cache import caches
+from django.core.cache.backends.db import DatabaseCache
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.cache.backends.memcached import BaseMemcachedCache
+from django.core.cache.backends.redis import RedisCache
+
+PROCESS_LOCAL_BACKENDS = (LocMemCache, DummyCache)
+SQL_BACKENDS = (DatabaseCache,)
+ATOMIC_INCR_BACKENDS = (RedisCache, BaseMemcachedCache)
+
+
+def is_shared(alias='default'):
+    """False si la caché vive en la memoria de cada proceso (o no guarda nada)"""
+    return not isinstance(caches[alias], PROCESS_LOCAL_BACKENDS)
+
+
+def is_fast_shared(alias='default'):
+    """Compartida y sin consultas SQL por lectura (Redis, Memcached)"""
+    return is_shared(alias) and not isinstance(caches[alias], SQL_BACKENDS)
+
+
+def has_atomic_incr(alias='default'):
+    """
+    incr() atómico entre procesos (Redis, Memcached).
+
+    En los demás backends incr() lee y escribe por separado: dos procesos
+    pueden obtener el mismo valor.
+    """
+    return isinstance(caches[alias], ATOMIC_INCR_BACKENDS)
@@ -0,0 +1,22 @@
+from django.core.management.commands.createcachetable import Command as CreateCacheTable
+from django.db import migrations
+
+# Tabla para DatabaseCache (LOCATION en CACHES); se crea aunque la caché
+# configurada sea otra para poder usarla sin pasos adicionales
+CACHE_TABLE = 'pyneumonia_cache'
+
+
+def create_cache_table(apps, schema_editor):
+    # Sin efecto si la tabla ya existe
+    command = CreateCacheTable()
+    command.verbosity = 0
+    command.create_table(schema_editor.connection.alias, CACHE_TABLE, False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = []
+
+    operations = [
+        migrations.RunPython(create_cache_table, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,118 @@
+"""
+Paginación del API: por número de página o, a pedido, por cursor (keyset)
+
+Por defecto se usa PageNumberPagination (COUNT(*) + OFFSET). Los ViewSets que
+declaran `keyset_fields` aceptan además paginación por cursor: con
+`?pagination=cursor` (primera página) o `?cursor=<token>` (siguientes) se
+ordena por esos campos y cada página filtra "después de la última fila vista"
+en lugar de saltar filas, así que la página N cuesta lo mismo que la primera y
+no se cuenta el total. Los campos deben cubrirse con un índice compuesto en el
+mismo orden y terminar en una columna única (normalmente `id`).
+
+En modo cursor la respuesta es {next, previous, results}; solo se avanza
+(previous es siempre null) y el parámetro `ordering` se ignora.
+"""
+import base64
+import json
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+def keyset_condition(fields, values):
+    """Filas estrictamente después de `values` según `fields` (con '-' para descendente)"""
+    condition = Q()
+    equal = Q()
+    for field, value in zip(fields, values):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        condition |= equal & Q(**{f'{name}__{lookup}': value})
+        equal &= Q(**{name: value})
+    return condition
+
+
+def encode_cursor(values):
+    """Token opaco (base64 de una lista JSON) con la posición de la última fila"""
+    payload = json.dumps([value.isoformat() if hasattr(value, 'isoformat') else str(value) for value in values])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token, size):
+    """
+    Valores de un token de `encode_cursor` (como texto).
+
+    Raises:
+        ValueError: si el token no es válido o no tiene `size` valores
+    """
+    try:
+        raw = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except Exception:
+        raise ValueError(token)
+    if not isinstance(raw, list) or len(raw) != size:
+        raise ValueError(token)
+    return raw
+
+
+class PageOrKeysetPagination(PageNumberPagination):
+    cursor_query_param = 'cursor'
+    mode_query_param = 'pagination'
+    invalid_cursor_message = 'Cursor inválido'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset_fields = tuple(getattr(view, 'keyset_fields', ()) or ())
+        self.use_keyset = bool(self.keyset_fields) and (
+            request.query_params.get(self.mode_query_param) == 'cursor'
+            or self.cursor_query_param in request.query_params
+        )
+        if not self.use_keyset:
+            return super().paginate_queryset(queryset, request, view)
+
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+        self.request = request
+        self.display_page_controls = False
+
+        queryset = queryset.order_by(*self.keyset_fields)
+        token = request.query_params.get(self.cursor_query_param)
+        if token:
+            queryset = queryset.filter(keyset_condition(self.keyset_fields, self.decode_cursor(queryset.model, token)))
+
+        rows = list(queryset[:page_size + 1])
+        self.has_next = len(rows) > page_size
+        rows = rows[:page_size]
+        self.next_position = self.position(rows[-1]) if self.has_next else None
+        return rows
+
+    def position(self, instance):
+        return [getattr(instance, field.lstrip('-')) for field in self.keyset_fields]
+
+    def decode_cursor(self, model, token):
+        try:
+            raw = decode_cursor(token, len(self.keyset_fields))
+            return [
+                model._meta.get_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(self.keyset_fields, raw)
+            ]
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if not self.use_keyset:
+            return super().get_next_link()
+        if self.next_position is None:
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(), self.mode_query_param)
+        return replace_query_param(url, self.cursor_query_param, encode_cursor(self.next_position))
+
+    def get_paginated_response(self, data):
+        if not self.use_keyset:
+            return super().get_paginated_response(data)
+        return Response({
+            'next': self.get_next_link(),
+            'previous': None,
+            'results': data,
+        })
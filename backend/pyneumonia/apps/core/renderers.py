@@ -0,0 +1,93 @@
+"""
+Renderers y parsers rápidos del API
+
+- FastJSONRenderer / FastJSONParser: application/json con orjson, que serializa
+  UUID, datetime, date y time de forma nativa (en C). Los demás tipos (Decimal,
+  timedelta, textos traducibles, QuerySet...) se convierten igual que en el
+  JSONEncoder de DRF. Sin orjson instalado se comportan como JSONRenderer y
+  JSONParser.
+- MessagePackRenderer / MessagePackParser: application/msgpack para clientes
+  internos (requiere el paquete msgpack). Los valores se reducen a los mismos
+  tipos que en JSON.
+
+Diferencias con JSONRenderer: las fechas conservan los microsegundos y `indent`
+solo admite 2 espacios. La lista de renderers del proyecto se arma en settings
+(BrowsableAPIRenderer solo con API_BROWSABLE); ver `manage.py benchmark_renderers`.
+"""
+import uuid
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser, JSONParser
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+_encoder = JSONEncoder()
+
+
+def _default(obj):
+    """Tipos que orjson no serializa: misma conversión que el encoder de DRF"""
+    return _encoder.default(obj)
+
+
+def _msgpack_default(obj):
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    return _encoder.default(obj)
+
+
+class FastJSONRenderer(JSONRenderer):
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        if data is None:
+            return b''
+        option = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+        if self.get_indent(accepted_media_type or '', renderer_context or {}):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, default=_default, option=option)
+
+
+class FastJSONParser(JSONParser):
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if orjson is None:
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError(f'JSON parse error - {exc}')
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=_msgpack_default, use_bin_type=True, datetime=False)
+
+
+class MessagePackParser(BaseParser):
+    media_type = 'application/msgpack'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read(), raw=False)
+        except Exception as exc:
+            raise ParseError(f'MessagePack parse error - {exc}')
+
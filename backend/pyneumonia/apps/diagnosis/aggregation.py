@@ -0,0 +1,68 @@
+"""
+Motor de agregación para estadísticas
+
+Agrupa los contadores solicitados por queryset base y los resuelve con un único
+aggregate() por modelo usando agregados condicionales (Count(filter=Q(...))),
+en lugar de un COUNT(*) independiente por métrica.
+"""
+from django.db.models import Count, Exists, OuterRef, Q
+
+
+def has_related(model, link_field, **filters):
+    """Condición EXISTS: la fila tiene al menos un `model` relacionado que cumple `filters`"""
+    return Q(Exists(model.objects.filter(**{link_field: OuterRef('pk')}, **filters)))
+
+
+class CounterSet:
+    """
+    Colección de métricas agrupadas por fuente.
+
+    Uso:
+        counters = CounterSet()
+        counters.source('diagnoses', dr_qs)
+        counters.count('diagnoses', 'total')
+        counters.count('diagnoses', 'pending', Q(is_reviewed=False))
+        counters.add('diagnoses', 'avg_confidence', Avg('confidence'))
+        values = counters.evaluate()   # una consulta por fuente
+        values['diagnoses']['pending']
+    """
+
+    def __init__(self):
+        self._sources = {}
+        self._metrics = {}
+
+    def source(self, name, queryset):
+        """Registra un queryset base; las métricas de la misma fuente comparten consulta"""
+        self._sources[name] = queryset
+        self._metrics.setdefault(name, {})
+        return self
+
+    def add(self, source, metric, expression):
+        """Agrega una expresión de agregación arbitraria (Avg, Sum, Count...)"""
+        if source not in self._sources:
+            raise KeyError(f'Fuente no registrada: {source}')
+        self._metrics[source][metric] = expression
+        return self
+
+    def count(self, source, metric, condition=None):
+        """Cuenta filas de la fuente que cumplen `condition` (todas si es None)"""
+        return self.add(source, metric, Count('pk', filter=condition))
+
+    def groups(self):
+        """Lista de (fuente, queryset, métricas) con al menos una métrica"""
+        return [
+            (name, self._sources[name], metrics)
+            for name, metrics in self._metrics.items() if metrics
+        ]
+
+    @staticmethod
+    def evaluate_group(queryset, metrics):
+        """Resuelve las métricas de una fuente con un solo aggregate()"""
+        return queryset.aggregate(**metrics)
+
+    def evaluate(self):
+        """Evalúa todas las fuentes; retorna {fuente: {métrica: valor}}"""
+        return {
+            name: self.evaluate_group(queryset, metrics)
+            for name, queryset, metrics in self.groups()
+        }
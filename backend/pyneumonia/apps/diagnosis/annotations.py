@@ -0,0 +1,85 @@
+"""
+Consultas declaradas por los ViewSets para sus serializers
+
+Cada ViewSet declara lo que su serializer lee de otras tablas: relaciones
+(`select_related_fields`, `prefetch_related_fields`) y valores calculados
+(`annotations`, p. ej. un Exists() para `has_xray`). Los serializers usan el
+valor anotado cuando está presente y solo consultan por fila como respaldo
+(instancias creadas o actualizadas fuera del listado), de modo que un listado
+cuesta un número fijo de consultas sin importar el tamaño de página.
+
+Las anotaciones no referenciadas se eliminan de count() y aggregate(), así que
+no encarecen la paginación ni el validador del GET condicional. Con ?fields=
+solo se aplican las relaciones y anotaciones de los campos pedidos.
+"""
+from django.db.models import Exists, OuterRef
+
+from .fieldsets import SparseFieldsetMixin, requested_fields, load_plan
+
+
+def exists(model, link_field, **filters):
+    """Fábrica de anotación EXISTS: la fila tiene al menos un `model` relacionado"""
+    return lambda: Exists(model.objects.filter(**{link_field: OuterRef('pk')}, **filters))
+
+
+def annotated(obj, name, fallback):
+    """Valor anotado `name` de `obj`, o `fallback()` si la instancia no viene de la consulta anotada"""
+    try:
+        return getattr(obj, name)
+    except AttributeError:
+        return fallback()
+
+
+class AnnotatedQuerysetMixin:
+    """
+    Aplica las relaciones y anotaciones declaradas al queryset del ViewSet.
+
+    Atributos:
+        select_related_fields: Rutas para select_related()
+        prefetch_related_fields: Rutas u objetos Prefetch para prefetch_related()
+        annotations: {nombre: función sin argumentos que retorna la expresión}
+    """
+    select_related_fields = ()
+    prefetch_related_fields = ()
+    annotations = {}
+
+    def get_queryset(self):
+        return self.annotate_queryset(super().get_queryset())
+
+    def get_load_plan(self, model):
+        """Plan de carga para ?fields= en list/retrieve (ver apps.diagnosis.fieldsets), o None"""
+        serializer_class = self.get_serializer_class()
+        if self.action not in ('list', 'retrieve') or not issubclass(serializer_class, SparseFieldsetMixin):
+            return None
+        selected = requested_fields(self.request, serializer_class.expandable_fields)
+        if selected is None:
+            return None
+        plan = load_plan(serializer_class, model, selected)
+        if plan is not None:
+            plan['annotations'] = selected
+        return plan
+
+    def annotate_queryset(self, queryset):
+        plan = self.get_load_plan(queryset.model)
+        if plan is None:
+            select_related = self.select_related_fields
+            prefetch_related = self.prefetch_related_fields
+            annotations = self.annotations
+        else:
+            # Solo lo que leen los campos pedidos
+            select_related = sorted(plan['select_related'])
+            prefetch_related = [
+                lookup for lookup in self.prefetch_related_fields
+                if getattr(lookup, 'prefetch_through', lookup).split('__')[0] in plan['full_relations']
+            ]
+            annotations = {name: build for name, build in self.annotations.items() if name in plan['annotations']}
+
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*prefetch_related)
+        if annotations:
+            queryset = queryset.annotate(**{name: build() for name, build in annotations.items()})
+        if plan is not None:
+            queryset = queryset.only(*sorted(plan['only']))
+        return queryset
@@ -0,0 +1,87 @@
+"""
+Variantes asíncronas (ASGI) de los endpoints de estadísticas
+
+Las consultas independientes del dashboard (un aggregate() por fuente, la
+distribución reciente, los grupos) se lanzan a la vez sobre un pool de hilos
+acotado (`STATS_ASYNC_WORKERS`), cada hilo con su propia conexión. El ORM
+asíncrono de Django ejecuta todo en un único hilo sensible, así que por sí solo
+no solapa consultas; por eso el pool es propio.
+
+Con `STATS_ASYNC_WORKERS = 0` las consultas se ejecutan en serie en el hilo de
+la petición (útil en pruebas, donde otros hilos no ven la transacción). Con
+CONN_MAX_AGE = 0 cada consulta del pool abre y cierra su conexión; para que el
+paralelismo compense conviene usar conexiones persistentes.
+
+Estas vistas no pasan por la caché de respuestas (apps.diagnosis.stats_cache):
+su objetivo es reducir la latencia del cálculo en frío. Se despliegan con
+cualquier servidor ASGI, p. ej. `uvicorn pyneumonia.asgi:application`.
+"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections
+from django.http import JsonResponse
+from django.views.decorators.http import require_GET
+from rest_framework import status
+from rest_framework.exceptions import NotAuthenticated
+
+from .dashboard import plan_dashboard, run_queries
+from .scope import determine_stats_scope
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Pool compartido por todas las peticiones (None si STATS_ASYNC_WORKERS es 0)"""
+    global _executor
+    workers = getattr(settings, 'STATS_ASYNC_WORKERS', 8)
+    if workers <= 0:
+        return None
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='stats-async')
+    return _executor
+
+
+def _in_worker(function):
+    """Ejecuta `function` en un hilo del pool liberando al terminar las conexiones vencidas"""
+    try:
+        return function()
+    finally:
+        close_old_connections()
+
+
+async def run_blocking(function):
+    executor = get_executor()
+    if executor is None:
+        return await sync_to_async(function)()
+    return await asyncio.get_running_loop().run_in_executor(executor, _in_worker, function)
+
+
+async def run_concurrently(queries):
+    """Versión concurrente de run_queries: {nombre: resultado}"""
+    if get_executor() is None:
+        return await sync_to_async(run_queries)(queries)
+    names = list(queries)
+    results = await asyncio.gather(*(run_blocking(queries[name]) for name in names))
+    return dict(zip(names, results))
+
+
+@require_GET
+async def dashboard_overview_async_view(request):
+    """
+    Variante asíncrona de dashboard_overview_view con la misma respuesta.
+    Requiere una sesión autenticada.
+    """
+    user = await request.auser()
+    if not user.is_authenticated:
+        return JsonResponse({'detail': str(NotAuthenticated.default_detail)}, status=status.HTTP_403_FORBIDDEN)
+
+    scope_info = await run_blocking(lambda: determine_stats_scope(user))
+    queries, render = plan_dashboard(user, scope_info)
+    return JsonResponse(render(await run_concurrently(queries)), encoder=DjangoJSONEncoder)
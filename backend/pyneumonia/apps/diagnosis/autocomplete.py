@@ -0,0 +1,269 @@
+"""
+Autocompletado de pacientes por DNI o apellido
+
+Cada paciente activo tiene claves normalizadas en PatientLookupKey: su DNI, sus
+apellidos completos y cada apellido siguiente ("Pérez Gómez" -> "perez gomez",
+"gomez"). Una búsqueda es un prefijo de esas claves y retorna los primeros N
+pacientes en orden de clave.
+
+Con PATIENT_AUTOCOMPLETE_IN_MEMORY la búsqueda se resuelve en un índice por
+proceso: las claves ordenadas en una lista, donde un prefijo es un rango que se
+ubica con bisect (la misma consulta que el recorrido de un trie, con menos
+memoria por entrada en Python). Los signals de Patient actualizan la tabla y,
+al confirmarse la transacción, el índice del proceso que escribe y la
+generación en la caché compartida; los demás procesos recargan su índice
+cuando ven otra generación (o a los PATIENT_AUTOCOMPLETE_TTL segundos). El
+proceso que escribe aplica su cambio en el lugar solo si la generación nueva
+es la siguiente a la suya, lo que exige un incr() atómico entre procesos
+(Redis, Memcached): con la tabla de caché dos escrituras concurrentes
+obtendrían la misma generación, y con una caché local de cada proceso la
+generación no llegaría a los demás workers. En esos casos no se usa el índice
+en memoria.
+
+Sin índice en memoria, el prefijo es un rango sobre el índice de `key` en la
+base de datos.
+"""
+import bisect
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from apps.core import batching
+from apps.core.cache import has_atomic_incr
+from .models import Patient, PatientLookupKey
+from .search import normalize, TOKEN_RE
+
+GENERATION_KEY = 'patient_autocomplete:gen'
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 25
+
+# Campos cuyo cambio altera las claves o la respuesta
+SOURCE_FIELDS = ('dni', 'first_name', 'last_name', 'is_active')
+
+
+def lookup_keys(dni, last_name):
+    """Claves normalizadas de un paciente"""
+    tokens = TOKEN_RE.findall(normalize(last_name))
+    keys = {normalize(dni).strip(), ' '.join(tokens), *tokens[1:]}
+    keys.discard('')
+    return keys
+
+
+def normalize_query(query):
+    return ' '.join(TOKEN_RE.findall(normalize(query)))
+
+
+def prefix_upper_bound(prefix):
+    """Menor cadena mayor que todas las que empiezan con `prefix`"""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def full_name(first_name, last_name):
+    return f"{first_name} {last_name}"
+
+
+class PrefixIndex:
+    """Claves ordenadas [(clave, id)] y datos de cada paciente {id: (dni, nombre completo, claves)}"""
+
+    def __init__(self, rows=()):
+        self.entries = []
+        self.patients = {}
+        for key, patient_id, dni, first_name, last_name in rows:
+            self.entries.append((key, patient_id))
+            _, _, keys = self.patients.setdefault(patient_id, (dni, full_name(first_name, last_name), []))
+            keys.append(key)
+        self.entries.sort()
+
+    def __len__(self):
+        return len(self.patients)
+
+    def remove(self, patient_id):
+        _, _, keys = self.patients.pop(patient_id, (None, None, ()))
+        for key in keys:
+            position = bisect.bisect_left(self.entries, (key, patient_id))
+            if position < len(self.entries) and self.entries[position] == (key, patient_id):
+                del self.entries[position]
+
+    def put(self, patient_id, dni, first_name, last_name, keys):
+        self.remove(patient_id)
+        self.patients[patient_id] = (dni, full_name(first_name, last_name), list(keys))
+        for key in keys:
+            bisect.insort(self.entries, (key, patient_id))
+
+    def search(self, prefix, limit):
+        matches = {}
+        position = bisect.bisect_left(self.entries, (prefix,))
+        while position < len(self.entries) and len(matches) < limit:
+            key, patient_id = self.entries[position]
+            if not key.startswith(prefix):
+                break
+            matches.setdefault(patient_id, None)
+            position += 1
+        return [(patient_id, *self.patients[patient_id][:2]) for patient_id in matches]
+
+
+def _rows():
+    return PatientLookupKey.objects.values_list(
+        'key', 'patient_id', 'patient__dni', 'patient__first_name', 'patient__last_name'
+    ).iterator(chunk_size=5000)
+
+
+def _generation():
+    return cache.get(GENERATION_KEY, 0)
+
+
+def _bump_generation():
+    try:
+        return cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.add(GENERATION_KEY, time.time_ns(), None)
+        return _generation()
+
+
+class _IndexHolder:
+    """Índice de autocompletado del proceso"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.index = None
+        self.generation = None
+        self.built_at = 0.0
+
+    def invalidate(self):
+        with self.lock:
+            self.index = None
+
+    def get(self):
+        generation = _generation()
+        with self.lock:
+            expired = time.monotonic() - self.built_at > getattr(settings, 'PATIENT_AUTOCOMPLETE_TTL', 300)
+            if self.index is None or expired or generation != self.generation:
+                self.index = PrefixIndex(_rows())
+                self.generation = generation
+                self.built_at = time.monotonic()
+            return self.index
+
+    def apply(self, generation, change):
+        """Aplica `change(index)` si el índice cargado estaba al día con la generación anterior"""
+        with self.lock:
+            if self.index is None:
+                return
+            if self.generation is not None and generation is not None and self.generation + 1 == generation:
+                change(self.index)
+                self.generation = generation
+            else:
+                self.index = None
+
+
+_holder = _IndexHolder()
+
+
+def get_index():
+    return _holder.get()
+
+
+def uses_memory_index():
+    return getattr(settings, 'PATIENT_AUTOCOMPLETE_IN_MEMORY', True) and has_atomic_incr()
+
+
+def _apply_changes(changes):
+    """Una generación nueva por transacción y sus cambios sobre el índice de este proceso (None: recargar)"""
+    generation = _bump_generation()
+    if None in changes:
+        _holder.invalidate()
+        return
+
+    def change_all(index):
+        for change in changes:
+            change(index)
+
+    _holder.apply(generation, change_all)
+
+
+def _publish(change=None):
+    # Al confirmar: antes del commit otro proceso podría recargar su índice sin
+    # el cambio y quedarse con la generación nueva hasta el TTL
+    batching.add(_apply_changes, change)
+
+
+def sync_patient(instance):
+    """Regenera las claves de `instance` (ninguna si está inactivo) y actualiza el índice en memoria"""
+    keys = lookup_keys(instance.dni, instance.last_name) if instance.is_active else set()
+    PatientLookupKey.objects.filter(patient_id=instance.pk).exclude(key__in=keys).delete()
+    PatientLookupKey.objects.bulk_create(
+        [PatientLookupKey(patient_id=instance.pk, key=key) for key in keys], ignore_conflicts=True
+    )
+    if keys:
+        _publish(lambda index: index.put(instance.pk, instance.dni, instance.first_name, instance.last_name, keys))
+    else:
+        _publish(lambda index: index.remove(instance.pk))
+
+
+def add_patients(instances):
+    """Claves de pacientes creados en bloque; los índices en memoria se recargan en la próxima búsqueda"""
+    PatientLookupKey.objects.bulk_create(
+        [
+            PatientLookupKey(patient_id=instance.pk, key=key)
+            for instance in instances if instance.is_active
+            for key in lookup_keys(instance.dni, instance.last_name)
+        ],
+        batch_size=1000, ignore_conflicts=True,
+    )
+    _publish()
+
+
+def remove_patient(patient_id):
+    # Las claves se eliminan en cascada con el paciente
+    _publish(lambda index: index.remove(patient_id))
+
+
+def rebuild():
+    """Regenera todas las claves desde los pacientes activos; retorna la cantidad escrita"""
+    PatientLookupKey.objects.all().delete()
+    rows = [
+        PatientLookupKey(patient_id=patient_id, key=key)
+        for patient_id, dni, last_name in Patient.objects.filter(is_active=True)
+        .values_list('pk', 'dni', 'last_name').iterator(chunk_size=5000)
+        for key in lookup_keys(dni, last_name)
+    ]
+    PatientLookupKey.objects.bulk_create(rows, batch_size=1000)
+    _publish()
+    return len(rows)
+
+
+def search_database(prefix, limit):
+    rows = PatientLookupKey.objects.filter(
+        key__gte=prefix, key__lt=prefix_upper_bound(prefix),
+    ).order_by('key', 'patient_id').values_list(
+        'patient_id', 'patient__dni', 'patient__first_name', 'patient__last_name'
+    )
+    # Un paciente puede coincidir por más de una clave (p. ej. "Pérez Pérez")
+    matches = {}
+    for patient_id, dni, first_name, last_name in rows[:limit * 2]:
+        matches.setdefault(patient_id, (patient_id, dni, full_name(first_name, last_name)))
+        if len(matches) == limit:
+            break
+    return list(matches.values())
+
+
+def suggest(query, limit=DEFAULT_LIMIT):
+    """
+    Pacientes cuyo DNI o apellido empieza con `query`.
+
+    Returns:
+        list: [{'id', 'dni', 'full_name'}] en orden de clave, como máximo `limit`
+    """
+    prefix = normalize_query(query)
+    if not prefix:
+        return []
+    limit = max(1, min(limit, MAX_LIMIT))
+    if uses_memory_index():
+        matches = get_index().search(prefix, limit)
+    else:
+        matches = search_database(prefix, limit)
+    return [
+        {'id': str(patient_id), 'dni': dni, 'full_name': name}
+        for patient_id, dni, name in matches
+    ]
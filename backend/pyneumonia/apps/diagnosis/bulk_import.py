@@ -0,0 +1,204 @@
+"""
+Importación masiva de pacientes (CSV / NDJSON)
+
+Las filas se procesan en lotes de `batch_size` dentro de una transacción:
+    1. Cédulas: limpieza y validación del dígito verificador sobre todo el lote
+       con numpy (mismas reglas y mensajes que validate_ecuadorian_dni).
+    2. Unicidad: una sola consulta dni IN (...) por lote, más los duplicados
+       dentro del mismo archivo.
+    3. Resto de campos: PatientImportSerializer (sin consultas por fila).
+    4. Inserción con bulk_create.
+
+bulk_create no emite post_save, así que al terminar se envía
+`patients_imported` con todas las instancias creadas; los receivers de
+apps.diagnosis.signals actualizan en bloque auditoría (un solo registro con el
+id de la importación), estadísticas, participaciones, series de tiempo,
+sketches y los índices de búsqueda. Las filas inválidas no detienen la
+importación: se informan en el reporte con su número de fila.
+"""
+import csv
+import io
+import json
+import re
+import uuid
+
+import numpy as np
+from django.db import transaction
+from django.dispatch import Signal
+from rest_framework import serializers
+
+from .models import Patient, DNI_ERRORS
+from .serializers import PatientImportSerializer
+
+IMPORT_FORMATS = ('csv', 'ndjson')
+BATCH_SIZE = 1000
+
+# Enviado con instances=[Patient, ...], user=User, import_id=UUID tras insertar una importación
+patients_imported = Signal()
+
+DNI_CLEAN_RE = re.compile(r'[-\s]')
+DNI_COEFFICIENTS = np.array([2, 1, 2, 1, 2, 1, 2, 1, 2], dtype=np.int16)
+
+
+def clean_dni(value):
+    return DNI_CLEAN_RE.sub('', str(value if value is not None else ''))
+
+
+def dni_errors(dnis):
+    """
+    Valida un lote de cédulas ya limpias.
+
+    Returns:
+        dict: {posición en `dnis`: mensaje} de las cédulas inválidas
+    """
+    errors = {}
+    well_formed = []
+    for position, dni in enumerate(dnis):
+        if len(dni) == 10 and dni.isascii() and dni.isdigit():
+            well_formed.append(position)
+        else:
+            errors[position] = DNI_ERRORS['format']
+    if not well_formed:
+        return errors
+
+    digits = np.frombuffer(
+        ''.join(dnis[position] for position in well_formed).encode('ascii'), dtype=np.uint8
+    ).reshape(-1, 10).astype(np.int16) - ord('0')
+    province = digits[:, 0] * 10 + digits[:, 1]
+    products = digits[:, :9] * DNI_COEFFICIENTS
+    products -= 9 * (products >= 10)
+    check_digit = (10 - products.sum(axis=1) % 10) % 10
+
+    checks = (
+        ('province', (province < 1) | (province > 24)),
+        ('third_digit', digits[:, 2] > 6),
+        ('checksum', check_digit != digits[:, 9]),
+    )
+    # Se informa la primera regla que falla, en el mismo orden que el validador por fila
+    for code, failed in checks:
+        for index in np.flatnonzero(failed):
+            errors.setdefault(well_formed[index], DNI_ERRORS[code])
+    return errors
+
+
+def parse_rows(stream, import_format):
+    """
+    Filas de un archivo de texto.
+
+    Yields:
+        tuple: (número de fila, dict de datos o None si la línea no se pudo leer)
+    """
+    if import_format == 'csv':
+        # La fila 1 es el encabezado
+        for number, row in enumerate(csv.DictReader(stream), start=2):
+            yield number, {field: value for field, value in row.items() if field and value not in ('', None)}
+        return
+    for number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield number, row if isinstance(row, dict) else None
+
+
+def open_upload(upload):
+    return io.TextIOWrapper(upload, encoding='utf-8-sig', newline='')
+
+
+def guess_format(filename):
+    return 'ndjson' if filename.lower().endswith(('.ndjson', '.jsonl')) else 'csv'
+
+
+def _batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class PatientImporter:
+    """Valida e inserta filas de pacientes en lotes y acumula el reporte"""
+
+    def __init__(self, user, dry_run=False, batch_size=BATCH_SIZE):
+        self.user = user
+        self.dry_run = dry_run
+        self.batch_size = batch_size
+        self.import_id = uuid.uuid4()
+        self.serializer = PatientImportSerializer()
+        self.seen_dnis = set()
+        self.created = []
+        self.errors = []
+        self.total = 0
+
+    def error(self, number, dni, detail):
+        self.errors.append({'row': number, 'dni': dni, 'errors': detail})
+
+    def validate_batch(self, batch):
+        """Instancias válidas del lote; las filas inválidas se agregan a `errors`"""
+        parsed = [(number, row) for number, row in batch if row is not None]
+        for number, row in batch:
+            if row is None:
+                self.error(number, None, {'non_field_errors': ['Fila ilegible']})
+
+        dnis = [clean_dni(row.get('dni')) for _, row in parsed]
+        invalid = dni_errors(dnis)
+        existing = set(
+            Patient.objects.filter(dni__in={dni for position, dni in enumerate(dnis) if position not in invalid})
+            .values_list('dni', flat=True)
+        )
+
+        instances = []
+        for position, ((number, row), dni) in enumerate(zip(parsed, dnis)):
+            if position in invalid:
+                self.error(number, row.get('dni'), {'dni': [invalid[position]]})
+                continue
+            if dni in existing or dni in self.seen_dnis:
+                self.error(number, row.get('dni'), {'dni': ['Ya existe un paciente con este DNI.']})
+                continue
+            try:
+                data = self.serializer.run_validation({**row, 'dni': dni})
+            except serializers.ValidationError as exc:
+                self.error(number, row.get('dni'), exc.detail)
+                continue
+            self.seen_dnis.add(dni)
+            instances.append(Patient(**data, created_by=self.user))
+        return instances
+
+    def run(self, rows):
+        with transaction.atomic():
+            for batch in _batches(rows, self.batch_size):
+                self.total += len(batch)
+                instances = self.validate_batch(batch)
+                if instances and not self.dry_run:
+                    self.created.extend(Patient.objects.bulk_create(instances))
+            if self.created:
+                patients_imported.send(
+                    sender=Patient, instances=self.created, user=self.user, import_id=self.import_id
+                )
+        return self.report()
+
+    def report(self):
+        return {
+            'import_id': str(self.import_id),
+            'dry_run': self.dry_run,
+            'total': self.total,
+            'created': len(self.created) if not self.dry_run else 0,
+            'valid': self.total - len(self.errors),
+            'errors': self.errors,
+        }
+
+
+def import_patients(rows, user, dry_run=False, batch_size=BATCH_SIZE):
+    """
+    Importa filas (número de fila, datos) de `parse_rows`.
+
+    Returns:
+        dict: Reporte con import_id, total, created, valid y errors [{row, dni, errors}]
+    """
+    return PatientImporter(user, dry_run, batch_size).run(rows)
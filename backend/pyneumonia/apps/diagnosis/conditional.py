@@ -0,0 +1,132 @@
+"""
+GET condicional (ETag) para ViewSets
+
+El validador de una petición es la versión de datos de cada modelo del que
+depende la respuesta (el del queryset más `etag_models`): un contador en la
+caché compartida que cambia al confirmarse cualquier escritura sobre ese
+modelo (ver signals). Comparar If-None-Match no consulta la base de datos, y
+como la versión cubre el modelo entero también cambia por relaciones
+anidadas, anotaciones (p. ej. has_xray) o nombres de usuarios mostrados.
+
+El ETag combina esas versiones con la ruta, el usuario, el tipo de contenido
+y la fecha (hay campos calculados con la fecha, como la edad). Con una caché
+local de cada proceso las versiones no llegarían a los demás workers: el ETag
+se calcula entonces sobre los datos serializados (ahorra transferencia, no
+trabajo del servidor).
+"""
+import hashlib
+import json
+import time
+
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+from apps.core import batching
+from apps.core.cache import is_shared
+
+
+def make_etag(*parts):
+    return quote_etag(hashlib.sha1('|'.join(str(part) for part in parts).encode()).hexdigest())
+
+
+def data_etag(data, *parts):
+    """ETag calculado sobre los datos de una respuesta"""
+    return make_etag(*parts, json.dumps(data, cls=DjangoJSONEncoder, sort_keys=True))
+
+
+def _version_key(model):
+    return f'conditional:version:{model._meta.label_lower}'
+
+
+def data_versions(models):
+    """Versión de datos actual de cada modelo, en orden de etiqueta"""
+    keys = sorted({_version_key(model) for model in models})
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        # Sin versión (primer uso o expulsada de la caché): una nueva, nunca una ya entregada
+        for key in missing:
+            cache.add(key, time.time_ns(), None)
+        versions.update(cache.get_many(missing))
+    return [versions.get(key) for key in keys]
+
+
+def bump_versions(models):
+    """Cambia la versión de datos de `models` al confirmar la transacción en curso"""
+    batching.add(_apply_bumps, *(_version_key(model) for model in models))
+
+
+def _apply_bumps(keys):
+    version = time.time_ns()
+    cache.set_many(dict.fromkeys(set(keys), version), None)
+
+
+def etag_matches(request, etag):
+    """True si el ETag está entre los de If-None-Match (comparación débil)"""
+    header = request.headers.get('If-None-Match')
+    if not header:
+        return False
+    candidates = parse_etags(header)
+    return '*' in candidates or any(candidate.removeprefix('W/') == etag for candidate in candidates)
+
+
+def not_modified(etag, headers=None):
+    return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag, **(headers or {})})
+
+
+class ConditionalGetMixin:
+    """
+    ETag para `list` y `retrieve`.
+
+    Atributos:
+        etag_models: Modelos (además del del queryset) cuyas escrituras cambian la respuesta
+    """
+    etag_models = ()
+
+    def get_validator(self, model):
+        return data_versions({model, *self.etag_models})
+
+    def get_etag(self, request, model, validator):
+        return make_etag(
+            model._meta.label, request.get_full_path(), request.user.pk,
+            request.accepted_media_type, timezone.localdate(), *validator,
+        )
+
+    def _conditional(self, request, model, render):
+        if not is_shared():
+            return self._conditional_on_data(request, render)
+
+        etag = self.get_etag(request, model, self.get_validator(model))
+        if etag_matches(request, etag):
+            return not_modified(etag)
+
+        response = render()
+        if response.status_code == status.HTTP_200_OK:
+            response['ETag'] = etag
+        return response
+
+    def _conditional_on_data(self, request, render):
+        response = render()
+        if response.status_code != status.HTTP_200_OK or not isinstance(response, Response):
+            return response
+        etag = data_etag(response.data, request.accepted_media_type)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+        response['ETag'] = etag
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self._conditional(
+            request, self.get_queryset().model,
+            lambda: super(ConditionalGetMixin, self).list(request, *args, **kwargs),
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._conditional(
+            request, self.get_queryset().model,
+            lambda: super(ConditionalGetMixin, self).retrieve(request, *args, **kwargs),
+        )
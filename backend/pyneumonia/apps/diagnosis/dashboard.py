@@ -0,0 +1,169 @@
+"""
+Construcción del dashboard en dos fases
+
+`plan_dashboard` arma, sin ejecutarlas, las consultas independientes del
+dashboard (un aggregate() por fuente de CounterSet, la distribución reciente y
+las consultas adicionales que pidan las métricas del rol) y una función `render` que compone la
+respuesta con sus resultados. La vista síncrona las ejecuta en serie
+(`run_queries`); la asíncrona las lanza en paralelo (ver apps.diagnosis.async_views).
+"""
+from datetime import timedelta
+from functools import partial
+
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from apps.security.models import User
+from .models import XRayImage, DiagnosisResult, Patient, MedicalReport, MedicalOrder
+from .aggregation import CounterSet
+from .participation import participant_scoped
+from .system_stats import PNEUMONIA_CLASSES
+from .role_metrics import resolve_role, bind_role_metrics
+
+
+def run_queries(queries):
+    """Ejecuta en serie las consultas de un plan: {nombre: resultado}"""
+    return {name: query() for name, query in queries.items()}
+
+
+def plan_dashboard(user, scope_info):
+    """
+    Prepara las consultas del dashboard de `user` según su alcance.
+
+    Returns:
+        tuple: ({nombre: consulta sin argumentos}, render(resultados) -> dict de respuesta)
+    """
+    # Grupo principal del usuario (resuelto junto con el alcance)
+    group_name = scope_info['primary_group']
+
+    # Construir querysets base según scope
+    if scope_info['scope'] == 'all':
+        dr_qs = DiagnosisResult.objects.all()
+        patient_qs = Patient.objects.filter(is_active=True)
+        xray_qs = XRayImage.objects.all()
+        report_qs = MedicalReport.objects.all()
+    else:
+        # Índice de participación: una semi-unión sobre una sola tabla por modelo
+        user_ids = scope_info['user_ids']
+        dr_qs = participant_scoped(DiagnosisResult, user_ids)
+        patient_qs = participant_scoped(Patient, user_ids)
+        xray_qs = participant_scoped(XRayImage, user_ids)
+        report_qs = participant_scoped(MedicalReport, user_ids)
+
+    now = timezone.now()
+    today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    one_week_ago = now - timedelta(days=7)
+    thirty_days_ago = now - timedelta(days=30)
+    pneumonia = Q(predicted_class__in=PNEUMONIA_CLASSES)
+
+    counters = CounterSet()
+    counters.source('diagnoses', dr_qs)
+    counters.source('patients', patient_qs)
+    counters.source('xrays', xray_qs)
+    counters.source('reports', report_qs)
+    counters.source('orders', MedicalOrder.objects.all())
+    counters.source('users', User.objects.all())
+
+    # ==================== ESTADÍSTICAS GENERALES ====================
+    counters.count('diagnoses', 'total')
+    counters.count('diagnoses', 'pending_reviews', Q(is_reviewed=False))
+    counters.count('diagnoses', 'pneumonia', pneumonia)
+    counters.count('patients', 'total')
+    counters.count('xrays', 'total')
+    counters.count('xrays', 'pending_analysis', Q(is_analyzed=False))
+    counters.count('reports', 'total')
+    counters.count('reports', 'draft', Q(status='draft'))
+
+    # ==================== ACTIVIDAD RECIENTE ====================
+    counters.count('patients', 'new_week', Q(created_at__gte=one_week_ago))
+    counters.count('xrays', 'new_week', Q(uploaded_at__gte=one_week_ago))
+    counters.count('diagnoses', 'new_week', Q(created_at__gte=one_week_ago))
+    counters.count('reports', 'new_week', Q(created_at__gte=one_week_ago))
+
+    # ==================== CASOS PRIORITARIOS ====================
+    counters.count('diagnoses', 'high_priority', pneumonia & Q(confidence__gte=0.7) & Q(radiologist_review__isnull=True))
+
+    # ==================== MÉTRICAS ESPECÍFICAS POR GRUPO ====================
+    # Declaradas por rol en apps.diagnosis.role_metrics; comparten el aggregate() de su fuente
+    role = resolve_role(user, scope_info)
+    role_queries, render_role_metrics = bind_role_metrics(role, counters, {
+        'user': user,
+        'today_start': today_start,
+        'one_week_ago': one_week_ago,
+        'thirty_days_ago': thirty_days_ago,
+    })
+
+    # ==================== CONSULTAS INDEPENDIENTES ====================
+    queries = {
+        name: partial(CounterSet.evaluate_group, queryset, metrics)
+        for name, queryset, metrics in counters.groups()
+    }
+    # Distribución de diagnósticos recientes
+    queries['recent_diagnoses'] = lambda: list(
+        dr_qs.filter(created_at__gte=thirty_days_ago).values('predicted_class').annotate(
+            count=Count('id')
+        ).order_by('-count')
+    )
+    queries.update(role_queries)
+
+    def render(results):
+        diagnoses, patients = results['diagnoses'], results['patients']
+        xrays, reports = results['xrays'], results['reports']
+
+        total_diagnoses = diagnoses['total']
+        pneumonia_cases = diagnoses['pneumonia']
+        pending_reviews = diagnoses['pending_reviews']
+        pending_analysis = xrays['pending_analysis']
+
+        group_metrics = render_role_metrics(results)
+
+        # ==================== RESPUESTA FINAL ====================
+        return {
+            'scope': scope_info['scope'],
+            'user_group': group_name,
+            'user_role': 'admin' if user.is_superuser else 'staff' if user.is_staff else 'user',
+            'user_info': {
+                'username': user.username,
+                'full_name': user.get_full_name,
+                'email': user.email,
+            },
+
+            # Resumen general
+            'summary': {
+                'total_diagnoses': total_diagnoses,
+                'total_patients': patients['total'],
+                'total_xrays': xrays['total'],
+                'total_reports': reports['total'],
+            },
+
+            # Tareas pendientes
+            'pending_tasks': {
+                'pending_reviews': pending_reviews,
+                'pending_analysis': pending_analysis,
+                'draft_reports': reports['draft'],
+                'high_priority_cases': diagnoses['high_priority'],
+            },
+
+            # Estadísticas de enfermedades
+            'disease_stats': {
+                'pneumonia_cases': pneumonia_cases,
+                'normal_cases': total_diagnoses - pneumonia_cases,
+                'pneumonia_rate': round((pneumonia_cases / total_diagnoses * 100) if total_diagnoses > 0 else 0, 2),
+            },
+
+            # Actividad reciente
+            'recent_activity': {
+                'new_patients': patients['new_week'],
+                'new_xrays': xrays['new_week'],
+                'new_diagnoses': diagnoses['new_week'],
+                'new_reports': reports['new_week'],
+            },
+
+            # Distribución de diagnósticos recientes
+            'recent_diagnoses_distribution': results['recent_diagnoses'],
+
+            # Métricas específicas del grupo
+            'group_specific_metrics': group_metrics,
+        }
+
+    return queries, render
@@ -0,0 +1,131 @@
+"""
+Agregación demográfica de pacientes en una sola consulta
+
+Agrupa los pacientes por rango de edad (CASE sobre la fecha de nacimiento),
+género, estado activo y banderas de radiografía/diagnóstico (EXISTS). El
+resultado es un cubo pequeño (a lo sumo rangos × géneros × 8 filas) con el
+conteo de pacientes y de radiografías, del que se derivan todos los totales
+en memoria. También puede exportarse a CSV.
+"""
+import csv
+import io
+from datetime import date
+
+from django.conf import settings
+from django.db.models import Case, Count, Exists, IntegerField, OuterRef, Subquery, Sum, Value, When, CharField
+from django.db.models.functions import Coalesce
+
+from .models import XRayImage, DiagnosisResult
+
+# (etiqueta, edad mínima en años cumplidos); cada rango llega hasta la edad mínima del siguiente.
+# Son los cortes históricos de las estadísticas publicadas: con 18 años cumplidos
+# se cuenta en '19-35', con 35 en '36-50', con 50 en '51-65' y con 65 en '65+'
+DEFAULT_AGE_BUCKETS = (
+    ('0-18', 0),
+    ('19-35', 18),
+    ('36-50', 35),
+    ('51-65', 50),
+    ('65+', 65),
+)
+
+CUBE_FIELDS = ('age_range', 'gender', 'is_active', 'has_xrays', 'has_diagnoses', 'patients', 'xrays')
+
+
+def get_age_buckets():
+    return getattr(settings, 'PATIENT_AGE_BUCKETS', DEFAULT_AGE_BUCKETS)
+
+
+def years_before(day, years):
+    """
+    Misma fecha `years` años antes; el 29 de febrero pasa al 28 en años no bisiestos.
+
+    Es coherente con Patient.age: quien nació un 29 de febrero cumple años el
+    1 de marzo en años no bisiestos.
+    """
+    try:
+        return day.replace(year=day.year - years)
+    except ValueError:
+        return day.replace(year=day.year - years, day=28)
+
+
+def age_range_expression(buckets=None, today=None):
+    """CASE que asigna la etiqueta del rango de edad según date_of_birth"""
+    buckets = buckets or get_age_buckets()
+    today = today or date.today()
+    # Edad >= N  <=>  date_of_birth <= hoy menos N años; se evalúa del rango mayor al menor
+    whens = [
+        When(date_of_birth__lte=years_before(today, min_age), then=Value(label))
+        for label, min_age in sorted(buckets, key=lambda bucket: bucket[1], reverse=True)
+        if min_age > 0
+    ]
+    youngest = min(buckets, key=lambda bucket: bucket[1])[0]
+    return Case(*whens, default=Value(youngest), output_field=CharField())
+
+
+def demographic_cube(queryset, buckets=None, today=None):
+    """
+    Filas agrupadas por (age_range, gender, is_active, has_xrays, has_diagnoses).
+
+    Args:
+        queryset: Pacientes a considerar (ya filtrados por alcance)
+        buckets: Rangos de edad [(etiqueta, edad mínima), ...]
+        today: Fecha de referencia para calcular edades
+
+    Returns:
+        list[dict]: Una fila por combinación con 'patients' y 'xrays'
+    """
+    xray_count = XRayImage.objects.filter(patient=OuterRef('pk')).order_by().values('patient').annotate(
+        total=Count('pk')
+    ).values('total')
+    rows = queryset.order_by().annotate(
+        age_range=age_range_expression(buckets, today),
+        has_xrays=Exists(XRayImage.objects.filter(patient=OuterRef('pk'))),
+        has_diagnoses=Exists(DiagnosisResult.objects.filter(xray__patient=OuterRef('pk'))),
+        xray_count=Coalesce(Subquery(xray_count, output_field=IntegerField()), 0),
+    ).values('age_range', 'gender', 'is_active', 'has_xrays', 'has_diagnoses').annotate(
+        patients=Count('pk'), xrays=Sum('xray_count'),
+    )
+    return [{**row, 'xrays': row['xrays'] or 0} for row in rows]
+
+
+def summarize(cube, buckets=None):
+    """Totales derivados del cubo, con el formato de patient_statistics_view"""
+    buckets = buckets or get_age_buckets()
+    age_distribution = {label: 0 for label, _ in buckets}
+    by_gender = {}
+    totals = {'total': 0, 'active': 0, 'with_xrays': 0, 'with_diagnoses': 0, 'xrays': 0}
+
+    for row in cube:
+        count = row['patients']
+        totals['total'] += count
+        totals['active'] += count if row['is_active'] else 0
+        totals['with_xrays'] += count if row['has_xrays'] else 0
+        totals['with_diagnoses'] += count if row['has_diagnoses'] else 0
+        totals['xrays'] += row['xrays']
+        age_distribution[row['age_range']] = age_distribution.get(row['age_range'], 0) + count
+        by_gender[row['gender']] = by_gender.get(row['gender'], 0) + count
+
+    return {
+        'total_patients': totals['total'],
+        'active_patients': totals['active'],
+        'inactive_patients': totals['total'] - totals['active'],
+        'by_gender': [
+            {'gender': gender, 'count': count}
+            for gender, count in sorted(by_gender.items(), key=lambda item: item[1], reverse=True)
+        ],
+        'age_distribution': age_distribution,
+        'patients_with_xrays': totals['with_xrays'],
+        'patients_with_diagnoses': totals['with_diagnoses'],
+        'avg_xrays_per_patient': round(totals['xrays'] / totals['total'], 2) if totals['total'] else 0,
+        'total_xrays': totals['xrays'],
+    }
+
+
+def cube_to_csv(cube):
+    """Exporta el cubo demográfico como CSV (una fila por combinación)"""
+    output = io.StringIO()
+    writer = csv.DictWriter(output, fieldnames=CUBE_FIELDS)
+    writer.writeheader()
+    for row in cube:
+        writer.writerow({field: row[field] for field in CUBE_FIELDS})
+    return output.getvalue()
@@ -0,0 +1,460 @@
+"""
+Embeddings de radiografías e índice vectorial para búsqueda de casos similares
+
+- Extractor de características en CPU (NumPy + Pillow), procesado por lotes
+- Vectores de longitud fija almacenados como float16 en XRayImage.embedding
+- Índice de fuerza bruta para conjuntos pequeños e IVF-PQ para conjuntos grandes
+"""
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_DIM = 128
+EMBEDDING_DTYPE = np.float16
+IMAGE_SIZE = 128
+
+# Por debajo de este número de casos se usa búsqueda exacta en memoria
+BRUTE_FORCE_MAX_VECTORS = getattr(settings, 'SIMILARITY_BRUTE_FORCE_MAX', 50_000)
+INDEX_TTL_SECONDS = getattr(settings, 'SIMILARITY_INDEX_TTL', 300)
+# Candidatos aproximados por resultado que se reordenan con distancia exacta
+REFINE_FACTOR = 10
+# Celdas (filas x centroides) de cada bloque de distancias: ~16 MB en float32
+DISTANCE_BLOCK_CELLS = 4_000_000
+
+
+# ==================== EXTRACCIÓN DE CARACTERÍSTICAS ====================
+
+def _load_grayscale(path):
+    """Carga la imagen en escala de grises, redimensionada a IMAGE_SIZE x IMAGE_SIZE"""
+    with Image.open(path) as img:
+        img = img.convert('L').resize((IMAGE_SIZE, IMAGE_SIZE), Image.BILINEAR)
+        return np.asarray(img, dtype=np.float32) / 255.0
+
+
+def _unit_rows(matrix):
+    """Normaliza cada fila a norma L2 unitaria"""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+def _batch_features(batch):
+    """
+    Calcula los embeddings de un lote de imágenes (B, IMAGE_SIZE, IMAGE_SIZE).
+
+    Bloques (128 dimensiones):
+        - miniatura 8x8 centrada (64): distribución espacial de opacidades
+        - histograma de intensidades (32)
+        - energía de gradiente en rejilla 4x4 (16)
+        - histograma de orientaciones ponderado por magnitud (16)
+    """
+    size = batch.shape[0]
+    offsets = np.arange(size)[:, None]
+
+    thumb = batch.reshape(size, 8, IMAGE_SIZE // 8, 8, IMAGE_SIZE // 8).mean(axis=(2, 4)).reshape(size, 64)
+    thumb = thumb - thumb.mean(axis=1, keepdims=True)
+
+    bins = np.minimum((batch * 32).astype(np.int64), 31).reshape(size, -1)
+    hist = np.bincount((bins + offsets * 32).ravel(), minlength=size * 32).reshape(size, 32)
+    hist = np.sqrt(hist / float(IMAGE_SIZE * IMAGE_SIZE))
+
+    grad_y, grad_x = np.gradient(batch, axis=(1, 2))
+    magnitude = np.hypot(grad_x, grad_y)
+    energy = magnitude.reshape(size, 4, IMAGE_SIZE // 4, 4, IMAGE_SIZE // 4).mean(axis=(2, 4)).reshape(size, 16)
+
+    angles = np.mod(np.arctan2(grad_y, grad_x), np.pi)
+    angle_bins = np.minimum((angles / np.pi * 16).astype(np.int64), 15).reshape(size, -1)
+    orientation = np.bincount(
+        (angle_bins + offsets * 16).ravel(),
+        weights=magnitude.reshape(size, -1).ravel(),
+        minlength=size * 16,
+    ).reshape(size, 16)
+
+    blocks = [_unit_rows(block) for block in (thumb, hist, energy, orientation)]
+    return _unit_rows(np.hstack(blocks)).astype(np.float32)
+
+
+def extract_embeddings(paths, batch_size=32):
+    """
+    Calcula embeddings para una lista de rutas de imagen, por lotes.
+
+    Returns:
+        list: un np.ndarray (EMBEDDING_DIM,) por ruta, o None si la imagen no pudo leerse
+    """
+    results = [None] * len(paths)
+    for start in range(0, len(paths), batch_size):
+        images, positions = [], []
+        for position in range(start, min(start + batch_size, len(paths))):
+            try:
+                images.append(_load_grayscale(paths[position]))
+                positions.append(position)
+            except Exception as e:
+                logger.warning(f"No se pudo leer la imagen {paths[position]}: {str(e)}")
+        if not images:
+            continue
+        features = _batch_features(np.stack(images))
+        for position, vector in zip(positions, features):
+            results[position] = vector
+    return results
+
+
+def compute_embedding(path):
+    """Embedding de una sola imagen (o None si no pudo leerse)"""
+    return extract_embeddings([path], batch_size=1)[0]
+
+
+def encode_embedding(vector):
+    """Serializa un embedding al formato binario compacto (float16)"""
+    return np.asarray(vector, dtype=EMBEDDING_DTYPE).tobytes()
+
+
+def decode_embeddings(blobs):
+    """Convierte una secuencia de blobs en una matriz (N, EMBEDDING_DIM) float32"""
+    if not blobs:
+        return np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+    data = np.frombuffer(b''.join(bytes(blob) for blob in blobs), dtype=EMBEDDING_DTYPE)
+    return data.reshape(-1, EMBEDDING_DIM).astype(np.float32)
+
+
+# ==================== ÍNDICES VECTORIALES ====================
+
+def _squared_distances(data, centroids):
+    """Distancias euclídeas al cuadrado entre filas de data y centroids"""
+    return (
+        (data * data).sum(axis=1)[:, None]
+        - 2.0 * data @ centroids.T
+        + (centroids * centroids).sum(axis=1)[None, :]
+    )
+
+
+def _nearest(data, centroids, chunk_size=None):
+    """Índice del centroide más cercano para cada fila, por bloques para acotar memoria"""
+    if chunk_size is None:
+        chunk_size = max(1, DISTANCE_BLOCK_CELLS // max(1, len(centroids)))
+    labels = np.empty(len(data), dtype=np.int64)
+    for start in range(0, len(data), chunk_size):
+        chunk = data[start:start + chunk_size]
+        labels[start:start + chunk_size] = _squared_distances(chunk, centroids).argmin(axis=1)
+    return labels
+
+
+def _kmeans(data, k, iterations, rng):
+    """K-means de Lloyd simple; los clusters vacíos se reinicializan con puntos aleatorios"""
+    centroids = data[rng.choice(len(data), size=k, replace=len(data) < k)].copy()
+    for _ in range(iterations):
+        labels = _nearest(data, centroids)
+        counts = np.bincount(labels, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, data)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        if empty.any():
+            centroids[empty] = data[rng.choice(len(data), size=int(empty.sum()))]
+    return centroids
+
+
+class BruteForceIndex:
+    """Búsqueda exacta por similitud coseno (producto punto sobre vectores unitarios)"""
+
+    kind = 'brute_force'
+
+    def __init__(self, ids, vectors):
+        self.ids = np.asarray(ids)
+        self.vectors = _unit_rows(np.asarray(vectors, dtype=np.float32))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def search(self, query, k=10):
+        """Retorna [(id, similitud)] de los k vecinos más cercanos"""
+        if not len(self.ids):
+            return []
+        query = _unit_rows(np.asarray(query, dtype=np.float32).reshape(1, -1))[0]
+        scores = self.vectors @ query
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.ids[i], float(scores[i])) for i in top]
+
+
+class IVFPQIndex:
+    """
+    Índice IVF con cuantización por producto (IVF-PQ).
+
+    - Cuantizador grueso de n_lists centroides (listas invertidas)
+    - Residuos codificados con n_subvectors códigos de 8 bits
+    - Búsqueda: se exploran n_probe listas con tablas de distancia asimétrica (ADC)
+    """
+
+    kind = 'ivf_pq'
+
+    def __init__(self, n_lists, n_subvectors=16, n_probe=16):
+        if EMBEDDING_DIM % n_subvectors:
+            raise ValueError('EMBEDDING_DIM debe ser múltiplo de n_subvectors')
+        self.n_lists = n_lists
+        self.n_subvectors = n_subvectors
+        self.sub_dim = EMBEDDING_DIM // n_subvectors
+        self.n_probe = n_probe
+        self.coarse = None
+        self.codebooks = None
+        self.ids = np.zeros(0, dtype='<U36')
+        self.codes = np.zeros((0, n_subvectors), dtype=np.uint8)
+        self.list_offsets = np.zeros(n_lists + 1, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def train(self, vectors, sample_size=100_000, iterations=15, seed=0):
+        """Entrena el cuantizador grueso y los codebooks sobre una muestra"""
+        rng = np.random.default_rng(seed)
+        vectors = _unit_rows(np.asarray(vectors, dtype=np.float32))
+        if len(vectors) > sample_size:
+            vectors = vectors[rng.choice(len(vectors), size=sample_size, replace=False)]
+        self.coarse = _kmeans(vectors, self.n_lists, iterations, rng)
+        residuals = vectors - self.coarse[_nearest(vectors, self.coarse)]
+        self.codebooks = np.stack([
+            _kmeans(residuals[:, m * self.sub_dim:(m + 1) * self.sub_dim], 256, iterations, rng)
+            for m in range(self.n_subvectors)
+        ])
+        return self
+
+    def add(self, ids, vectors):
+        """Codifica y agrega todos los vectores (reemplaza el contenido actual)"""
+        vectors = _unit_rows(np.asarray(vectors, dtype=np.float32))
+        lists = _nearest(vectors, self.coarse)
+        residuals = vectors - self.coarse[lists]
+        codes = np.empty((len(vectors), self.n_subvectors), dtype=np.uint8)
+        for m in range(self.n_subvectors):
+            sub = residuals[:, m * self.sub_dim:(m + 1) * self.sub_dim]
+            codes[:, m] = _nearest(sub, self.codebooks[m])
+        order = np.argsort(lists, kind='stable')
+        self.ids = np.asarray(ids).astype('<U36')[order]
+        self.codes = codes[order]
+        self.list_offsets = np.concatenate(([0], np.cumsum(np.bincount(lists, minlength=self.n_lists))))
+        return self
+
+    def search(self, query, k=10):
+        """Retorna [(id, similitud aproximada)] de los k vecinos más cercanos"""
+        if not len(self.ids):
+            return []
+        query = _unit_rows(np.asarray(query, dtype=np.float32).reshape(1, -1))[0]
+        coarse_scores = self.coarse @ query
+        probes = np.argsort(-coarse_scores)[:self.n_probe]
+
+        candidate_ids, candidate_dist = [], []
+        for list_id in probes:
+            start, end = self.list_offsets[list_id], self.list_offsets[list_id + 1]
+            if start == end:
+                continue
+            residual = (query - self.coarse[list_id]).reshape(self.n_subvectors, 1, self.sub_dim)
+            tables = ((self.codebooks - residual) ** 2).sum(axis=2)  # (M, 256)
+            codes = self.codes[start:end]
+            distances = tables[np.arange(self.n_subvectors), codes].sum(axis=1)
+            candidate_ids.append(self.ids[start:end])
+            candidate_dist.append(distances)
+
+        if not candidate_ids:
+            return []
+        ids = np.concatenate(candidate_ids)
+        distances = np.concatenate(candidate_dist)
+        k = min(k, len(distances))
+        top = np.argpartition(distances, k - 1)[:k]
+        top = top[np.argsort(distances[top])]
+        # Para vectores unitarios: ||q - x||² = 2 - 2·cos
+        return [(ids[i], float(1.0 - distances[i] / 2.0)) for i in top]
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as fh:
+            np.savez(
+                fh, coarse=self.coarse, codebooks=self.codebooks, ids=self.ids,
+                codes=self.codes, list_offsets=self.list_offsets,
+                params=np.array([self.n_lists, self.n_subvectors, self.n_probe]),
+            )
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path, allow_pickle=False)
+        n_lists, n_subvectors, n_probe = (int(v) for v in data['params'])
+        index = cls(n_lists, n_subvectors=n_subvectors, n_probe=n_probe)
+        index.coarse = data['coarse']
+        index.codebooks = data['codebooks']
+        index.ids = data['ids']
+        index.codes = data['codes']
+        index.list_offsets = data['list_offsets']
+        return index
+
+
+class ExtendedIndex:
+    """
+    Índice IVF-PQ precalculado más los casos revisados después de construirlo.
+
+    Los casos nuevos se buscan de forma exacta y sus candidatos se suman a la
+    lista corta del IVF-PQ, que luego se reordena igual (find_similar_cases).
+    """
+
+    kind = IVFPQIndex.kind
+
+    def __init__(self, base, extra):
+        self.base = base
+        self.extra = extra
+
+    def __len__(self):
+        return len(self.base) + len(self.extra)
+
+    def search(self, query, k=10):
+        return self.base.search(query, k=k) + self.extra.search(query, k=k)
+
+
+def build_index(ids, vectors):
+    """Construye el índice adecuado según el tamaño del conjunto"""
+    if len(ids) <= BRUTE_FORCE_MAX_VECTORS:
+        return BruteForceIndex(ids, vectors)
+    n_lists = int(4 * np.sqrt(len(ids)))
+    return IVFPQIndex(n_lists).train(vectors).add(ids, vectors)
+
+
+# ==================== ÍNDICE DE CASOS REVISADOS ====================
+
+def index_path():
+    return getattr(
+        settings, 'SIMILARITY_INDEX_PATH',
+        os.path.join(settings.BASE_DIR, 'var', 'similarity_index.npz')
+    )
+
+
+def reviewed_embeddings_queryset():
+    """Casos confirmados por radiólogo cuya radiografía ya tiene embedding"""
+    from .models import DiagnosisResult
+    return DiagnosisResult.objects.filter(
+        radiologist_review__isnull=False,
+        status='completed',
+        xray__embedding__isnull=False,
+    )
+
+
+def load_reviewed_vectors():
+    """Lee (ids, matriz de embeddings) de los casos revisados"""
+    rows = list(reviewed_embeddings_queryset().values_list('id', 'xray__embedding'))
+    ids = [str(row[0]) for row in rows]
+    return ids, decode_embeddings([row[1] for row in rows])
+
+
+def load_unindexed_vectors(indexed_ids, chunk_size=1000):
+    """Lee (ids, matriz de embeddings) de los casos revisados que no están en `indexed_ids`"""
+    reviewed = np.array([str(pk) for pk in reviewed_embeddings_queryset().values_list('id', flat=True)])
+    missing = reviewed[~np.isin(reviewed, indexed_ids)].tolist() if len(reviewed) else []
+    ids, blobs = [], []
+    for start in range(0, len(missing), chunk_size):
+        rows = reviewed_embeddings_queryset().filter(
+            id__in=missing[start:start + chunk_size]
+        ).values_list('id', 'xray__embedding')
+        for case_id, blob in rows:
+            ids.append(str(case_id))
+            blobs.append(blob)
+    return ids, decode_embeddings(blobs)
+
+
+class _IndexHolder:
+    """
+    Caché por proceso del índice de casos revisados.
+
+    Con un IVF-PQ precalculado en disco, invalidar solo vuelve a leer los casos
+    revisados que no están en el archivo; el archivo se recarga cuando cambia.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.index = None
+        self.base = None
+        self.built_at = 0.0
+        self.source_mtime = None
+
+    def invalidate(self):
+        with self.lock:
+            self.index = None
+
+    def get(self):
+        with self.lock:
+            path = index_path()
+            file_mtime = os.path.getmtime(path) if os.path.exists(path) else None
+            expired = time.monotonic() - self.built_at > INDEX_TTL_SECONDS
+            if self.index is not None and not expired and file_mtime == self.source_mtime:
+                return self.index
+
+            if file_mtime is not None:
+                # Índice IVF-PQ precalculado con `manage.py build_similarity_index`
+                if self.base is None or file_mtime != self.source_mtime:
+                    self.base = IVFPQIndex.load(path)
+                ids, vectors = load_unindexed_vectors(self.base.ids)
+                if len(ids) > BRUTE_FORCE_MAX_VECTORS:
+                    logger.warning(
+                        "%s casos revisados fuera del índice precalculado; "
+                        "ejecute build_similarity_index para incorporarlos", len(ids)
+                    )
+                self.index = ExtendedIndex(self.base, BruteForceIndex(ids, vectors))
+            else:
+                self.base = None
+                ids, vectors = load_reviewed_vectors()
+                if len(ids) > BRUTE_FORCE_MAX_VECTORS:
+                    logger.warning(
+                        "Índice de similitud construido en línea sobre %s vectores; "
+                        "ejecute build_similarity_index para precalcularlo", len(ids)
+                    )
+                self.index = build_index(ids, vectors)
+            self.source_mtime = file_mtime
+            self.built_at = time.monotonic()
+            return self.index
+
+
+_holder = _IndexHolder()
+
+
+def get_similarity_index():
+    return _holder.get()
+
+
+def invalidate_similarity_index():
+    _holder.invalidate()
+
+
+def rerank_exact(query_vector, candidate_ids):
+    """Reordena candidatos con similitud exacta leyendo sus embeddings en una sola consulta"""
+    rows = list(
+        reviewed_embeddings_queryset()
+        .filter(id__in=candidate_ids)
+        .values_list('id', 'xray__embedding')
+    )
+    if not rows:
+        return []
+    exact = BruteForceIndex([str(row[0]) for row in rows], decode_embeddings([row[1] for row in rows]))
+    return exact.search(query_vector, k=len(rows))
+
+
+def find_similar_cases(query_vector, k=10, exclude_id=None):
+    """
+    Busca los k casos revisados más parecidos al vector dado.
+
+    Con IVF-PQ se recupera una lista corta aproximada (REFINE_FACTOR·k), más los
+    casos revisados después de precalcular el índice, que luego se reordena con
+    los embeddings exactos.
+
+    Returns:
+        list: [(diagnosis_id, similitud)] ordenado de mayor a menor similitud
+    """
+    index = get_similarity_index()
+    if index.kind == IVFPQIndex.kind:
+        shortlist = index.search(query_vector, k=(k + 1) * REFINE_FACTOR)
+        results = rerank_exact(query_vector, [str(case_id) for case_id, _ in shortlist])
+    else:
+        results = index.search(query_vector, k=k + 1)
+    results = [(str(case_id), score) for case_id, score in results]
+    if exclude_id is not None:
+        results = [(i, s) for i, s in results if i != str(exclude_id)]
+    return results[:k]
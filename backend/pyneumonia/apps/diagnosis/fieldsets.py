@@ -0,0 +1,124 @@
+"""
+Subconjuntos de campos (?fields=) y expansión (?expand=) en lecturas
+
+Sin parámetros la respuesta es la completa. Con `?fields=id,status,...` solo se
+serializan esos campos (el `id` siempre se incluye); los objetos anidados
+costosos (`expandable_fields`) se agregan con `?expand=xray_details,...`
+(o nombrándolos en `fields`).
+
+El mismo subconjunto decide qué carga el queryset (`load_plan`): solo las
+relaciones que leen los campos pedidos van a select_related() y solo sus
+columnas a only(). Los campos calculados declaran en `field_sources` las rutas
+ORM que leen; si un campo pedido no se puede resolver se carga todo, como sin
+subconjunto.
+"""
+from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+
+ALWAYS_INCLUDED = ('id',)
+
+
+def parse_field_list(value):
+    return {name.strip() for name in value.split(',') if name.strip()}
+
+
+def requested_fields(request, expandable=None):
+    """
+    Campos pedidos en la URL de una lectura.
+
+    Returns:
+        set | None: Nombres de campos, o None si se pidió la respuesta completa
+    """
+    if request is None or request.method not in SAFE_METHODS or 'fields' not in request.query_params:
+        return None
+    selected = parse_field_list(request.query_params['fields'])
+    expand = parse_field_list(request.query_params.get('expand', ''))
+    if expandable is not None:
+        expand &= set(expandable)
+    return selected | expand | set(ALWAYS_INCLUDED)
+
+
+class SparseFieldsetMixin:
+    """
+    Serializer que respeta ?fields= y ?expand= en lecturas.
+
+    Atributos:
+        expandable_fields: Campos anidados que se pueden pedir con ?expand=
+        field_sources: {campo calculado: rutas ORM (con __) que lee}
+    """
+    expandable_fields = ()
+    field_sources = {}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        selected = requested_fields(self.context.get('request'), self.expandable_fields)
+        if selected is not None:
+            for name in set(self.fields) - selected:
+                self.fields.pop(name)
+
+
+def _walk(model, path):
+    """
+    Recorre `path` (con __) desde `model`.
+
+    Returns:
+        tuple: (prefijos de relaciones directas atravesadas, campo final) o None si la ruta
+        pasa por relaciones inversas o muchos-a-muchos
+    """
+    relations = []
+    parts = path.split('__')
+    for index, part in enumerate(parts):
+        try:
+            field = model._meta.get_field(part)
+        except Exception:
+            return None
+        last = index == len(parts) - 1
+        if field.is_relation:
+            if field.many_to_many or field.one_to_many or not field.concrete:
+                return None
+            if not last:
+                relations.append('__'.join(parts[:index + 1]))
+                model = field.related_model
+        elif not last:
+            return None
+    return relations, field
+
+
+def load_plan(serializer_class, model, selected):
+    """
+    Relaciones y columnas que necesita el subconjunto `selected` de `serializer_class`.
+
+    Returns:
+        dict | None: {'select_related': set, 'full_relations': set, 'only': set}, o None
+        si algún campo pedido no se puede resolver (se carga todo)
+    """
+    fields = serializer_class().fields
+    relations, full_relations, columns = set(), set(), {model._meta.pk.name}
+    for name in selected:
+        field = fields.get(name)
+        if field is None or field.write_only:
+            continue
+        if name in serializer_class.field_sources:
+            paths = serializer_class.field_sources[name]
+        elif field.source == '*':
+            return None
+        else:
+            paths = (field.source.replace('.', '__'),)
+
+        for path in paths:
+            walked = _walk(model, path)
+            if walked is None:
+                return None
+            path_relations, final = walked
+            relations.update(path_relations)
+            columns.add(path)
+            # Serializer anidado sobre una relación: se carga la fila relacionada completa
+            if isinstance(field, serializers.BaseSerializer) and final.is_relation:
+                relations.add(path)
+                full_relations.add(path)
+
+    columns = {
+        column for column in columns
+        if not any(column.startswith(f'{relation}__') for relation in full_relations)
+    }
+    return {'select_related': relations, 'full_relations': full_relations, 'only': columns}
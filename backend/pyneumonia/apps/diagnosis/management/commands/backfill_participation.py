@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from apps.diagnosis.participation import backfill
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye el índice de participación (usuario-entidad-rol) desde las tablas de origen'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000, help='Filas por inserción en bloque')
+
+    def handle(self, *args, **options):
+        total = backfill(batch_size=options['batch_size'], stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(f'✓ Participaciones generadas: {total}'))
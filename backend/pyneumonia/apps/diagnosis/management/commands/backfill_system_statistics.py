@@ -0,0 +1,36 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from apps.diagnosis.system_stats import backfill_range
+
+
+def parse_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise CommandError(f'Fecha inválida: {value}. Use YYYY-MM-DD')
+
+
+class Command(BaseCommand):
+    help = 'Genera el historial de estadísticas del sistema para un rango de fechas (consultas agrupadas por día)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='start', required=True, help='Primer día (YYYY-MM-DD)')
+        parser.add_argument('--to', dest='end', help='Último día (YYYY-MM-DD); por defecto hoy')
+        parser.add_argument('--workers', type=int, default=4, help='Bloques consultados en paralelo')
+        parser.add_argument('--chunk-days', type=int, default=31, help='Días por bloque')
+
+    def handle(self, *args, **options):
+        start = parse_date(options['start'])
+        end = parse_date(options['end']) if options['end'] else timezone.localdate()
+        if start > end:
+            raise CommandError('--from debe ser anterior o igual a --to')
+        if options['workers'] < 1 or options['chunk_days'] < 1:
+            raise CommandError('--workers y --chunk-days deben ser mayores o iguales a 1')
+
+        written = backfill_range(
+            start, end, workers=options['workers'], chunk_days=options['chunk_days'], stdout=self.stdout
+        )
+        self.stdout.write(self.style.SUCCESS(f'✓ Días generados: {written}'))
@@ -0,0 +1,74 @@
+import asyncio
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, Client, override_settings
+from django.urls import reverse
+
+from apps.security.models import User
+
+
+def summarize(latencies):
+    ordered = sorted(latencies)
+    p95 = ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))]
+    return f'p50 {statistics.median(ordered) * 1000:.1f} ms · p95 {p95 * 1000:.1f} ms · máx {ordered[-1] * 1000:.1f} ms'
+
+
+class Command(BaseCommand):
+    help = 'Compara la latencia del dashboard síncrono con la variante asíncrona (consultas concurrentes)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', required=True, help='Usuario con el que se consulta el dashboard')
+        parser.add_argument('--requests', type=int, default=50, help='Peticiones por variante')
+        parser.add_argument('--concurrency', type=int, default=1, help='Peticiones asíncronas simultáneas')
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(username=options['user']).first()
+        if user is None:
+            raise CommandError(f"Usuario no encontrado: {options['user']}")
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--requests y --concurrency deben ser mayores o iguales a 1')
+
+        # Sin caché de respuestas se mide el cálculo en frío en ambas variantes
+        with override_settings(STATS_CACHE_ENABLED=False):
+            sync_latencies = self.run_sync(user, options['requests'])
+            async_latencies = asyncio.run(self.run_async(user, options['requests'], options['concurrency']))
+
+        self.stdout.write(f"Síncrono  ({options['requests']} peticiones): {summarize(sync_latencies)}")
+        self.stdout.write(
+            f"Asíncrono ({options['requests']} peticiones, {options['concurrency']} simultáneas): "
+            f'{summarize(async_latencies)}'
+        )
+        speedup = statistics.median(sync_latencies) / statistics.median(async_latencies)
+        self.stdout.write(self.style.SUCCESS(f'✓ Mediana síncrona / asíncrona: {speedup:.2f}x'))
+
+    def run_sync(self, user, total):
+        client = Client()
+        client.force_login(user)
+        url = reverse('diagnosis:dashboard-overview')
+        latencies = []
+        for _ in range(total):
+            started = time.perf_counter()
+            response = client.get(url)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                raise CommandError(f'Respuesta síncrona inesperada: {response.status_code}')
+        return latencies
+
+    async def run_async(self, user, total, concurrency):
+        client = AsyncClient()
+        await client.aforce_login(user)
+        url = reverse('diagnosis:dashboard-overview-async')
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def timed_request():
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.get(url)
+                elapsed = time.perf_counter() - started
+            if response.status_code != 200:
+                raise CommandError(f'Respuesta asíncrona inesperada: {response.status_code}')
+            return elapsed
+
+        return await asyncio.gather(*(timed_request() for _ in range(total)))
@@ -0,0 +1,83 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.urls import reverse
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from apps.core.renderers import FastJSONRenderer, MessagePackRenderer, orjson, msgpack
+from apps.diagnosis.models import DiagnosisResult
+from apps.diagnosis.serializers import DiagnosisResultSerializer
+from apps.security.models import User
+
+
+def median_ms(samples):
+    return statistics.median(samples) * 1000
+
+
+class Command(BaseCommand):
+    help = 'Compara JSONRenderer, FastJSONRenderer (orjson) y MessagePack sobre el listado de diagnósticos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', required=True, help='Usuario con el que se consulta el listado')
+        parser.add_argument('--rows', type=int, default=500, help='Diagnósticos serializados para medir el render')
+        parser.add_argument('--repeat', type=int, default=20, help='Repeticiones del render por renderer')
+        parser.add_argument('--requests', type=int, default=30, help='Peticiones al endpoint por tipo de contenido')
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(username=options['user']).first()
+        if user is None:
+            raise CommandError(f"Usuario no encontrado: {options['user']}")
+        if min(options['rows'], options['repeat'], options['requests']) < 1:
+            raise CommandError('--rows, --repeat y --requests deben ser mayores o iguales a 1')
+        if orjson is None:
+            self.stdout.write(self.style.WARNING('orjson no está instalado: FastJSONRenderer usa json estándar'))
+
+        renderers = {'JSONRenderer': JSONRenderer(), 'FastJSONRenderer': FastJSONRenderer()}
+        if msgpack is not None:
+            renderers['MessagePackRenderer'] = MessagePackRenderer()
+        self.benchmark_render(renderers, options['rows'], options['repeat'])
+
+        accepts = ['application/json'] + (['application/msgpack'] if msgpack is not None else [])
+        self.benchmark_endpoint(user, accepts, options['requests'])
+
+    def benchmark_render(self, renderers, rows, repeat):
+        request = Request(APIRequestFactory().get('/'))
+        queryset = DiagnosisResult.objects.select_related(
+            'xray__patient', 'xray__medical_order__requested_by',
+            'radiologist_review', 'treating_physician_approval', 'reviewed_by',
+        ).order_by('-created_at')[:rows]
+        data = DiagnosisResultSerializer(queryset, many=True, context={'request': request}).data
+        self.stdout.write(f'Render de {len(data)} diagnósticos ({repeat} repeticiones):')
+
+        baseline = None
+        for name, renderer in renderers.items():
+            samples = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                content = renderer.render(data, renderer.media_type, {})
+                samples.append(time.perf_counter() - started)
+            baseline = baseline or median_ms(samples)
+            self.stdout.write(
+                f'  {name:<20} {median_ms(samples):8.2f} ms · {len(content) / 1024:8.1f} KB · '
+                f'{baseline / median_ms(samples):5.2f}x'
+            )
+
+    def benchmark_endpoint(self, user, accepts, total):
+        client = Client()
+        client.force_login(user)
+        url = reverse('diagnosis:diagnosisresult-list')
+        self.stdout.write(f'Listado {url} ({total} peticiones):')
+        for accept in accepts:
+            samples = []
+            for _ in range(total):
+                started = time.perf_counter()
+                response = client.get(url, HTTP_ACCEPT=accept)
+                samples.append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    raise CommandError(f'Respuesta inesperada ({accept}): {response.status_code}')
+            self.stdout.write(f'  {accept:<20} p50 {median_ms(samples):.1f} ms')
+        self.stdout.write(self.style.SUCCESS('✓ Benchmark completado'))
@@ -0,0 +1,71 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from apps.diagnosis.embeddings import (
+    BRUTE_FORCE_MAX_VECTORS, IVFPQIndex, extract_embeddings, encode_embedding,
+    index_path, load_reviewed_vectors,
+)
+from apps.diagnosis.models import XRayImage
+
+
+class Command(BaseCommand):
+    help = 'Calcula embeddings de radiografías y precalcula el índice IVF-PQ de casos similares'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=64, help='Imágenes por lote de extracción')
+        parser.add_argument('--recompute', action='store_true', help='Recalcular también los embeddings existentes')
+        parser.add_argument('--skip-embeddings', action='store_true', help='Solo reconstruir el índice')
+        parser.add_argument('--force-ivf', action='store_true', help='Construir IVF-PQ aunque el conjunto sea pequeño')
+        parser.add_argument('--n-probe', type=int, default=16, help='Listas exploradas por consulta')
+
+    def handle(self, *args, **options):
+        if not options['skip_embeddings']:
+            self.compute_embeddings(options['batch_size'], options['recompute'])
+        self.build_index(options['force_ivf'], options['n_probe'])
+
+    def compute_embeddings(self, batch_size, recompute):
+        xrays = XRayImage.objects.filter(is_analyzed=True).exclude(image='')
+        if not recompute:
+            xrays = xrays.filter(embedding__isnull=True)
+
+        total = 0
+        batch = []
+        for xray_id, image in xrays.values_list('id', 'image').iterator(chunk_size=batch_size):
+            batch.append((xray_id, image))
+            if len(batch) >= batch_size:
+                total += self._store_batch(batch, batch_size)
+                batch = []
+        if batch:
+            total += self._store_batch(batch, batch_size)
+
+        self.stdout.write(self.style.SUCCESS(f'✓ Embeddings calculados: {total}'))
+
+    def _store_batch(self, batch, batch_size):
+        storage = XRayImage._meta.get_field('image').storage
+        vectors = extract_embeddings([storage.path(image) for _, image in batch], batch_size=batch_size)
+        updates = [
+            XRayImage(id=xray_id, embedding=encode_embedding(vector))
+            for (xray_id, _), vector in zip(batch, vectors) if vector is not None
+        ]
+        XRayImage.objects.bulk_update(updates, ['embedding'])
+        return len(updates)
+
+    def build_index(self, force_ivf, n_probe):
+        path = index_path()
+        ids, vectors = load_reviewed_vectors()
+
+        if len(ids) <= BRUTE_FORCE_MAX_VECTORS and not force_ivf:
+            # Conjuntos pequeños: búsqueda exacta construida en línea desde la base de datos
+            if os.path.exists(path):
+                os.remove(path)
+            self.stdout.write(self.style.SUCCESS(
+                f'✓ {len(ids)} casos revisados: se usará búsqueda exacta (sin índice precalculado)'
+            ))
+            return
+
+        n_lists = max(1, int(4 * len(ids) ** 0.5))
+        self.stdout.write(f'Entrenando IVF-PQ con {n_lists} listas sobre {len(ids)} vectores...')
+        index = IVFPQIndex(n_lists, n_probe=n_probe).train(vectors).add(ids, vectors)
+        index.save(path)
+        self.stdout.write(self.style.SUCCESS(f'✓ Índice guardado en {path}'))
@@ -0,0 +1,43 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.diagnosis.bulk_import import BATCH_SIZE, IMPORT_FORMATS, guess_format, parse_rows, import_patients
+from apps.security.models import User
+
+
+class Command(BaseCommand):
+    help = 'Importa pacientes desde un archivo CSV o NDJSON en lotes (validación, unicidad e inserción por lote)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Archivo CSV (con encabezado) o NDJSON')
+        parser.add_argument('--user', required=True, help='Usuario registrado como creador de los pacientes')
+        parser.add_argument('--format', choices=IMPORT_FORMATS, help='Formato; por defecto según la extensión')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Filas por lote')
+        parser.add_argument('--dry-run', action='store_true', help='Solo validar, sin insertar')
+        parser.add_argument('--report', help='Guardar el reporte completo (JSON) en este archivo')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"Usuario no encontrado: {options['user']}")
+        import_format = options['format'] or guess_format(options['path'])
+
+        with open(options['path'], encoding='utf-8-sig', newline='') as stream:
+            report = import_patients(
+                parse_rows(stream, import_format), user,
+                dry_run=options['dry_run'], batch_size=options['batch_size'],
+            )
+
+        if options['report']:
+            with open(options['report'], 'w', encoding='utf-8') as output:
+                json.dump(report, output, ensure_ascii=False, indent=2)
+        for error in report['errors'][:20]:
+            self.stdout.write(f"Fila {error['row']} ({error['dni']}): {json.dumps(error['errors'], ensure_ascii=False)}")
+        if len(report['errors']) > 20:
+            self.stdout.write(f"... y {len(report['errors']) - 20} errores más")
+        self.stdout.write(self.style.SUCCESS(
+            f"✓ Importación {report['import_id']}: {report['total']} filas, {report['valid']} válidas, "
+            f"{report['created']} creadas, {len(report['errors'])} con errores"
+        ))
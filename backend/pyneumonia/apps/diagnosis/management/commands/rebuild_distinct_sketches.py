@@ -0,0 +1,41 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from apps.diagnosis.sketches import METRICS, rebuild_sketches, estimate_count, exact_count
+
+
+def parse_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise CommandError(f'Fecha inválida: {value}. Use YYYY-MM-DD')
+
+
+class Command(BaseCommand):
+    help = 'Regenera los sketches HyperLogLog de conteos distintos, o compara estimación y conteo exacto (--audit)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='start', required=True, help='Primer día (YYYY-MM-DD)')
+        parser.add_argument('--to', dest='end', help='Último día (YYYY-MM-DD); por defecto hoy')
+        parser.add_argument('--metric', action='append', choices=METRICS, help='Métrica (repetible); por defecto todas')
+        parser.add_argument('--audit', action='store_true', help='Solo comparar estimación y conteo exacto del rango')
+
+    def handle(self, *args, **options):
+        start = parse_date(options['start'])
+        end = parse_date(options['end']) if options['end'] else timezone.localdate()
+        if start > end:
+            raise CommandError('--from debe ser anterior o igual a --to')
+        metrics = tuple(options['metric'] or METRICS)
+
+        if options['audit']:
+            for metric in metrics:
+                estimate = estimate_count(metric, start, end)
+                exact = exact_count(metric, start, end)
+                error = abs(estimate - exact) / exact * 100 if exact else 0.0
+                self.stdout.write(f'{metric}: estimado {estimate}, exacto {exact} (error {error:.2f} %)')
+            return
+
+        written = rebuild_sketches(start, end, metrics)
+        self.stdout.write(self.style.SUCCESS(f'✓ Sketches generados: {written}'))
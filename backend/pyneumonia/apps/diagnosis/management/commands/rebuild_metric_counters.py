@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from apps.diagnosis.timeseries import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye los contadores horarios de series de tiempo desde las tablas de origen'
+
+    def handle(self, *args, **options):
+        total = rebuild(stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(f'✓ Contadores generados: {total}'))
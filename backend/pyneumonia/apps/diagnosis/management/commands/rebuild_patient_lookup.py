@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from apps.diagnosis.autocomplete import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Regenera las claves de autocompletado de pacientes (DNI y apellidos normalizados)'
+
+    def handle(self, *args, **options):
+        written = rebuild()
+        self.stdout.write(self.style.SUCCESS(f'✓ Claves de autocompletado generadas: {written}'))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from apps.diagnosis.search import DOCUMENTS, rebuild
+
+
+class Command(BaseCommand):
+    help = 'Regenera el índice de búsqueda de texto completo (pacientes, órdenes, diagnósticos y reportes)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--entity', action='append', choices=[entity for entity, _ in DOCUMENTS.values()],
+            help='Tipo de entidad (repetible); por defecto todas'
+        )
+
+    def handle(self, *args, **options):
+        entities = options['entity']
+        models = [model for model, (entity, _) in DOCUMENTS.items() if not entities or entity in entities]
+        for entity, written in rebuild(models).items():
+            self.stdout.write(f'{entity}: {written} documentos')
+        self.stdout.write(self.style.SUCCESS('✓ Índice de búsqueda regenerado'))
@@ -0,0 +1,36 @@
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from apps.diagnosis.system_stats import update_system_statistics
+
+
+class Command(BaseCommand):
+    help = 'Recalcula desde cero las estadísticas diarias del sistema (reparación de contadores incrementales)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='Fecha a recalcular (YYYY-MM-DD); por defecto hoy')
+        parser.add_argument('--days', type=int, default=1, help='Cantidad de días hasta la fecha indicada')
+
+    def handle(self, *args, **options):
+        if options['date']:
+            try:
+                end_date = datetime.strptime(options['date'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('Formato de fecha inválido. Use YYYY-MM-DD')
+        else:
+            end_date = timezone.localdate()
+        if options['days'] < 1:
+            raise CommandError('--days debe ser mayor o igual a 1')
+
+        # En orden cronológico para que cada día quede consistente con el anterior
+        for offset in range(options['days'] - 1, -1, -1):
+            target_date = end_date - timedelta(days=offset)
+            stats = update_system_statistics(target_date)
+            self.stdout.write(
+                f'{target_date}: {stats.daily_diagnoses_made} diagnósticos, '
+                f'{stats.active_users_today} usuarios activos'
+            )
+
+        self.stdout.write(self.style.SUCCESS('✓ Estadísticas del sistema recalculadas'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from apps.diagnosis.performance import rebuild_user_performance_metrics
+
+
+class Command(BaseCommand):
+    help = 'Recalcula las métricas de rendimiento de los usuarios con consultas agrupadas (siembra y reparación)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='users', help='ID de usuario (repetible)')
+
+    def handle(self, *args, **options):
+        written = rebuild_user_performance_metrics(options['users'])
+        self.stdout.write(self.style.SUCCESS(f'✓ Métricas de rendimiento recalculadas: {written} usuarios'))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from apps.diagnosis.rollups import run_rollup
+
+
+class Command(BaseCommand):
+    help = 'Consolida DiagnosticStatistics por día, semana y mes (solo períodos modificados desde la última ejecución)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Recalcular todo el historial')
+
+    def handle(self, *args, **options):
+        result = run_rollup(full=options['full'])
+        if result['window']:
+            start, end = result['window']
+            self.stdout.write(f'Ventana recalculada: {start} - {end}')
+        elif not options['full'] and not result['written']:
+            self.stdout.write('Sin cambios desde la última ejecución')
+        self.stdout.write(self.style.SUCCESS(
+            f"✓ Períodos escritos: {result['written']}, eliminados: {result['deleted']}"
+        ))
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-19 01:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diagnosis', '0006_remove_medicalreport_radiologist_signed_at_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='xrayimage',
+            name='embedding',
+            field=models.BinaryField(blank=True, null=True, verbose_name='Embedding de Imagen'),
+        ),
+    ]
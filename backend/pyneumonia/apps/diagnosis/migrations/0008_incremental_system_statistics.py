@@ -0,0 +1,104 @@
+# Generated by Django 5.2.7 on 2026-10-19 01:07
+
+from collections import Counter
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+
+PNEUMONIA_CLASSES = ('PNEUMONIA_BACTERIA', 'PNEUMONIA_BACTERIAL', 'PNEUMONIA_VIRAL')
+
+
+def seed_counters(apps, schema_editor):
+    """Siembra los contadores base de las filas existentes con los diagnósticos creados hasta cada día"""
+    SystemStatistics = apps.get_model('diagnosis', 'SystemStatistics')
+    DiagnosisResult = apps.get_model('diagnosis', 'DiagnosisResult')
+    rows = list(SystemStatistics.objects.order_by('date'))
+    if not rows:
+        return
+
+    completed_with_time = Q(status='completed', processing_time__isnull=False)
+    by_day = {
+        row.pop('day'): row
+        for row in DiagnosisResult.objects.annotate(day=TruncDate('created_at')).values('day').annotate(
+            daily_completed_diagnoses=Count('pk', filter=Q(status='completed')),
+            normal_diagnoses=Count('pk', filter=Q(predicted_class='NORMAL')),
+            pneumonia_diagnoses=Count('pk', filter=Q(predicted_class__in=PNEUMONIA_CLASSES)),
+            processing_time_total=Sum('processing_time', filter=completed_with_time),
+            processing_time_samples=Count('pk', filter=completed_with_time),
+        ).order_by()
+    }
+    days = sorted(by_day)
+    cumulative = Counter()
+    position = 0
+    for stats in rows:
+        while position < len(days) and days[position] <= stats.date:
+            day = by_day[days[position]]
+            cumulative.update({name: day[name] or 0 for name in day if name != 'daily_completed_diagnoses'})
+            position += 1
+        stats.normal_diagnoses = cumulative['normal_diagnoses']
+        stats.pneumonia_diagnoses = cumulative['pneumonia_diagnoses']
+        stats.processing_time_total = float(cumulative['processing_time_total'])
+        stats.processing_time_samples = cumulative['processing_time_samples']
+        stats.daily_completed_diagnoses = by_day.get(stats.date, {}).get('daily_completed_diagnoses', 0)
+    SystemStatistics.objects.bulk_update(rows, [
+        'normal_diagnoses', 'pneumonia_diagnoses', 'processing_time_total',
+        'processing_time_samples', 'daily_completed_diagnoses',
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diagnosis', '0007_xrayimage_embedding'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='systemstatistics',
+            name='daily_completed_diagnoses',
+            field=models.IntegerField(default=0, verbose_name='Diagnósticos Completados Hoy'),
+        ),
+        migrations.AddField(
+            model_name='systemstatistics',
+            name='is_final',
+            field=models.BooleanField(default=False, help_text='Los días cerrados no se vuelven a modificar', verbose_name='Cerrado'),
+        ),
+        migrations.AddField(
+            model_name='systemstatistics',
+            name='normal_diagnoses',
+            field=models.IntegerField(default=0, verbose_name='Total Diagnósticos Normales'),
+        ),
+        migrations.AddField(
+            model_name='systemstatistics',
+            name='pneumonia_diagnoses',
+            field=models.IntegerField(default=0, verbose_name='Total Diagnósticos de Neumonía'),
+        ),
+        migrations.AddField(
+            model_name='systemstatistics',
+            name='processing_time_samples',
+            field=models.IntegerField(default=0, verbose_name='Diagnósticos con Tiempo de Procesamiento'),
+        ),
+        migrations.AddField(
+            model_name='systemstatistics',
+            name='processing_time_total',
+            field=models.FloatField(default=0.0, verbose_name='Suma Tiempos de Procesamiento (s)'),
+        ),
+        migrations.CreateModel(
+            name='DailyActiveUser',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Fecha')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_activity', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Usuario Activo por Día',
+                'verbose_name_plural': 'Usuarios Activos por Día',
+                'constraints': [models.UniqueConstraint(fields=('date', 'user'), name='unique_daily_active_user')],
+            },
+        ),
+        migrations.RunPython(seed_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,153 @@
+# Generated by Django 5.2.7 on 2026-10-19 01:12
+
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, Q, Sum
+
+# Copia de apps.diagnosis.performance al crear esta migración: la migración no
+# debe depender de cómo evolucione el código de la app
+SPECIALTY_MIN_CASES = 10
+SPECIALTY_LABELS = {
+    'NORMAL': 'Diagnósticos Normales',
+    'PNEUMONIA_BACTERIA': 'Neumonía Bacteriana',
+    'PNEUMONIA_BACTERIAL': 'Neumonía Bacterial',
+    'PNEUMONIA_VIRAL': 'Neumonía Viral',
+}
+REVIEW_FIELDS = (('reviewed_by', 'reviewed_at'), ('treating_physician_approval', 'approved_at'))
+WRITTEN_FIELDS = (
+    'total_diagnoses_lifetime', 'total_reports_lifetime', 'total_reviews_lifetime',
+    'completed_diagnoses_lifetime', 'confidence_sum', 'processing_time_sum',
+    'processing_time_samples', 'final_reports_lifetime',
+    'lifetime_average_confidence', 'lifetime_average_processing_time',
+    'accuracy_score', 'quality_score', 'specialty_focus',
+    'class_counts', 'first_diagnosis_date', 'last_activity_date', 'updated_at',
+)
+
+
+def derive(metrics):
+    """Promedios, puntuaciones y especialidad a partir de los acumuladores"""
+    average_confidence = (
+        Decimal(metrics.confidence_sum) / metrics.completed_diagnoses_lifetime
+        if metrics.completed_diagnoses_lifetime else Decimal('0.00')
+    )
+    metrics.lifetime_average_confidence = Decimal(str(round(float(average_confidence), 2)))
+    metrics.lifetime_average_processing_time = (
+        metrics.processing_time_sum / metrics.processing_time_samples
+        if metrics.processing_time_samples else 0.0
+    )
+    accuracy_score = min(float(average_confidence) * 100, 100.0) if metrics.total_diagnoses_lifetime else 0.0
+    metrics.accuracy_score = Decimal(str(round(accuracy_score, 2)))
+    quality_score = (
+        metrics.final_reports_lifetime / metrics.total_reports_lifetime * 100
+        if metrics.total_reports_lifetime else 0.0
+    )
+    metrics.quality_score = Decimal(str(round(quality_score, 2)))
+    metrics.specialty_focus = None
+    if metrics.class_counts:
+        predicted_class, count = max(metrics.class_counts.items(), key=lambda item: item[1])
+        if count >= SPECIALTY_MIN_CASES:
+            metrics.specialty_focus = SPECIALTY_LABELS.get(predicted_class, predicted_class)
+    return metrics
+
+
+def seed_accumulators(apps, schema_editor):
+    """Siembra sumas, conteos y métricas derivadas de todos los usuarios desde su historial"""
+    DiagnosisResult = apps.get_model('diagnosis', 'DiagnosisResult')
+    MedicalReport = apps.get_model('diagnosis', 'MedicalReport')
+    UserPerformanceMetrics = apps.get_model('diagnosis', 'UserPerformanceMetrics')
+
+    rows = defaultdict(lambda: {'class_counts': {}})
+    completed = Q(status='completed')
+    reviewed = DiagnosisResult.objects.filter(radiologist_review__isnull=False)
+
+    for entry in reviewed.values('radiologist_review').annotate(
+        total=Count('pk'),
+        completed=Count('pk', filter=completed),
+        confidence=Sum('confidence', filter=completed),
+        time_sum=Sum('processing_time', filter=completed),
+        time_samples=Count('processing_time', filter=completed),
+        first=Min('created_at'),
+        last=Max('radiologist_reviewed_at'),
+    ).order_by():
+        rows[entry['radiologist_review']].update(
+            total_diagnoses_lifetime=entry['total'],
+            completed_diagnoses_lifetime=entry['completed'],
+            confidence_sum=entry['confidence'] or Decimal('0'),
+            processing_time_sum=entry['time_sum'] or 0.0,
+            processing_time_samples=entry['time_samples'],
+            first_diagnosis_date=entry['first'],
+            activity=[entry['last']],
+        )
+
+    for entry in reviewed.values('radiologist_review', 'predicted_class').annotate(count=Count('pk')).order_by():
+        rows[entry['radiologist_review']]['class_counts'][entry['predicted_class']] = entry['count']
+
+    for field, timestamp_field in REVIEW_FIELDS:
+        for entry in DiagnosisResult.objects.filter(**{f'{field}__isnull': False}).values(field).annotate(
+            count=Count('pk'), last=Max(timestamp_field)
+        ).order_by():
+            row = rows[entry[field]]
+            row['total_reviews_lifetime'] = row.get('total_reviews_lifetime', 0) + entry['count']
+            row.setdefault('activity', []).append(entry['last'])
+
+    for entry in MedicalReport.objects.filter(created_by__isnull=False).values('created_by').annotate(
+        total=Count('pk'), final=Count('pk', filter=Q(status='final'))
+    ).order_by():
+        rows[entry['created_by']].update(
+            total_reports_lifetime=entry['total'], final_reports_lifetime=entry['final']
+        )
+
+    metrics_rows = []
+    for user_id in set(rows) | set(UserPerformanceMetrics.objects.values_list('user_id', flat=True)):
+        row = rows.get(user_id, {'class_counts': {}})
+        activity = [timestamp for timestamp in row.pop('activity', []) if timestamp]
+        metrics_rows.append(derive(UserPerformanceMetrics(
+            user_id=user_id, last_activity_date=max(activity, default=None), **row
+        )))
+
+    UserPerformanceMetrics.objects.bulk_create(
+        metrics_rows, update_conflicts=True, unique_fields=['user'], update_fields=WRITTEN_FIELDS,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diagnosis', '0008_incremental_system_statistics'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userperformancemetrics',
+            name='class_counts',
+            field=models.JSONField(blank=True, default=dict, verbose_name='Diagnósticos por Clase'),
+        ),
+        migrations.AddField(
+            model_name='userperformancemetrics',
+            name='completed_diagnoses_lifetime',
+            field=models.IntegerField(default=0, verbose_name='Diagnósticos Completados (Histórico)'),
+        ),
+        migrations.AddField(
+            model_name='userperformancemetrics',
+            name='confidence_sum',
+            field=models.DecimalField(decimal_places=3, default=Decimal('0'), max_digits=14, verbose_name='Suma de Confianza'),
+        ),
+        migrations.AddField(
+            model_name='userperformancemetrics',
+            name='final_reports_lifetime',
+            field=models.IntegerField(default=0, verbose_name='Reportes Finales (Histórico)'),
+        ),
+        migrations.AddField(
+            model_name='userperformancemetrics',
+            name='processing_time_samples',
+            field=models.IntegerField(default=0, verbose_name='Diagnósticos con Tiempo de Procesamiento'),
+        ),
+        migrations.AddField(
+            model_name='userperformancemetrics',
+            name='processing_time_sum',
+            field=models.FloatField(default=0.0, verbose_name='Suma Tiempos de Procesamiento (s)'),
+        ),
+        migrations.RunPython(seed_accumulators, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.7 on 2026-10-19 01:13
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diagnosis', '0009_incremental_user_performance'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True, verbose_name='Proceso')),
+                ('processed_until', models.DateTimeField(blank=True, null=True, verbose_name='Procesado Hasta')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Última Actualización')),
+            ],
+            options={
+                'verbose_name': 'Marca de Consolidación',
+                'verbose_name_plural': 'Marcas de Consolidación',
+            },
+        ),
+        migrations.AddField(
+            model_name='diagnosticstatistics',
+            name='period_type',
+            field=models.CharField(choices=[('day', 'Diario'), ('week', 'Semanal'), ('month', 'Mensual')], default='day', max_length=10, verbose_name='Tipo de Período'),
+        ),
+        migrations.AddIndex(
+            model_name='diagnosticstatistics',
+            index=models.Index(fields=['period_type', 'user', '-period_start'], name='diagnosis_d_period__be7142_idx'),
+        ),
+    ]
@@ -0,0 +1,102 @@
+# Generated by Django 5.2.7 on 2026-10-19 01:17
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+# Copia de las reglas de apps.diagnosis.participation al crear esta migración:
+# la migración no debe depender de cómo evolucione el código de la app
+DIAGNOSIS_ROLES = (
+    ('radiologist_review_id', 'radiologist'),
+    ('reviewed_by_id', 'reviewer'),
+    ('treating_physician_approval_id', 'approver'),
+)
+BATCH_SIZE = 2000
+
+
+def participations(apps):
+    """(entity_type, entity_id, user_id, role, source_id) de cada relación existente"""
+    Patient = apps.get_model('diagnosis', 'Patient')
+    MedicalOrder = apps.get_model('diagnosis', 'MedicalOrder')
+    XRayImage = apps.get_model('diagnosis', 'XRayImage')
+    DiagnosisResult = apps.get_model('diagnosis', 'DiagnosisResult')
+    MedicalReport = apps.get_model('diagnosis', 'MedicalReport')
+
+    for pk, user_id in Patient.objects.filter(created_by__isnull=False).values_list('pk', 'created_by_id'):
+        yield 'patient', pk, user_id, 'creator', pk
+
+    for pk, patient_id, user_id in MedicalOrder.objects.filter(requested_by__isnull=False).values_list(
+        'pk', 'patient_id', 'requested_by_id'
+    ):
+        yield 'patient', patient_id, user_id, 'requester', pk
+
+    xrays = {
+        pk: (patient_id, uploader_id)
+        for pk, patient_id, uploader_id in XRayImage.objects.values_list('pk', 'patient_id', 'uploaded_by_id')
+    }
+    for pk, (patient_id, uploader_id) in xrays.items():
+        if uploader_id:
+            yield 'xray', pk, uploader_id, 'uploader', pk
+            yield 'patient', patient_id, uploader_id, 'uploader', pk
+
+    role_fields = [field for field, _ in DIAGNOSIS_ROLES]
+    for values in DiagnosisResult.objects.values('pk', 'xray_id', *role_fields).iterator(chunk_size=BATCH_SIZE):
+        if values['xray_id'] not in xrays:
+            continue
+        pk, xray_id = values['pk'], values['xray_id']
+        patient_id, uploader_id = xrays[xray_id]
+        if uploader_id:
+            yield 'diagnosis', pk, uploader_id, 'uploader', pk
+        for field, role in DIAGNOSIS_ROLES:
+            if values[field]:
+                for entity_type, entity_id in (('diagnosis', pk), ('xray', xray_id), ('patient', patient_id)):
+                    yield entity_type, entity_id, values[field], role, pk
+
+    for pk, created_by_id, received_by_id in MedicalReport.objects.values_list('pk', 'created_by_id', 'received_by_id'):
+        for user_id, role in ((created_by_id, 'creator'), (received_by_id, 'receiver')):
+            if user_id:
+                yield 'report', pk, user_id, role, pk
+
+
+def backfill_participation(apps, schema_editor):
+    """Genera el índice de las relaciones existentes (las estadísticas por grupo lo leen solo a él)"""
+    Participation = apps.get_model('diagnosis', 'Participation')
+    rows = []
+    for entity_type, entity_id, user_id, role, source_id in participations(apps):
+        rows.append(Participation(
+            entity_type=entity_type, entity_id=entity_id, user_id=user_id, role=role, source_id=source_id
+        ))
+        if len(rows) >= BATCH_SIZE:
+            Participation.objects.bulk_create(rows, ignore_conflicts=True)
+            rows = []
+    Participation.objects.bulk_create(rows, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diagnosis', '0010_diagnostic_statistics_rollup'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Participation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entity_type', models.CharField(choices=[('patient', 'Paciente'), ('xray', 'Radiografía'), ('diagnosis', 'Diagnóstico'), ('report', 'Reporte')], max_length=20, verbose_name='Tipo de Entidad')),
+                ('entity_id', models.UUIDField(verbose_name='ID de Entidad')),
+                ('role', models.CharField(choices=[('creator', 'Registro'), ('requester', 'Solicitante'), ('uploader', 'Carga de Radiografía'), ('radiologist', 'Radiólogo'), ('reviewer', 'Revisor'), ('approver', 'Aprobación Médica'), ('receiver', 'Recepción de Reporte')], max_length=20, verbose_name='Rol')),
+                ('source_id', models.UUIDField(verbose_name='ID de Origen')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='participations', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Participación',
+                'verbose_name_plural': 'Participaciones',
+                'indexes': [models.Index(fields=['entity_type', 'user', 'entity_id'], name='diagnosis_p_entity__f29c1c_idx'), models.Index(fields=['source_id'], name='diagnosis_p_source__6b3a41_idx')],
+                'constraints': [models.UniqueConstraint(fields=('entity_type', 'entity_id', 'user', 'role', 'source_id'), name='unique_participation')],
+            },
+        ),
+        migrations.RunPython(backfill_participation, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.2.7 on 2026-10-19 01:23
+
+from datetime import timezone as dt_timezone
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncHour
+
+# Copia de apps.diagnosis.timeseries.METRICS al crear esta migración: la
+# migración no debe depender de cómo evolucione el código de la app.
+# métrica: (modelo, campo de fecha, campo de dimensión o None, condición {campo: valor})
+METRICS = {
+    'patients_registered': ('Patient', 'created_at', 'gender', {}),
+    'xray_uploads': ('XRayImage', 'uploaded_at', None, {}),
+    'diagnoses': ('DiagnosisResult', 'created_at', 'predicted_class', {}),
+    'diagnosis_errors': ('DiagnosisResult', 'created_at', None, {'status': 'error'}),
+    'reports': ('MedicalReport', 'created_at', 'status', {}),
+}
+
+
+def backfill_counters(apps, schema_editor):
+    """Cuenta por hora los registros existentes (las tendencias leen solo los contadores)"""
+    MetricCounter = apps.get_model('diagnosis', 'MetricCounter')
+    rows = []
+    for metric, (model_name, timestamp_field, dimension, condition) in METRICS.items():
+        model = apps.get_model('diagnosis', model_name)
+        grouped = model.objects.filter(**condition, **{f'{timestamp_field}__isnull': False}).annotate(
+            hour=TruncHour(timestamp_field, tzinfo=dt_timezone.utc)
+        ).values('hour', *([dimension] if dimension else [])).annotate(total=Count('pk')).order_by()
+        rows.extend(
+            MetricCounter(
+                metric=metric, bucket=row['hour'],
+                dimension=(row[dimension] or '') if dimension else '', count=row['total'],
+            )
+            for row in grouped
+        )
+    MetricCounter.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diagnosis', '0011_participation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MetricCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField(verbose_name='Hora (UTC)')),
+                ('metric', models.CharField(max_length=50, verbose_name='Métrica')),
+                ('dimension', models.CharField(blank=True, default='', max_length=50, verbose_name='Dimensión')),
+                ('count', models.IntegerField(default=0, verbose_name='Conteo')),
+            ],
+            options={
+                'verbose_name': 'Contador de Métrica',
+                'verbose_name_plural': 'Contadores de Métricas',
+                'constraints': [models.UniqueConstraint(fields=('metric', 'bucket', 'dimension'), name='unique_metric_counter')],
+            },
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
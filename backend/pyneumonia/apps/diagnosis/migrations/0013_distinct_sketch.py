@@ -0,0 +1,29 @@
+# Generated by Django 5.2.7 on 2026-10-19 01:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diagnosis', '0012_metric_counter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DistinctSketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metric', models.CharField(max_length=50, verbose_name='Métrica')),
+                ('scope', models.CharField(default='all', max_length=60, verbose_name='Alcance')),
+                ('date', models.DateField(verbose_name='Fecha')),
+                ('registers', models.BinaryField(verbose_name='Registros')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Última Actualización')),
+            ],
+            options={
+                'verbose_name': 'Sketch de Distintos',
+                'verbose_name_plural': 'Sketches de Distintos',
+                'constraints': [models.UniqueConstraint(fields=('metric', 'scope', 'date'), name='unique_distinct_sketch')],
+            },
+        ),
+    ]
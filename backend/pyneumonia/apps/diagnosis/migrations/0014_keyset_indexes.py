@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-19 01:45
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diagnosis', '0013_distinct_sketch'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='diagnosisresult',
+            index=models.Index(fields=['-created_at', '-id'], name='diagnosis_d_created_12334a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='xrayimage',
+            index=models.Index(fields=['-uploaded_at', '-id'], name='diagnosis_x_uploade_42e816_idx'),
+        ),
+    ]
@@ -0,0 +1,113 @@
+# Generated by Django 5.2.7 on 2026-10-19 01:49
+
+import unicodedata
+
+from django.db import migrations, models
+
+# Índice de texto completo sobre diagnosis_searchentry.body según el motor:
+# SQLite -> tabla FTS5 de contenido externo sincronizada con triggers;
+# PostgreSQL -> índice GIN sobre to_tsvector('simple', body).
+SQLITE_FORWARD = [
+    """CREATE VIRTUAL TABLE diagnosis_searchentry_fts USING fts5(
+        body, content='diagnosis_searchentry', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER diagnosis_searchentry_ai AFTER INSERT ON diagnosis_searchentry BEGIN
+        INSERT INTO diagnosis_searchentry_fts(rowid, body) VALUES (new.id, new.body);
+    END""",
+    """CREATE TRIGGER diagnosis_searchentry_ad AFTER DELETE ON diagnosis_searchentry BEGIN
+        INSERT INTO diagnosis_searchentry_fts(diagnosis_searchentry_fts, rowid, body) VALUES ('delete', old.id, old.body);
+    END""",
+    """CREATE TRIGGER diagnosis_searchentry_au AFTER UPDATE ON diagnosis_searchentry BEGIN
+        INSERT INTO diagnosis_searchentry_fts(diagnosis_searchentry_fts, rowid, body) VALUES ('delete', old.id, old.body);
+        INSERT INTO diagnosis_searchentry_fts(rowid, body) VALUES (new.id, new.body);
+    END""",
+]
+SQLITE_BACKWARD = [
+    'DROP TRIGGER IF EXISTS diagnosis_searchentry_ai',
+    'DROP TRIGGER IF EXISTS diagnosis_searchentry_ad',
+    'DROP TRIGGER IF EXISTS diagnosis_searchentry_au',
+    'DROP TABLE IF EXISTS diagnosis_searchentry_fts',
+]
+POSTGRESQL_FORWARD = [
+    "CREATE INDEX diagnosis_searchentry_body_fts ON diagnosis_searchentry USING GIN (to_tsvector('simple', body))",
+]
+POSTGRESQL_BACKWARD = [
+    'DROP INDEX IF EXISTS diagnosis_searchentry_body_fts',
+]
+
+
+def run_statements(forward):
+    def run(apps, schema_editor):
+        vendor = schema_editor.connection.vendor
+        if vendor == 'sqlite':
+            statements = SQLITE_FORWARD if forward else SQLITE_BACKWARD
+        elif vendor == 'postgresql':
+            statements = POSTGRESQL_FORWARD if forward else POSTGRESQL_BACKWARD
+        else:
+            statements = []
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+# Copia de apps.diagnosis.search.DOCUMENTS al crear esta migración: la
+# migración no debe depender de cómo evolucione el código de la app.
+# {modelo: (tipo de entidad, rutas de los campos que forman el documento)}
+DOCUMENTS = {
+    'Patient': ('patient', ('first_name', 'last_name', 'dni', 'email')),
+    'MedicalOrder': ('medical_order', ('patient__first_name', 'patient__last_name', 'patient__dni', 'reason')),
+    'DiagnosisResult': ('diagnosis', (
+        'predicted_class', 'xray__patient__first_name', 'xray__patient__last_name', 'xray__patient__dni',
+    )),
+    'MedicalReport': ('medical_report', ('title', 'findings', 'impression')),
+}
+
+
+def normalize(text):
+    """Minúsculas y sin marcas diacríticas (como search.normalize)"""
+    decomposed = unicodedata.normalize('NFKD', str(text))
+    return ''.join(char for char in decomposed if not unicodedata.combining(char)).lower()
+
+
+def backfill_search_index(apps, schema_editor):
+    """Indexa los registros existentes (?search= solo consulta el índice)"""
+    SearchEntry = apps.get_model('diagnosis', 'SearchEntry')
+    for model_name, (entity_type, paths) in DOCUMENTS.items():
+        rows = apps.get_model('diagnosis', model_name).objects.values_list('pk', *paths).iterator(chunk_size=2000)
+        SearchEntry.objects.bulk_create(
+            (
+                SearchEntry(
+                    entity_type=entity_type, entity_id=row[0],
+                    body=normalize(' '.join(str(value) for value in row[1:] if value)),
+                )
+                for row in rows
+            ),
+            batch_size=500, ignore_conflicts=True,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diagnosis', '0014_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entity_type', models.CharField(max_length=40, verbose_name='Tipo de Entidad')),
+                ('entity_id', models.UUIDField(verbose_name='ID de Entidad')),
+                ('body', models.TextField(verbose_name='Texto Indexado')),
+            ],
+            options={
+                'verbose_name': 'Entrada de Búsqueda',
+                'verbose_name_plural': 'Entradas de Búsqueda',
+                'constraints': [models.UniqueConstraint(fields=('entity_type', 'entity_id'), name='unique_search_entry')],
+            },
+        ),
+        migrations.RunPython(run_statements(forward=True), run_statements(forward=False)),
+        migrations.RunPython(backfill_search_index, migrations.RunPython.noop),
+    ]
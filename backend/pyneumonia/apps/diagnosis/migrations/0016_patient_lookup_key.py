@@ -0,0 +1,65 @@
+# Generated by Django 5.2.7 on 2026-10-19 01:52
+
+import django.db.models.deletion
+import re
+import unicodedata
+
+from django.db import migrations, models
+
+# Copia de las reglas de apps.diagnosis.autocomplete al crear esta migración:
+# la migración no debe depender de cómo evolucione el código de la app
+TOKEN_RE = re.compile(r'[^\W_]+')
+
+
+def normalize(text):
+    """Minúsculas y sin marcas diacríticas (como search.normalize)"""
+    decomposed = unicodedata.normalize('NFKD', str(text))
+    return ''.join(char for char in decomposed if not unicodedata.combining(char)).lower()
+
+
+def lookup_keys(dni, last_name):
+    """DNI, apellido completo y cada apellido después del primero"""
+    tokens = TOKEN_RE.findall(normalize(last_name))
+    keys = {normalize(dni).strip(), ' '.join(tokens), *tokens[1:]}
+    keys.discard('')
+    return keys
+
+
+def backfill_lookup_keys(apps, schema_editor):
+    """Claves de los pacientes existentes (el autocompletado solo consulta esta tabla)"""
+    Patient = apps.get_model('diagnosis', 'Patient')
+    PatientLookupKey = apps.get_model('diagnosis', 'PatientLookupKey')
+    PatientLookupKey.objects.bulk_create(
+        [
+            PatientLookupKey(patient_id=patient_id, key=key)
+            for patient_id, dni, last_name in Patient.objects.filter(is_active=True)
+            .values_list('pk', 'dni', 'last_name').iterator(chunk_size=5000)
+            for key in lookup_keys(dni, last_name)
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diagnosis', '0015_search_entry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientLookupKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=120, verbose_name='Clave')),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lookup_keys', to='diagnosis.patient')),
+            ],
+            options={
+                'verbose_name': 'Clave de Autocompletado',
+                'verbose_name_plural': 'Claves de Autocompletado',
+                'indexes': [models.Index(fields=['key', 'patient'], name='diagnosis_lookup_key_idx')],
+                'constraints': [models.UniqueConstraint(fields=('patient', 'key'), name='unique_patient_lookup_key')],
+            },
+        ),
+        migrations.RunPython(backfill_lookup_keys, migrations.RunPython.noop),
+    ]
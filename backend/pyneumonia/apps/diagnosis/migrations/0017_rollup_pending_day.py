@@ -0,0 +1,24 @@
+# Generated by Django 5.2.7 on 2026-10-19 02:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diagnosis', '0016_patient_lookup_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupPendingDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True, verbose_name='Fecha')),
+            ],
+            options={
+                'verbose_name': 'Día Pendiente de Consolidación',
+                'verbose_name_plural': 'Días Pendientes de Consolidación',
+            },
+        ),
+    ]
@@ -9,6 +9,13 @@ from django.core.validators import RegexValidator
 import math
 from django.utils import timezone
 
+# Mensajes de validación de cédula (compartidos con la validación por lotes de bulk_import)
+DNI_ERRORS = {
+    'format': 'La cédula debe tener exactamente 10 dígitos numéricos.',
+    'province': 'Los dos primeros dígitos deben corresponder a una provincia válida (01-24).',
+    'third_digit': 'El tercer dígito debe ser menor o igual a 6 para cédulas de personas naturales.',
+    'checksum': 'La cédula ingresada no es válida. El dígito verificador no coincide.',
+}
 
 
 def validate_ecuadorian_dni(value):
@@ -21,18 +28,18 @@ def validate_ecuadorian_dni(value):
     
     # Verificar que tenga exactamente 10 dígitos
     if not re.match(r'^\d{10}$', dni):
-        raise ValidationError('La cédula debe tener exactamente 10 dígitos numéricos.')
+        raise ValidationError(DNI_ERRORS['format'])
     
     # Verificar que los dos primeros dígitos correspondan a una provincia válida (01-24)
     provincia = int(dni[:2])
     if provincia < 1 or provincia > 24:
-        raise ValidationError('Los dos primeros dígitos deben corresponder a una provincia válida (01-24).')
+        raise ValidationError(DNI_ERRORS['province'])
     
     # Verificar el tercer dígito (debe ser menor a 6 para cédulas de personas naturales)
     # Nota: Se permite hasta 6 para casos especiales
     tercer_digito = int(dni[2])
     if tercer_digito > 6:
-        raise ValidationError('El tercer dígito debe ser menor o igual a 6 para cédulas de personas naturales.')
+        raise ValidationError(DNI_ERRORS['third_digit'])
     
     # Algoritmo de validación del dígito verificador
     multiplicador = [2, 1, 2, 1, 2, 1, 2, 1, 2]
@@ -51,7 +58,7 @@ def validate_ecuadorian_dni(value):
     digito_verificador = int(math.ceil(suma / 10.0) * 10) - suma
     
     if digito_verificador != ultimo_digito:
-        raise ValidationError('La cédula ingresada no es válida. El dígito verificador no coincide.')
+        raise ValidationError(DNI_ERRORS['checksum'])
     
     return value
 
@@ -263,6 +270,9 @@ class XRayImage(models.Model):
     # Estado del análisis
     is_analyzed = models.BooleanField('Analizada', default=False)
     
+    # Embedding de la imagen (float16) para búsqueda de casos similares
+    embedding = models.BinaryField('Embedding de Imagen', blank=True, null=True, editable=False)
+    
     # Auditoría
     uploaded_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='xrays_uploaded')
     uploaded_at = models.DateTimeField('Fecha de Carga', auto_now_add=True)
@@ -275,6 +285,8 @@ class XRayImage(models.Model):
         indexes = [
             models.Index(fields=['patient', '-uploaded_at']),
             models.Index(fields=['is_analyzed']),
+            # Paginación por cursor (keyset)
+            models.Index(fields=['-uploaded_at', '-id']),
         ]
     
     def __str__(self):
@@ -370,6 +382,8 @@ class DiagnosisResult(models.Model):
         indexes = [
             models.Index(fields=['predicted_class']),
             models.Index(fields=['status']),
+            # Paginación por cursor (keyset)
+            models.Index(fields=['-created_at', '-id']),
             models.Index(fields=['radiologist_review']),
             models.Index(fields=['treating_physician_approval']),
         ]
@@ -509,7 +523,14 @@ class DiagnosticStatistics(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='diagnostic_statistics')
     
+    PERIOD_TYPES = [
+        ('day', 'Diario'),
+        ('week', 'Semanal'),
+        ('month', 'Mensual'),
+    ]
+    
     # Período de análisis
+    period_type = models.CharField('Tipo de Período', max_length=10, choices=PERIOD_TYPES, default='day')
     period_start = models.DateField('Inicio del Período')
     period_end = models.DateField('Fin del Período')
     
@@ -578,6 +599,7 @@ class DiagnosticStatistics(models.Model):
         indexes = [
             models.Index(fields=['user', '-period_end']),
             models.Index(fields=['period_start', 'period_end']),
+            models.Index(fields=['period_type', 'user', '-period_start']),
         ]
         unique_together = ['user', 'period_start', 'period_end']
     
@@ -598,6 +620,39 @@ class DiagnosticStatistics(models.Model):
         return self.moderate_cases + self.severe_cases
 
 
+class RollupWatermark(models.Model):
+    """Marca de agua de los procesos de consolidación (hasta dónde se procesaron cambios)"""
+    
+    name = models.CharField('Proceso', max_length=50, unique=True)
+    processed_until = models.DateTimeField('Procesado Hasta', blank=True, null=True)
+    updated_at = models.DateTimeField('Última Actualización', auto_now=True)
+    
+    class Meta:
+        verbose_name = 'Marca de Consolidación'
+        verbose_name_plural = 'Marcas de Consolidación'
+    
+    def __str__(self):
+        return f"{self.name} - {self.processed_until}"
+
+
+class RollupPendingDay(models.Model):
+    """
+    Días de los que salió actividad (eliminaciones, fechas o usuarios reasignados).
+
+    La consolidación incremental ubica los períodos a recalcular por las fechas
+    actuales de las filas modificadas; estos días cubren las fechas anteriores.
+    """
+    
+    date = models.DateField('Fecha', unique=True)
+    
+    class Meta:
+        verbose_name = 'Día Pendiente de Consolidación'
+        verbose_name_plural = 'Días Pendientes de Consolidación'
+    
+    def __str__(self):
+        return str(self.date)
+
+
 class UserPerformanceMetrics(models.Model):
     """Métricas de rendimiento acumulativas por usuario"""
     
@@ -649,7 +704,15 @@ class UserPerformanceMetrics(models.Model):
     # Fechas
     first_diagnosis_date = models.DateTimeField('Primera Diagnosis', blank=True, null=True)
     last_activity_date = models.DateTimeField('Última Actividad', blank=True, null=True)
-    
+
+    # Acumuladores para el mantenimiento incremental de promedios y especialidad
+    completed_diagnoses_lifetime = models.IntegerField('Diagnósticos Completados (Histórico)', default=0)
+    confidence_sum = models.DecimalField('Suma de Confianza', max_digits=14, decimal_places=3, default=Decimal('0'))
+    processing_time_sum = models.FloatField('Suma Tiempos de Procesamiento (s)', default=0.0)
+    processing_time_samples = models.IntegerField('Diagnósticos con Tiempo de Procesamiento', default=0)
+    final_reports_lifetime = models.IntegerField('Reportes Finales (Histórico)', default=0)
+    class_counts = models.JSONField('Diagnósticos por Clase', default=dict, blank=True)
+
     # Auditoría
     created_at = models.DateTimeField('Fecha de Creación', auto_now_add=True)
     updated_at = models.DateTimeField('Última Actualización', auto_now=True)
@@ -727,7 +790,15 @@ class SystemStatistics(models.Model):
     
     # Usuarios activos
     active_users_today = models.IntegerField('Usuarios Activos Hoy', default=0)
-    
+
+    # Contadores base del mantenimiento incremental (las métricas derivadas se calculan con ellos)
+    daily_completed_diagnoses = models.IntegerField('Diagnósticos Completados Hoy', default=0)
+    normal_diagnoses = models.IntegerField('Total Diagnósticos Normales', default=0)
+    pneumonia_diagnoses = models.IntegerField('Total Diagnósticos de Neumonía', default=0)
+    processing_time_total = models.FloatField('Suma Tiempos de Procesamiento (s)', default=0.0)
+    processing_time_samples = models.IntegerField('Diagnósticos con Tiempo de Procesamiento', default=0)
+    is_final = models.BooleanField('Cerrado', default=False, help_text='Los días cerrados no se vuelven a modificar')
+
     # Auditoría
     created_at = models.DateTimeField('Fecha de Creación', auto_now_add=True)
     updated_at = models.DateTimeField('Última Actualización', auto_now=True)
@@ -741,4 +812,190 @@ class SystemStatistics(models.Model):
         ]
     
     def __str__(self):
-        return f"Estadísticas del Sistema - {self.date}"
\ No newline at end of file
+        return f"Estadísticas del Sistema - {self.date}"
+
+    def apply_derived_metrics(self):
+        """Calcula porcentajes, promedio de respuesta y tasa de éxito a partir de los contadores base"""
+        def percentage(part, total, default):
+            if not total:
+                return default
+            return Decimal(str(round(part / total * 100, 2)))
+
+        self.normal_percentage = percentage(self.normal_diagnoses, self.total_diagnoses, Decimal('0.00'))
+        self.pneumonia_percentage = percentage(self.pneumonia_diagnoses, self.total_diagnoses, Decimal('0.00'))
+        self.api_success_rate = percentage(
+            self.daily_completed_diagnoses, self.daily_diagnoses_made, Decimal('100.00')
+        )
+        self.average_system_response_time = (
+            self.processing_time_total / self.processing_time_samples
+            if self.processing_time_samples else 0.0
+        )
+        return self
+
+
+class DailyActiveUser(models.Model):
+    """Usuarios con actividad registrada en un día (fuente exacta de active_users_today)"""
+
+    date = models.DateField('Fecha')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_activity')
+
+    class Meta:
+        verbose_name = 'Usuario Activo por Día'
+        verbose_name_plural = 'Usuarios Activos por Día'
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'user'], name='unique_daily_active_user'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} - {self.date}"
+
+
+class Participation(models.Model):
+    """
+    Índice desnormalizado de participación: qué usuario intervino en qué entidad y con qué rol.
+
+    Se mantiene con signals (ver apps.diagnosis.participation) y permite filtrar por
+    alcance con una sola semi-unión sobre esta tabla en lugar de un OR de joins.
+    `source_id` identifica el registro que origina la participación (por ejemplo la
+    radiografía subida que vincula al usuario con el paciente).
+    """
+
+    ENTITY_TYPES = [
+        ('patient', 'Paciente'),
+        ('xray', 'Radiografía'),
+        ('diagnosis', 'Diagnóstico'),
+        ('report', 'Reporte'),
+    ]
+
+    ROLES = [
+        ('creator', 'Registro'),
+        ('requester', 'Solicitante'),
+        ('uploader', 'Carga de Radiografía'),
+        ('radiologist', 'Radiólogo'),
+        ('reviewer', 'Revisor'),
+        ('approver', 'Aprobación Médica'),
+        ('receiver', 'Recepción de Reporte'),
+    ]
+
+    entity_type = models.CharField('Tipo de Entidad', max_length=20, choices=ENTITY_TYPES)
+    entity_id = models.UUIDField('ID de Entidad')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='participations')
+    role = models.CharField('Rol', max_length=20, choices=ROLES)
+    source_id = models.UUIDField('ID de Origen')
+
+    class Meta:
+        verbose_name = 'Participación'
+        verbose_name_plural = 'Participaciones'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['entity_type', 'entity_id', 'user', 'role', 'source_id'],
+                name='unique_participation',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['entity_type', 'user', 'entity_id']),
+            models.Index(fields=['source_id']),
+        ]
+
+    def __str__(self):
+        return f"{self.user} - {self.role} - {self.entity_type} {self.entity_id}"
+
+
+class MetricCounter(models.Model):
+    """
+    Contador horario pre-agregado de una métrica (serie de tiempo).
+
+    Se incrementa con signals (ver apps.diagnosis.timeseries); las consultas de
+    tendencia agregan las horas a día/semana/mes sin recorrer las tablas de origen.
+    """
+
+    bucket = models.DateTimeField('Hora (UTC)')
+    metric = models.CharField('Métrica', max_length=50)
+    dimension = models.CharField('Dimensión', max_length=50, blank=True, default='')
+    count = models.IntegerField('Conteo', default=0)
+
+    class Meta:
+        verbose_name = 'Contador de Métrica'
+        verbose_name_plural = 'Contadores de Métricas'
+        constraints = [
+            models.UniqueConstraint(fields=['metric', 'bucket', 'dimension'], name='unique_metric_counter'),
+        ]
+
+    def __str__(self):
+        return f"{self.metric}[{self.dimension}] {self.bucket:%Y-%m-%d %H}:00 = {self.count}"
+
+
+class DistinctSketch(models.Model):
+    """
+    Sketch HyperLogLog de valores distintos de una métrica por día y alcance.
+
+    Los registros (un byte por registro) se combinan con el máximo elemento a
+    elemento, de modo que el conteo de una semana o un mes se obtiene uniendo
+    los sketches diarios (ver apps.diagnosis.sketches).
+    """
+
+    metric = models.CharField('Métrica', max_length=50)
+    scope = models.CharField('Alcance', max_length=60, default='all')
+    date = models.DateField('Fecha')
+    registers = models.BinaryField('Registros')
+    updated_at = models.DateTimeField('Última Actualización', auto_now=True)
+
+    class Meta:
+        verbose_name = 'Sketch de Distintos'
+        verbose_name_plural = 'Sketches de Distintos'
+        constraints = [
+            models.UniqueConstraint(fields=['metric', 'scope', 'date'], name='unique_distinct_sketch'),
+        ]
+
+    def __str__(self):
+        return f"{self.metric} [{self.scope}] {self.date}"
+
+
+class SearchEntry(models.Model):
+    """
+    Documento de búsqueda de texto completo de un registro.
+
+    `body` guarda el texto indexable ya normalizado (minúsculas, sin tildes). El
+    índice propio del motor (FTS5 en SQLite, GIN sobre tsvector en PostgreSQL)
+    se crea en la migración y se consulta desde apps.diagnosis.search.
+    """
+
+    entity_type = models.CharField('Tipo de Entidad', max_length=40)
+    entity_id = models.UUIDField('ID de Entidad')
+    body = models.TextField('Texto Indexado')
+
+    class Meta:
+        verbose_name = 'Entrada de Búsqueda'
+        verbose_name_plural = 'Entradas de Búsqueda'
+        constraints = [
+            models.UniqueConstraint(fields=['entity_type', 'entity_id'], name='unique_search_entry'),
+        ]
+
+    def __str__(self):
+        return f"{self.entity_type}:{self.entity_id}"
+
+
+class PatientLookupKey(models.Model):
+    """
+    Clave de autocompletado de un paciente activo.
+
+    Cada paciente tiene una clave por su DNI, por sus apellidos completos y por
+    cada apellido siguiente, normalizadas (minúsculas, sin tildes). La búsqueda
+    por prefijo es un rango sobre el índice de `key` (ver apps.diagnosis.autocomplete).
+    """
+
+    key = models.CharField('Clave', max_length=120)
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='lookup_keys')
+
+    class Meta:
+        verbose_name = 'Clave de Autocompletado'
+        verbose_name_plural = 'Claves de Autocompletado'
+        indexes = [
+            models.Index(fields=['key', 'patient'], name='diagnosis_lookup_key_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['patient', 'key'], name='unique_patient_lookup_key'),
+        ]
+
+    def __str__(self):
+        return self.key
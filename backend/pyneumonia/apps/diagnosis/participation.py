@@ -0,0 +1,187 @@
+"""
+Índice de participación de usuarios en entidades clínicas
+
+Cada registro de origen (paciente, orden, radiografía, diagnóstico, reporte)
+genera un conjunto de filas Participation. Al guardarse se reemplazan las filas
+de ese origen y al eliminarse se borran; así el índice refleja exactamente las
+relaciones actuales sin recorrer otras tablas.
+
+`participant_scoped` convierte el filtro por alcance en una semi-unión
+(`pk IN (SELECT entity_id ...)`) sobre una sola tabla indexada, sin joins ni
+DISTINCT.
+"""
+from django.db import transaction
+
+from .models import (
+    Patient, MedicalOrder, XRayImage, DiagnosisResult, MedicalReport, Participation
+)
+
+ENTITY_TYPES = {
+    Patient: 'patient',
+    XRayImage: 'xray',
+    DiagnosisResult: 'diagnosis',
+    MedicalReport: 'report',
+}
+
+# Campos de cada modelo de origen que alteran sus participaciones
+SOURCE_FIELDS = {
+    Patient: ('created_by_id',),
+    MedicalOrder: ('patient_id', 'requested_by_id'),
+    XRayImage: ('patient_id', 'uploaded_by_id'),
+    DiagnosisResult: ('xray_id', 'radiologist_review_id', 'reviewed_by_id', 'treating_physician_approval_id'),
+    MedicalReport: ('created_by_id', 'received_by_id'),
+}
+
+DIAGNOSIS_ROLES = (
+    ('radiologist_review_id', 'radiologist'),
+    ('reviewed_by_id', 'reviewer'),
+    ('treating_physician_approval_id', 'approver'),
+)
+
+
+def _row(entity_type, entity_id, user_id, role, source_id):
+    return Participation(
+        entity_type=entity_type, entity_id=entity_id, user_id=user_id, role=role, source_id=source_id
+    )
+
+
+def diagnosis_facts(diagnosis_id, xray_id, patient_id, uploader_id, role_user_ids):
+    """Filas de un diagnóstico: carga (solo el diagnóstico) y roles clínicos (diagnóstico, radiografía y paciente)"""
+    rows = []
+    if uploader_id:
+        rows.append(_row('diagnosis', diagnosis_id, uploader_id, 'uploader', diagnosis_id))
+    for field, role in DIAGNOSIS_ROLES:
+        user_id = role_user_ids.get(field)
+        if not user_id:
+            continue
+        for entity_type, entity_id in (('diagnosis', diagnosis_id), ('xray', xray_id), ('patient', patient_id)):
+            rows.append(_row(entity_type, entity_id, user_id, role, diagnosis_id))
+    return rows
+
+
+def facts_for(instance):
+    """Filas de participación que genera un registro de origen"""
+    rows = []
+    if isinstance(instance, Patient):
+        if instance.created_by_id:
+            rows.append(_row('patient', instance.pk, instance.created_by_id, 'creator', instance.pk))
+
+    elif isinstance(instance, MedicalOrder):
+        if instance.requested_by_id:
+            rows.append(_row('patient', instance.patient_id, instance.requested_by_id, 'requester', instance.pk))
+
+    elif isinstance(instance, XRayImage):
+        if instance.uploaded_by_id:
+            for entity_type, entity_id in (('xray', instance.pk), ('patient', instance.patient_id)):
+                rows.append(_row(entity_type, entity_id, instance.uploaded_by_id, 'uploader', instance.pk))
+
+    elif isinstance(instance, DiagnosisResult):
+        if DiagnosisResult.xray.is_cached(instance):
+            xray = {'patient_id': instance.xray.patient_id, 'uploaded_by_id': instance.xray.uploaded_by_id}
+        else:
+            xray = XRayImage.objects.filter(pk=instance.xray_id).values('patient_id', 'uploaded_by_id').first()
+        if xray is not None:
+            rows.extend(diagnosis_facts(
+                instance.pk, instance.xray_id, xray['patient_id'], xray['uploaded_by_id'],
+                {field: getattr(instance, field) for field, _ in DIAGNOSIS_ROLES},
+            ))
+
+    elif isinstance(instance, MedicalReport):
+        for field, role in (('created_by_id', 'creator'), ('received_by_id', 'receiver')):
+            user_id = getattr(instance, field)
+            if user_id:
+                rows.append(_row('report', instance.pk, user_id, role, instance.pk))
+    return rows
+
+
+def sync_source(instance):
+    """Reemplaza las participaciones generadas por `instance`"""
+    with transaction.atomic(savepoint=False):
+        Participation.objects.filter(source_id=instance.pk).delete()
+        Participation.objects.bulk_create(facts_for(instance), ignore_conflicts=True)
+
+
+def sync_sources(instances):
+    """Reemplaza en bloque las participaciones generadas por `instances`"""
+    with transaction.atomic(savepoint=False):
+        Participation.objects.filter(source_id__in=[instance.pk for instance in instances]).delete()
+        add_sources(instances)
+
+
+def add_sources(instances):
+    """Agrega las participaciones de registros recién creados en bloque (p. ej. una importación)"""
+    rows = [row for instance in instances for row in facts_for(instance)]
+    Participation.objects.bulk_create(rows, batch_size=1000, ignore_conflicts=True)
+
+
+def remove_source(source_id):
+    Participation.objects.filter(source_id=source_id).delete()
+
+
+def sync_dependents(xray):
+    """
+    Las participaciones de carga en el diagnóstico dependen de la radiografía:
+    si cambia quién la subió o su paciente, se regeneran las del diagnóstico.
+    """
+    diagnosis = DiagnosisResult.objects.filter(xray_id=xray.pk).first()
+    if diagnosis is not None:
+        sync_source(diagnosis)
+
+
+def participant_ids(model, user_ids):
+    """Subconsulta con los IDs de `model` en los que participó alguno de `user_ids`"""
+    return Participation.objects.filter(
+        entity_type=ENTITY_TYPES[model], user_id__in=user_ids
+    ).values('entity_id')
+
+
+def participant_scoped(model, user_ids, queryset=None):
+    """Queryset de `model` restringido a entidades con participación de `user_ids`"""
+    queryset = model.objects.all() if queryset is None else queryset
+    return queryset.filter(pk__in=participant_ids(model, user_ids))
+
+
+def backfill(batch_size=2000, stdout=None):
+    """
+    Reconstruye el índice completo a partir de las tablas de origen.
+
+    Recorre cada modelo de origen por lotes, cargando solo los campos que
+    generan participaciones, e inserta en bloque.
+
+    Returns:
+        int: Filas de participación generadas
+    """
+    def insert(rows):
+        return len(Participation.objects.bulk_create(rows, ignore_conflicts=True))
+
+    total = 0
+    xrays = {
+        pk: (patient_id, uploader_id)
+        for pk, patient_id, uploader_id in XRayImage.objects.values_list('pk', 'patient_id', 'uploaded_by_id')
+    }
+
+    with transaction.atomic():
+        Participation.objects.all().delete()
+
+        for model, fields in SOURCE_FIELDS.items():
+            rows = []
+            for values in model.objects.values('pk', *fields).order_by().iterator(chunk_size=batch_size):
+                rows.extend(_facts_from_values(model, values, xrays))
+                if len(rows) >= batch_size:
+                    total += insert(rows)
+                    rows = []
+            if rows:
+                total += insert(rows)
+            if stdout:
+                stdout.write(f'{model._meta.verbose_name_plural}: {total} participaciones acumuladas')
+    return total
+
+
+def _facts_from_values(model, values, xrays):
+    """Equivalente de facts_for sobre diccionarios de valores, usando las radiografías precargadas"""
+    if model is DiagnosisResult:
+        xray = xrays.get(values['xray_id'])
+        if xray is None:
+            return []
+        return diagnosis_facts(values['pk'], values['xray_id'], *xray, values)
+    return facts_for(model(**{('id' if name == 'pk' else name): value for name, value in values.items()}))
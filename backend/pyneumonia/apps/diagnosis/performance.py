@@ -0,0 +1,349 @@
+"""
+Mantenimiento incremental de UserPerformanceMetrics
+
+Cada diagnóstico y reporte aporta a los contadores de los usuarios que
+participan en él (radiólogo, revisor, médico que aprueba, autor del reporte).
+Ante un alta, un cambio o una eliminación se calcula el aporte anterior y el
+nuevo, y solo la diferencia se aplica sobre la fila de métricas (bloqueada con
+select_for_update). Los promedios se derivan de sumas y conteos acumulados, sin
+volver a recorrer las tablas.
+
+`rebuild_user_performance_metrics` recalcula todos los usuarios (o un
+subconjunto) con consultas agrupadas y un único upsert; se usa para sembrar y
+reparar las métricas.
+"""
+from collections import Counter, defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, Max, Min, Q, Sum
+
+from .models import DiagnosisResult, MedicalReport, UserPerformanceMetrics
+
+# Mínimo de casos de una clase para considerarla especialidad
+SPECIALTY_MIN_CASES = 10
+
+SPECIALTY_LABELS = {
+    'NORMAL': 'Diagnósticos Normales',
+    'PNEUMONIA_BACTERIA': 'Neumonía Bacteriana',
+    'PNEUMONIA_BACTERIAL': 'Neumonía Bacterial',
+    'PNEUMONIA_VIRAL': 'Neumonía Viral',
+}
+
+COUNTER_FIELDS = (
+    'total_diagnoses_lifetime', 'total_reports_lifetime', 'total_reviews_lifetime',
+    'completed_diagnoses_lifetime', 'confidence_sum', 'processing_time_sum',
+    'processing_time_samples', 'final_reports_lifetime',
+)
+
+DERIVED_FIELDS = (
+    'lifetime_average_confidence', 'lifetime_average_processing_time',
+    'accuracy_score', 'quality_score', 'specialty_focus',
+)
+
+DIAGNOSIS_FIELDS = (
+    'radiologist_review_id', 'reviewed_by_id', 'treating_physician_approval_id',
+    'predicted_class', 'status', 'confidence', 'processing_time',
+)
+
+REPORT_FIELDS = ('created_by_id', 'status')
+
+# Marca de tiempo de actividad asociada a cada rol sobre un diagnóstico
+ACTIVITY_FIELDS = (
+    ('radiologist_review_id', 'radiologist_reviewed_at'),
+    ('reviewed_by_id', 'reviewed_at'),
+    ('treating_physician_approval_id', 'approved_at'),
+)
+
+
+def apply_derived_metrics(metrics):
+    """Recalcula promedios, puntuaciones y especialidad a partir de los acumuladores"""
+    average_confidence = (
+        Decimal(metrics.confidence_sum) / metrics.completed_diagnoses_lifetime
+        if metrics.completed_diagnoses_lifetime else Decimal('0.00')
+    )
+    metrics.lifetime_average_confidence = Decimal(str(round(float(average_confidence), 2)))
+    metrics.lifetime_average_processing_time = (
+        metrics.processing_time_sum / metrics.processing_time_samples
+        if metrics.processing_time_samples else 0.0
+    )
+
+    # Accuracy score basado en confianza promedio y completitud
+    accuracy_score = min(float(average_confidence) * 100, 100.0) if metrics.total_diagnoses_lifetime else 0.0
+    metrics.accuracy_score = Decimal(str(round(accuracy_score, 2)))
+
+    # Quality score basado en reportes finales sobre reportes generados
+    quality_score = (
+        metrics.final_reports_lifetime / metrics.total_reports_lifetime * 100
+        if metrics.total_reports_lifetime else 0.0
+    )
+    metrics.quality_score = Decimal(str(round(quality_score, 2)))
+
+    # Especialización: clase con más diagnósticos
+    metrics.specialty_focus = None
+    if metrics.class_counts:
+        predicted_class, count = max(metrics.class_counts.items(), key=lambda item: item[1])
+        if count >= SPECIALTY_MIN_CASES:
+            metrics.specialty_focus = SPECIALTY_LABELS.get(predicted_class, predicted_class)
+    return metrics
+
+
+# ==================== APORTES POR ENTIDAD ====================
+
+def diagnosis_contributions(state):
+    """Aporte de un diagnóstico a las métricas de cada usuario participante"""
+    contributions = defaultdict(Counter)
+    radiologist_id = state['radiologist_review_id']
+    if radiologist_id:
+        contribution = contributions[radiologist_id]
+        contribution['total_diagnoses_lifetime'] += 1
+        contribution[f"class:{state['predicted_class']}"] += 1
+        if state['status'] == 'completed':
+            contribution['completed_diagnoses_lifetime'] += 1
+            contribution['confidence_sum'] += Decimal(str(state['confidence'] or 0))
+            if state['processing_time'] is not None:
+                contribution['processing_time_sum'] += state['processing_time']
+                contribution['processing_time_samples'] += 1
+    for field in ('reviewed_by_id', 'treating_physician_approval_id'):
+        if state[field]:
+            contributions[state[field]]['total_reviews_lifetime'] += 1
+    return contributions
+
+
+def report_contributions(state):
+    """Aporte de un reporte a las métricas de su autor"""
+    contributions = defaultdict(Counter)
+    if state['created_by_id']:
+        contribution = contributions[state['created_by_id']]
+        contribution['total_reports_lifetime'] += 1
+        contribution['final_reports_lifetime'] += int(state['status'] == 'final')
+    return contributions
+
+
+def _states(instance, fields, created, changes):
+    """Estado anterior y actual de los campos relevantes de una instancia"""
+    current = {name: getattr(instance, name) for name in fields}
+    if created:
+        return None, current
+    previous = {name: changes[name][0] if name in changes else value for name, value in current.items()}
+    return previous, current
+
+
+def _difference(before, after):
+    """Diferencia de aportes por usuario (after - before), omitiendo usuarios sin cambios"""
+    deltas = {}
+    for user_id in set(before) | set(after):
+        delta = Counter(after.get(user_id, {}))
+        delta.subtract(before.get(user_id, {}))
+        delta = {key: value for key, value in delta.items() if value}
+        if delta:
+            deltas[user_id] = delta
+    return deltas
+
+
+def apply_user_deltas(user_id, deltas, first_diagnosis=None, last_activity=None):
+    """
+    Aplica los incrementos de un usuario sobre su fila de métricas.
+
+    Si el usuario aún no tiene fila se recalcula desde el historial, que ya
+    incluye el cambio en curso (los signals corren después de escribirlo).
+    """
+    with transaction.atomic(savepoint=False):
+        metrics = UserPerformanceMetrics.objects.select_for_update().filter(user_id=user_id).first()
+        if metrics is None:
+            rebuild_user_performance_metrics([user_id])
+            return UserPerformanceMetrics.objects.get(user_id=user_id)
+        class_counts = dict(metrics.class_counts or {})
+        for key, value in deltas.items():
+            if key.startswith('class:'):
+                predicted_class = key.split(':', 1)[1]
+                class_counts[predicted_class] = class_counts.get(predicted_class, 0) + value
+                if class_counts[predicted_class] <= 0:
+                    del class_counts[predicted_class]
+            elif key == 'confidence_sum':
+                metrics.confidence_sum = Decimal(metrics.confidence_sum) + value
+            else:
+                setattr(metrics, key, getattr(metrics, key) + value)
+        metrics.class_counts = class_counts
+
+        if first_diagnosis and (not metrics.first_diagnosis_date or first_diagnosis < metrics.first_diagnosis_date):
+            metrics.first_diagnosis_date = first_diagnosis
+        if last_activity and (not metrics.last_activity_date or last_activity > metrics.last_activity_date):
+            metrics.last_activity_date = last_activity
+
+        apply_derived_metrics(metrics).save()
+    return metrics
+
+
+def _diagnosis_change(instance, created, changes):
+    """Incrementos por usuario, primer diagnóstico y última actividad que aporta un cambio"""
+    previous, current = _states(instance, DIAGNOSIS_FIELDS, created, changes)
+    deltas = _difference(diagnosis_contributions(previous) if previous else {}, diagnosis_contributions(current))
+
+    activity = {}
+    for user_field, timestamp_field in ACTIVITY_FIELDS:
+        user_id = getattr(instance, user_field)
+        if user_id and timestamp_field in changes and changes[timestamp_field][1] is not None:
+            activity[user_id] = changes[timestamp_field][1]
+
+    first_diagnosis = {}
+    radiologist_id = instance.radiologist_review_id
+    if radiologist_id and (created or 'radiologist_review_id' in changes):
+        first_diagnosis[radiologist_id] = instance.created_at
+    return deltas, first_diagnosis, activity
+
+
+def record_diagnosis_change(instance, created, changes):
+    """Actualiza las métricas de los participantes ante el alta o cambio de un diagnóstico"""
+    deltas, first_diagnosis, activity = _diagnosis_change(instance, created, changes)
+    for user_id in set(deltas) | set(activity):
+        apply_user_deltas(
+            user_id, deltas.get(user_id, {}),
+            first_diagnosis=first_diagnosis.get(user_id), last_activity=activity.get(user_id),
+        )
+
+
+def record_diagnosis_changes(instances):
+    """Como record_diagnosis_change para varios diagnósticos, con una actualización por usuario"""
+    deltas, first_diagnosis, activity = defaultdict(Counter), {}, {}
+    for instance in instances:
+        instance_deltas, instance_first, instance_activity = _diagnosis_change(
+            instance, False, getattr(instance, '_field_changes', {})
+        )
+        for user_id, user_deltas in instance_deltas.items():
+            deltas[user_id].update(user_deltas)
+        for user_id, moment in instance_first.items():
+            first_diagnosis[user_id] = min(moment, first_diagnosis.get(user_id, moment))
+        for user_id, moment in instance_activity.items():
+            activity[user_id] = max(moment, activity.get(user_id, moment))
+    for user_id in set(deltas) | set(activity):
+        apply_user_deltas(
+            user_id, {key: value for key, value in deltas.get(user_id, {}).items() if value},
+            first_diagnosis=first_diagnosis.get(user_id), last_activity=activity.get(user_id),
+        )
+
+
+def record_diagnosis_delete(instance):
+    current = {name: getattr(instance, name) for name in DIAGNOSIS_FIELDS}
+    for user_id, deltas in _difference(diagnosis_contributions(current), {}).items():
+        apply_user_deltas(user_id, deltas)
+
+
+def record_report_change(instance, created, changes):
+    """Actualiza las métricas del autor ante el alta o cambio de estado de un reporte"""
+    previous, current = _states(instance, REPORT_FIELDS, created, changes)
+    deltas = _difference(report_contributions(previous) if previous else {}, report_contributions(current))
+    for user_id, user_deltas in deltas.items():
+        apply_user_deltas(user_id, user_deltas)
+
+
+def record_report_delete(instance):
+    current = {name: getattr(instance, name) for name in REPORT_FIELDS}
+    for user_id, deltas in _difference(report_contributions(current), {}).items():
+        apply_user_deltas(user_id, deltas)
+
+
+# ==================== RECÁLCULO COMPLETO ====================
+
+def rebuild_user_performance_metrics(user_ids=None):
+    """
+    Recalcula las métricas desde las tablas de origen con consultas agrupadas.
+
+    Args:
+        user_ids: Usuarios a recalcular; None recalcula todos (incluidos los que
+            ya tenían métricas y dejaron de tener actividad)
+
+    Returns:
+        int: Cantidad de filas de métricas escritas
+    """
+    diagnoses, reports, metrics_model = DiagnosisResult, MedicalReport, UserPerformanceMetrics
+
+    def restrict(queryset, field):
+        if user_ids is None:
+            return queryset.filter(**{f'{field}__isnull': False})
+        return queryset.filter(**{f'{field}__in': user_ids})
+
+    rows = defaultdict(lambda: {'class_counts': {}})
+    completed = Q(status='completed')
+
+    for entry in restrict(diagnoses.objects, 'radiologist_review').values('radiologist_review').annotate(
+        total=Count('pk'),
+        completed=Count('pk', filter=completed),
+        confidence=Sum('confidence', filter=completed),
+        time_sum=Sum('processing_time', filter=completed),
+        time_samples=Count('processing_time', filter=completed),
+        first=Min('created_at'),
+        last=Max('radiologist_reviewed_at'),
+    ).order_by():
+        rows[entry['radiologist_review']].update(
+            total_diagnoses_lifetime=entry['total'],
+            completed_diagnoses_lifetime=entry['completed'],
+            confidence_sum=entry['confidence'] or Decimal('0'),
+            processing_time_sum=entry['time_sum'] or 0.0,
+            processing_time_samples=entry['time_samples'],
+            first_diagnosis_date=entry['first'],
+            activity=[entry['last']],
+        )
+
+    for entry in restrict(diagnoses.objects, 'radiologist_review').values(
+        'radiologist_review', 'predicted_class'
+    ).annotate(count=Count('pk')).order_by():
+        rows[entry['radiologist_review']]['class_counts'][entry['predicted_class']] = entry['count']
+
+    for user_field, timestamp_field in ACTIVITY_FIELDS[1:]:
+        field = user_field[:-3]
+        for entry in restrict(diagnoses.objects, field).values(field).annotate(
+            count=Count('pk'), last=Max(timestamp_field)
+        ).order_by():
+            row = rows[entry[field]]
+            row['total_reviews_lifetime'] = row.get('total_reviews_lifetime', 0) + entry['count']
+            row.setdefault('activity', []).append(entry['last'])
+
+    for entry in restrict(reports.objects, 'created_by').values('created_by').annotate(
+        total=Count('pk'), final=Count('pk', filter=Q(status='final'))
+    ).order_by():
+        rows[entry['created_by']].update(
+            total_reports_lifetime=entry['total'], final_reports_lifetime=entry['final']
+        )
+
+    target_ids = set(rows)
+    if user_ids is None:
+        target_ids |= set(metrics_model.objects.values_list('user_id', flat=True))
+    else:
+        target_ids |= set(user_ids)
+
+    metrics_rows = []
+    for user_id in target_ids:
+        row = rows.get(user_id, {'class_counts': {}})
+        activity = [timestamp for timestamp in row.pop('activity', []) if timestamp]
+        metrics = metrics_model(
+            user_id=user_id,
+            last_activity_date=max(activity, default=None),
+            **{name: value for name, value in row.items()}
+        )
+        metrics_rows.append(apply_derived_metrics(metrics))
+
+    metrics_model.objects.bulk_create(
+        metrics_rows,
+        update_conflicts=True,
+        unique_fields=['user'],
+        update_fields=[
+            *COUNTER_FIELDS, *DERIVED_FIELDS, 'class_counts',
+            'first_diagnosis_date', 'last_activity_date', 'updated_at',
+        ],
+    )
+    return len(metrics_rows)
+
+
+def update_user_performance_metrics(user):
+    """
+    Recalcula las métricas de rendimiento de un usuario
+
+    Args:
+        user: Usuario del cual actualizar métricas
+
+    Returns:
+        UserPerformanceMetrics: Métricas actualizadas
+    """
+    rebuild_user_performance_metrics([user.pk])
+    return UserPerformanceMetrics.objects.get(user=user)
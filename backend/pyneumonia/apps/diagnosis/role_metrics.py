@@ -0,0 +1,317 @@
+"""
+Métricas del dashboard por rol, declaradas como datos
+
+Cada rol tiene un proveedor: un dict {clave de respuesta: especificación}. Las
+especificaciones (`count`, `average`, `related`, `ref`, `total`, `constant`,
+`from_groups`) describen la métrica sin ejecutarla; `bind_role_metrics` registra
+todas las del rol en el CounterSet del dashboard, de modo que se resuelven en el
+mismo aggregate() de su fuente que los contadores generales. Agregar una métrica
+agrega una columna al aggregate, no una consulta.
+
+El rol de un usuario se obtiene de su grupo principal según
+`DASHBOARD_ROLE_GROUPS` ({rol: [id o nombre exacto de grupo]}); los
+superusuarios tienen el rol 'admin' y los grupos sin rol configurado, 'generic'.
+
+Fuentes disponibles: diagnoses, patients, xrays, reports, orders, users.
+"""
+from django.conf import settings
+from django.contrib.auth.models import Group
+from django.db.models import Avg, Count, Q
+
+from apps.security.models import User
+from .models import XRayImage, MedicalOrder
+from .aggregation import has_related
+from .system_stats import PNEUMONIA_CLASSES
+
+DEFAULT_ROLE_GROUPS = {
+    'radiologist': ['Radiólogos'],
+    'physician': ['Médicos'],
+    'reception': ['Recepcionistas'],
+}
+
+
+class Param:
+    """Valor que se resuelve al evaluar (usuario actual, inicio del día...)"""
+
+    def __init__(self, name):
+        self.name = name
+
+    def resolve(self, context):
+        return context[self.name]
+
+
+USER = Param('user')
+TODAY = Param('today_start')
+WEEK_AGO = Param('one_week_ago')
+MONTH_AGO = Param('thirty_days_ago')
+
+
+def _lookups(lookups, context):
+    return {
+        name: value.resolve(context) if isinstance(value, Param) else value
+        for name, value in lookups.items()
+    }
+
+
+class count:
+    """Filas de `source` que cumplen `lookups` (todas si no hay)"""
+
+    def __init__(self, source, **lookups):
+        self.source, self.lookups = source, lookups
+
+    def bind(self, counters, alias, context):
+        condition = Q(**_lookups(self.lookups, context)) if self.lookups else None
+        counters.count(self.source, alias, condition)
+
+    def value(self, results, alias):
+        return results[self.source][alias]
+
+
+class related(count):
+    """Filas de `source` con (o sin, si `negate`) un `model` relacionado que cumple `lookups`"""
+
+    def __init__(self, source, model, link_field, negate=False, **lookups):
+        super().__init__(source, **lookups)
+        self.model, self.link_field, self.negate = model, link_field, negate
+
+    def bind(self, counters, alias, context):
+        condition = has_related(self.model, self.link_field, **_lookups(self.lookups, context))
+        counters.count(self.source, alias, ~condition if self.negate else condition)
+
+
+class average:
+    """Promedio de `field` en `source`, redondeado a `digits` decimales"""
+
+    def __init__(self, source, field, digits=2):
+        self.source, self.field, self.digits = source, field, digits
+
+    def bind(self, counters, alias, context):
+        counters.add(self.source, alias, Avg(self.field))
+
+    def value(self, results, alias):
+        return round(float(results[self.source][alias] or 0), self.digits)
+
+
+class ref:
+    """Reutiliza un contador general del dashboard (no agrega columnas)"""
+
+    def __init__(self, source, metric):
+        self.source, self.metric = source, metric
+
+    def bind(self, counters, alias, context):
+        pass
+
+    def value(self, results, alias):
+        return results[self.source][self.metric]
+
+
+class total:
+    """Suma de otras especificaciones"""
+
+    def __init__(self, *parts):
+        self.parts = parts
+
+    def bind(self, counters, alias, context):
+        for index, part in enumerate(self.parts):
+            part.bind(counters, f'{alias}_{index}', context)
+
+    def value(self, results, alias):
+        return sum(part.value(results, f'{alias}_{index}') for index, part in enumerate(self.parts))
+
+
+class constant:
+    def __init__(self, value):
+        self.constant = value
+
+    def bind(self, counters, alias, context):
+        pass
+
+    def value(self, results, alias):
+        return self.constant
+
+
+class from_groups:
+    """Valor calculado sobre el desglose de grupos (una consulta agrupada compartida)"""
+    query = 'groups'
+
+    def __init__(self, reducer):
+        self.reducer = reducer
+
+    def bind(self, counters, alias, context):
+        pass
+
+    def value(self, results, alias):
+        return self.reducer(results[self.query])
+
+
+def group_breakdown():
+    """Usuarios y permisos por grupo en una sola consulta agrupada"""
+    return list(Group.objects.annotate(
+        member_count=Count('user', distinct=True),
+        permission_count=Count('permissions', distinct=True),
+    ).values('name', 'member_count', 'permission_count'))
+
+
+# Consultas adicionales que pueden requerir las especificaciones
+EXTRA_QUERIES = {
+    'groups': group_breakdown,
+}
+
+PNEUMONIA = {'predicted_class__in': PNEUMONIA_CLASSES}
+
+ROLE_METRICS = {
+    'admin': {
+        'total_users': count('users'),
+        'active_users': count('users', is_active=True),
+        'inactive_users': count('users', is_active=False),
+        'total_groups': from_groups(len),
+        'users_by_group': from_groups(lambda groups: {group['name']: group['member_count'] for group in groups}),
+        'users_without_group': related('users', User.groups.through, 'user', negate=True),
+        'new_users_week': count('users', date_joined__gte=WEEK_AGO),
+
+        # Actividad de login
+        'logins_today': count('users', last_login__gte=TODAY),
+        'logins_week': count('users', last_login__gte=WEEK_AGO),
+        'logins_month': count('users', last_login__gte=MONTH_AGO),
+
+        # Métricas del sistema
+        'total_permissions': from_groups(lambda groups: sum(group['permission_count'] for group in groups)),
+        'system_health': constant('optimal'),  # Puede expandirse con métricas reales
+    },
+    'radiologist': {
+        'total_analyses': ref('diagnoses', 'total'),
+        'my_reviews': count('diagnoses', radiologist_review=USER),
+        'pending_analyses': ref('xrays', 'pending_analysis'),
+        'pending_radiologist_review': count('diagnoses', radiologist_review__isnull=True, status='completed'),
+
+        # Métricas de calidad
+        'avg_confidence': average('diagnoses', 'confidence', digits=3),
+        'high_quality_xrays': count('xrays', quality__in=['excellent', 'good']),
+        'low_quality_xrays': count('xrays', quality__in=['fair', 'poor']),
+
+        # Productividad
+        'analyses_today': count('diagnoses', created_at__gte=TODAY),
+        'my_reviews_today': count('diagnoses', radiologist_review=USER, radiologist_reviewed_at__gte=TODAY),
+        'avg_processing_time': average('diagnoses', 'processing_time'),
+
+        # Distribución de severidad
+        'severe_cases': count('diagnoses', severity='severe'),
+        'moderate_cases': count('diagnoses', severity='moderate'),
+        'mild_cases': count('diagnoses', severity='mild'),
+    },
+    'physician': {
+        'total_patients_treated': ref('patients', 'total'),
+        'my_reviews': count('diagnoses', reviewed_by=USER),
+        'my_approvals': count('diagnoses', treating_physician_approval=USER),
+
+        # Casos críticos
+        'critical_cases': count('diagnoses', severity='severe', is_reviewed=False),
+        'reviews_completed': count('diagnoses', reviewed_by=USER, is_reviewed=True),
+        'reviews_pending': ref('diagnoses', 'pending_reviews'),
+        'approvals_pending': count(
+            'diagnoses', treating_physician_approval__isnull=True, radiologist_review__isnull=False
+        ),
+
+        # Casos de neumonía
+        'pneumonia_cases_active': count('diagnoses', is_reviewed=False, **PNEUMONIA),
+        'pneumonia_cases_my_review': count('diagnoses', reviewed_by=USER, **PNEUMONIA),
+
+        # Reportes
+        'reports_generated': count('reports', created_by=USER),
+        'reports_pending': count('reports', created_by=USER, status='draft'),
+        'reports_today': count('reports', created_by=USER, created_at__gte=TODAY),
+
+        # Órdenes médicas
+        'orders_requested': count('orders', requested_by=USER),
+        'orders_pending': count('orders', requested_by=USER, status='pending'),
+    },
+    'reception': {
+        # Registro de pacientes
+        'patients_registered_today': count('patients', created_at__gte=TODAY),
+        'patients_registered_week': ref('patients', 'new_week'),
+        'patients_registered_by_me': count('patients', created_by=USER),
+
+        # Estado de pacientes
+        'patients_with_pending_xrays': related('patients', XRayImage, 'patient', is_analyzed=False),
+        'patients_with_pending_orders': related('patients', MedicalOrder, 'patient', status='pending'),
+        'active_patients': count('patients', is_active=True),
+
+        # Radiografías
+        'xrays_uploaded_today': count('xrays', uploaded_at__gte=TODAY),
+        'xrays_uploaded_by_me': count('xrays', uploaded_by=USER),
+        'xrays_pending_analysis': ref('xrays', 'pending_analysis'),
+
+        # Órdenes médicas
+        'orders_today': count('orders', created_at__gte=TODAY),
+        'orders_pending': count('orders', status='pending'),
+        'orders_in_progress': count('orders', status='in_progress'),
+    },
+    'generic': {
+        'total_diagnoses': ref('diagnoses', 'total'),
+        'total_patients': ref('patients', 'total'),
+        'total_xrays': ref('xrays', 'total'),
+        'pending_tasks': total(ref('diagnoses', 'pending_reviews'), ref('xrays', 'pending_analysis')),
+        'my_activity': {
+            'xrays_uploaded': count('xrays', uploaded_by=USER),
+            'patients_created': count('patients', created_by=USER),
+            'reports_created': count('reports', created_by=USER),
+        },
+    },
+}
+
+
+def register_role_metrics(role, metrics):
+    """Agrega (o reemplaza) métricas del proveedor de `role`"""
+    ROLE_METRICS.setdefault(role, {}).update(metrics)
+
+
+def resolve_role(user, scope_info):
+    """Rol del dashboard: 'admin', uno de DASHBOARD_ROLE_GROUPS, 'generic' o None (sin grupo)"""
+    if user.is_superuser:
+        return 'admin'
+    group_name = scope_info['primary_group']
+    if not group_name:
+        return None
+    group_id = scope_info.get('primary_group_id')
+    for role, groups in getattr(settings, 'DASHBOARD_ROLE_GROUPS', DEFAULT_ROLE_GROUPS).items():
+        if group_id in groups or group_name in groups:
+            return role
+    return 'generic'
+
+
+def _walk(metrics, prefix='role'):
+    """(alias, ruta de claves, especificación) de cada métrica, incluso las anidadas"""
+    for key, spec in metrics.items():
+        alias = f'{prefix}_{key}'
+        if isinstance(spec, dict):
+            for item in _walk(spec, alias):
+                yield item[0], (key, *item[1]), item[2]
+        else:
+            yield alias, (key,), spec
+
+
+def bind_role_metrics(role, counters, context):
+    """
+    Registra las métricas de `role` en `counters`.
+
+    Returns:
+        tuple: ({nombre: consulta adicional}, render(resultados) -> dict de métricas)
+    """
+    entries = list(_walk(ROLE_METRICS.get(role, {})))
+    queries = {}
+    for alias, _, spec in entries:
+        spec.bind(counters, alias, context)
+        query = getattr(spec, 'query', None)
+        if query:
+            queries[query] = EXTRA_QUERIES[query]
+
+    def render(results):
+        metrics = {}
+        for alias, path, spec in entries:
+            target = metrics
+            for key in path[:-1]:
+                target = target.setdefault(key, {})
+            target[path[-1]] = spec.value(results, alias)
+        return metrics
+
+    return queries, render
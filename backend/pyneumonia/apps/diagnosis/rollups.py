@@ -0,0 +1,296 @@
+"""
+Consolidación periódica de DiagnosticStatistics
+
+Calcula, para todos los usuarios a la vez, las estadísticas diarias, semanales y
+mensuales a partir de tres consultas agrupadas por (usuario, día): revisiones
+radiológicas, revisiones médicas y reportes. Las sumas y conteos diarios se
+acumulan en memoria hacia semanas y meses, y el resultado se escribe con un
+único upsert sobre (user, period_start, period_end).
+
+En modo incremental solo se recalculan los períodos que contienen actividad
+modificada desde la última ejecución (según `updated_at` de las tablas de
+origen); la marca de agua queda en RollupWatermark. Las fechas de las que salió
+actividad (filas eliminadas, fechas o usuarios reasignados) ya no aparecen en
+las tablas de origen: los signals las registran en RollupPendingDay.
+"""
+import calendar
+from collections import Counter, defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, DurationField, ExpressionWrapper, F, Max, Min, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .conditional import bump_versions
+from .models import DiagnosisResult, MedicalReport, DiagnosticStatistics, RollupWatermark, RollupPendingDay
+
+WATERMARK_NAME = 'diagnostic_statistics'
+
+PERIOD_TYPES = ('day', 'week', 'month')
+
+BACTERIAL_CLASSES = ('PNEUMONIA_BACTERIA', 'PNEUMONIA_BACTERIAL')
+
+# Umbrales de confianza (la confianza se almacena como fracción 0-1)
+HIGH_CONFIDENCE = Decimal('0.8')
+LOW_CONFIDENCE = Decimal('0.5')
+
+COUNT_FIELDS = (
+    'total_cases_analyzed', 'total_xrays_reviewed', 'total_reports_generated',
+    'normal_cases', 'pneumonia_bacterial_cases', 'pneumonia_viral_cases',
+    'high_confidence_cases', 'low_confidence_cases',
+    'mild_cases', 'moderate_cases', 'severe_cases',
+)
+
+DERIVED_FIELDS = (
+    'average_confidence', 'average_processing_time', 'average_review_time',
+    'peer_agreement_rate', 'revision_rate',
+)
+
+# (modelo, campo de usuario, campo de fecha) de cada fuente de actividad
+ACTIVITY_SOURCES = (
+    (DiagnosisResult, 'radiologist_review_id', 'radiologist_reviewed_at'),
+    (DiagnosisResult, 'reviewed_by_id', 'reviewed_at'),
+    (MedicalReport, 'created_by_id', 'created_at'),
+)
+
+
+def period_bounds(day, period_type):
+    """(inicio, fin) del período de `period_type` que contiene `day` (semanas de lunes a domingo)"""
+    if period_type == 'day':
+        return day, day
+    if period_type == 'week':
+        start = day - timedelta(days=day.weekday())
+        return start, start + timedelta(days=6)
+    if period_type == 'month':
+        last_day = calendar.monthrange(day.year, day.month)[1]
+        return day.replace(day=1), day.replace(day=last_day)
+    raise ValueError(f'Tipo de período inválido: {period_type}')
+
+
+def _in_range(field, start, end):
+    """Filtro por fecha (local) del campo de actividad; sin límites si start es None"""
+    if start is None:
+        return Q(**{f'{field}__isnull': False})
+    # Límites como datetime para que el filtro pueda usar índices sobre el campo
+    lower = timezone.make_aware(datetime.combine(start, time.min))
+    upper = timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min))
+    return Q(**{f'{field}__gte': lower, f'{field}__lt': upper})
+
+
+def collect_daily(start=None, end=None):
+    """
+    Sumas y conteos por (usuario, día) de las tres fuentes de actividad.
+
+    Returns:
+        dict: {(user_id, fecha): Counter}
+    """
+    daily = defaultdict(Counter)
+    confidence = Q(status='completed')
+
+    # Casos analizados: diagnósticos revisados por el radiólogo, por fecha de revisión
+    review_time = ExpressionWrapper(F('radiologist_reviewed_at') - F('created_at'), output_field=DurationField())
+    radiology = DiagnosisResult.objects.filter(
+        _in_range('radiologist_reviewed_at', start, end), radiologist_review__isnull=False
+    ).annotate(day=TruncDate('radiologist_reviewed_at')).values('radiologist_review', 'day').annotate(
+        total_cases_analyzed=Count('pk'),
+        normal_cases=Count('pk', filter=Q(predicted_class='NORMAL')),
+        pneumonia_bacterial_cases=Count('pk', filter=Q(predicted_class__in=BACTERIAL_CLASSES)),
+        pneumonia_viral_cases=Count('pk', filter=Q(predicted_class='PNEUMONIA_VIRAL')),
+        confidence_sum=Sum('confidence', filter=confidence),
+        confidence_samples=Count('pk', filter=confidence),
+        high_confidence_cases=Count('pk', filter=Q(confidence__gt=HIGH_CONFIDENCE)),
+        low_confidence_cases=Count('pk', filter=Q(confidence__lt=LOW_CONFIDENCE)),
+        mild_cases=Count('pk', filter=Q(severity='mild')),
+        moderate_cases=Count('pk', filter=Q(severity='moderate')),
+        severe_cases=Count('pk', filter=Q(severity='severe')),
+        processing_time_sum=Sum('processing_time'),
+        processing_time_samples=Count('processing_time'),
+        review_time_sum=Sum(review_time),
+        approved_cases=Count('pk', filter=Q(treating_physician_approval__isnull=False)),
+    ).order_by()
+    for row in radiology:
+        key = (row.pop('radiologist_review'), row.pop('day'))
+        review_time_sum = row.pop('review_time_sum')
+        row['review_time_sum'] = review_time_sum.total_seconds() if review_time_sum else 0.0
+        daily[key].update({name: value for name, value in row.items() if value})
+
+    # Radiografías revisadas por el médico (mark_reviewed), por fecha de revisión
+    reviews = DiagnosisResult.objects.filter(
+        _in_range('reviewed_at', start, end), reviewed_by__isnull=False
+    ).annotate(day=TruncDate('reviewed_at')).values('reviewed_by', 'day').annotate(
+        total=Count('pk')
+    ).order_by()
+    for row in reviews:
+        daily[(row['reviewed_by'], row['day'])]['total_xrays_reviewed'] += row['total']
+
+    # Reportes generados, por fecha de creación
+    reports = MedicalReport.objects.filter(
+        _in_range('created_at', start, end), created_by__isnull=False
+    ).annotate(day=TruncDate('created_at')).values('created_by', 'day').annotate(
+        total=Count('pk'), revised=Count('pk', filter=Q(status='revised'))
+    ).order_by()
+    for row in reports:
+        counters = daily[(row['created_by'], row['day'])]
+        counters['total_reports_generated'] += row['total']
+        counters['revised_reports'] += row['revised']
+
+    return daily
+
+
+def rollup(daily, period_types=PERIOD_TYPES):
+    """Acumula los contadores diarios en los períodos pedidos: {(usuario, tipo, inicio, fin): Counter}"""
+    periods = defaultdict(Counter)
+    for (user_id, day), counters in daily.items():
+        for period_type in period_types:
+            start, end = period_bounds(day, period_type)
+            periods[(user_id, period_type, start, end)].update(counters)
+    return periods
+
+
+def _ratio(part, total, scale=1, digits=2):
+    if not total:
+        return None
+    return round(part / total * scale, digits)
+
+
+def build_statistics(user_id, period_type, start, end, counters):
+    """Fila de DiagnosticStatistics con los contadores y las métricas derivadas del período"""
+    stats = DiagnosticStatistics(
+        user_id=user_id, period_type=period_type, period_start=start, period_end=end,
+        **{name: counters[name] for name in COUNT_FIELDS}
+    )
+    cases = counters['total_cases_analyzed']
+    # Confianza promedio expresada en porcentaje
+    average_confidence = _ratio(float(counters['confidence_sum']), counters['confidence_samples'], 100)
+    stats.average_confidence = Decimal(str(average_confidence)) if average_confidence is not None else None
+    stats.average_processing_time = _ratio(
+        counters['processing_time_sum'], counters['processing_time_samples'], digits=3
+    )
+    stats.average_review_time = _ratio(counters['review_time_sum'], cases, 1 / 60)
+    peer_agreement = _ratio(counters['approved_cases'], cases, 100)
+    stats.peer_agreement_rate = Decimal(str(peer_agreement)) if peer_agreement is not None else None
+    revision_rate = _ratio(counters['revised_reports'], counters['total_reports_generated'], 100)
+    stats.revision_rate = Decimal(str(revision_rate)) if revision_rate is not None else None
+    return stats
+
+
+def vacated_days(instance, changes=None):
+    """
+    Fechas de las que sale la actividad de `instance`.
+
+    Con `changes` (apps.diagnosis.tracking) son las fechas anteriores de las
+    fuentes cuyo usuario o fecha cambió; sin `changes` (eliminación), todas.
+    """
+    days = set()
+    for model, user_field, timestamp_field in ACTIVITY_SOURCES:
+        if not isinstance(instance, model):
+            continue
+        if changes is None:
+            user_id, timestamp = getattr(instance, user_field), getattr(instance, timestamp_field)
+        elif changes.keys() & {user_field, timestamp_field}:
+            user_id = changes[user_field][0] if user_field in changes else getattr(instance, user_field)
+            timestamp = (
+                changes[timestamp_field][0] if timestamp_field in changes else getattr(instance, timestamp_field)
+            )
+        else:
+            continue
+        if user_id and timestamp:
+            days.add(timezone.localdate(timestamp))
+    return days
+
+
+def mark_pending(days):
+    """Registra días a recalcular en la próxima consolidación incremental"""
+    if days:
+        RollupPendingDay.objects.bulk_create(
+            [RollupPendingDay(date=day) for day in days], ignore_conflicts=True
+        )
+
+
+def touched_window(since, pending_days=()):
+    """
+    Rango de fechas con actividad modificada desde `since` (más `pending_days`),
+    ampliado para que cubra completos los meses y semanas afectados. None si no
+    hubo cambios.
+    """
+    changed_diagnoses = DiagnosisResult.objects.filter(updated_at__gte=since).aggregate(
+        radiology_min=Min('radiologist_reviewed_at'), radiology_max=Max('radiologist_reviewed_at'),
+        review_min=Min('reviewed_at'), review_max=Max('reviewed_at'),
+    )
+    changed_reports = MedicalReport.objects.filter(updated_at__gte=since).aggregate(
+        report_min=Min('created_at'), report_max=Max('created_at'),
+    )
+    bounds = {**changed_diagnoses, **changed_reports}
+    lows = [timezone.localdate(value) for name, value in bounds.items() if name.endswith('min') and value]
+    highs = [timezone.localdate(value) for name, value in bounds.items() if name.endswith('max') and value]
+    lows.extend(pending_days)
+    highs.extend(pending_days)
+    if not lows:
+        return None
+
+    start = period_bounds(period_bounds(min(lows), 'month')[0], 'week')[0]
+    end = period_bounds(period_bounds(max(highs), 'month')[1], 'week')[1]
+    return start, end
+
+
+def run_rollup(full=False):
+    """
+    Recalcula y guarda DiagnosticStatistics.
+
+    Args:
+        full: Recalcular todo el historial en lugar de solo los períodos modificados
+
+    Returns:
+        dict: Resumen con la ventana procesada y las filas escritas/eliminadas
+    """
+    started_at = timezone.now()
+    watermark, _ = RollupWatermark.objects.get_or_create(name=WATERMARK_NAME)
+    pending = dict(RollupPendingDay.objects.values_list('pk', 'date'))
+
+    if full or watermark.processed_until is None:
+        window = None
+    else:
+        window = touched_window(watermark.processed_until, pending.values())
+        if window is None:
+            watermark.processed_until = started_at
+            watermark.save(update_fields=['processed_until', 'updated_at'])
+            return {'window': None, 'written': 0, 'deleted': 0}
+
+    start, end = window or (None, None)
+    periods = rollup(collect_daily(start, end))
+    if window:
+        # Solo los períodos contenidos por completo en la ventana tienen todos sus días
+        periods = {key: counters for key, counters in periods.items() if key[2] >= start and key[3] <= end}
+
+    rows = [build_statistics(*key, counters) for key, counters in periods.items()]
+
+    with transaction.atomic():
+        existing = DiagnosticStatistics.objects.all()
+        if window:
+            existing = existing.filter(period_start__gte=start, period_end__lte=end)
+        # Períodos que ya no tienen actividad (reasignaciones, eliminaciones)
+        current_keys = {(row.user_id, row.period_start, row.period_end) for row in rows}
+        stale_ids = [
+            pk for pk, user_id, period_start, period_end
+            in existing.values_list('pk', 'user_id', 'period_start', 'period_end')
+            if (user_id, period_start, period_end) not in current_keys
+        ]
+        deleted, _ = DiagnosticStatistics.objects.filter(pk__in=stale_ids).delete()
+
+        DiagnosticStatistics.objects.bulk_create(
+            rows,
+            batch_size=500,
+            update_conflicts=True,
+            unique_fields=['user', 'period_start', 'period_end'],
+            update_fields=['period_type', *COUNT_FIELDS, *DERIVED_FIELDS, 'updated_at'],
+        )
+
+        RollupPendingDay.objects.filter(pk__in=list(pending)).delete()
+        # bulk_create no emite signals: los ETag del listado se invalidan aquí
+        bump_versions([DiagnosticStatistics])
+        watermark.processed_until = started_at
+        watermark.save(update_fields=['processed_until', 'updated_at'])
+
+    return {'window': window, 'written': len(rows), 'deleted': deleted}
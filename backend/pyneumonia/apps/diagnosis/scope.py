@@ -0,0 +1,105 @@
+"""
+Resolución cacheada del alcance de estadísticas
+
+El alcance de un usuario (todas, su grupo o personal) y el conjunto de IDs de
+los miembros de sus grupos se guardan en la caché de Django bajo una versión
+global. Los cambios de membresía (m2m_changed de User.groups) y de grupos
+incrementan la versión (ver signals), de modo que las entradas anteriores
+dejan de usarse sin tener que borrarlas una a una.
+
+En el camino habitual la resolución no consulta grupos ni miembros. Con una
+caché local de cada proceso el alcance se calcula siempre: la versión
+incrementada en un worker no llegaría a los demás. Con la tabla de caché de la
+base de datos también: leer versión y entrada son dos consultas, las mismas
+que calcularlo.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from apps.core.cache import is_fast_shared
+from apps.security.models import User
+
+VERSION_KEY = 'stats_scope:version'
+
+
+def _new_version():
+    # Basada en el reloj para no reutilizar versiones si la clave se pierde de la caché
+    return time.time_ns()
+
+
+def scope_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, _new_version(), None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def invalidate_stats_scopes():
+    """Invalida todos los alcances cacheados"""
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, _new_version(), None)
+
+
+def compute_stats_scope(user):
+    """Calcula el alcance consultando grupos y miembros (dos consultas)"""
+    groups = list(user.groups.order_by('pk').values_list('pk', 'name'))
+    primary_group_id, primary_group = groups[0] if groups else (None, None)
+    if not groups:
+        return {'scope': 'personal', 'user_ids': {user.id}, 'primary_group': None, 'primary_group_id': None}
+
+    # Reunir todos los usuarios de los grupos del usuario en una sola consulta
+    group_user_ids = set(
+        User.groups.through.objects.filter(group_id__in=[pk for pk, _ in groups])
+        .values_list('user_id', flat=True)
+    )
+
+    # Si solo está el propio usuario, tratar como personal
+    if group_user_ids == {user.id}:
+        return {
+            'scope': 'personal', 'user_ids': {user.id},
+            'primary_group': primary_group, 'primary_group_id': primary_group_id,
+        }
+
+    return {
+        'scope': 'group', 'user_ids': group_user_ids,
+        'primary_group': primary_group, 'primary_group_id': primary_group_id,
+    }
+
+
+def determine_stats_scope(user):
+    """
+    Determina el alcance de las estadísticas según rol/grupo del usuario.
+
+    Returns:
+        dict: {
+            'scope': 'all' | 'group' | 'personal',
+            'user_ids': set de IDs de usuarios incluidos,
+            'primary_group': nombre del grupo principal (o None),
+            'primary_group_id': ID del grupo principal (o None)
+        }
+
+    Reglas:
+        - superuser o staff => 'all' (todas las estadísticas)
+        - pertenece a grupos con otros usuarios => 'group' (estadísticas del grupo)
+        - sin grupos o solo él en grupos => 'personal' (solo sus estadísticas)
+    """
+    if is_fast_shared():
+        key = f'stats_scope:{scope_version()}:{user.pk}'
+        scope_info = cache.get(key)
+        if scope_info is None:
+            scope_info = compute_stats_scope(user)
+            cache.set(key, scope_info, getattr(settings, 'STATS_SCOPE_CACHE_TIMEOUT', 600))
+    else:
+        scope_info = compute_stats_scope(user)
+
+    if user.is_superuser or getattr(user, 'is_staff', False):
+        return {
+            'scope': 'all', 'user_ids': set(),
+            'primary_group': scope_info['primary_group'], 'primary_group_id': scope_info.get('primary_group_id'),
+        }
+    return scope_info
@@ -0,0 +1,156 @@
+"""
+Búsqueda de texto completo para pacientes, órdenes, diagnósticos y reportes
+
+Cada registro indexable tiene un documento en SearchEntry con el texto de sus
+campos de búsqueda, normalizado a minúsculas y sin tildes (José -> jose,
+Peña -> pena). Los signals lo actualizan al guardar o eliminar; si cambia un
+paciente se reindexan también sus órdenes y diagnósticos, que incluyen su
+nombre y DNI.
+
+La consulta usa el índice del motor (ver migración 0015_search_entry):
+    - SQLite: FTS5 con tokenizador unicode61
+    - PostgreSQL: to_tsvector('simple', body) con índice GIN
+Cada término se busca por prefijo ("jos pe" encuentra "José Pérez") y todos
+deben coincidir. En otros motores `FullTextSearchFilter` usa el SearchFilter
+de DRF (icontains sobre `search_fields`).
+"""
+import re
+import unicodedata
+
+from django.db import connection, transaction
+from django.db.models.expressions import RawSQL
+from rest_framework.filters import SearchFilter
+
+from .models import Patient, MedicalOrder, XRayImage, DiagnosisResult, MedicalReport, SearchEntry
+
+# {modelo: (tipo de entidad, rutas de los campos que forman el documento)}
+DOCUMENTS = {
+    Patient: ('patient', ('first_name', 'last_name', 'dni', 'email')),
+    MedicalOrder: ('medical_order', ('patient__first_name', 'patient__last_name', 'patient__dni', 'reason')),
+    DiagnosisResult: ('diagnosis', (
+        'predicted_class', 'xray__patient__first_name', 'xray__patient__last_name', 'xray__patient__dni',
+    )),
+    MedicalReport: ('medical_report', ('title', 'findings', 'impression')),
+}
+
+# Campos propios cuyo cambio altera algún documento (seguidos con apps.diagnosis.tracking)
+SOURCE_FIELDS = {
+    Patient: ('first_name', 'last_name', 'dni', 'email'),
+    MedicalOrder: ('patient_id', 'reason'),
+    XRayImage: ('patient_id',),
+    DiagnosisResult: ('predicted_class', 'xray_id'),
+    MedicalReport: ('title', 'findings', 'impression'),
+}
+
+# {modelo: [(modelo indexado cuyo documento lo incluye, ruta hacia el modelo)]}
+DEPENDENTS = {
+    Patient: [(MedicalOrder, 'patient'), (DiagnosisResult, 'xray__patient')],
+    XRayImage: [(DiagnosisResult, 'xray')],
+}
+
+TOKEN_RE = re.compile(r'[^\W_]+')
+
+
+def normalize(text):
+    """Minúsculas y sin marcas diacríticas"""
+    decomposed = unicodedata.normalize('NFKD', str(text))
+    return ''.join(char for char in decomposed if not unicodedata.combining(char)).lower()
+
+
+def tokenize(terms):
+    return [token for term in terms for token in TOKEN_RE.findall(normalize(term))]
+
+
+def is_supported():
+    return connection.vendor in ('sqlite', 'postgresql')
+
+
+def index_queryset(queryset):
+    """Crea o actualiza los documentos de las filas de `queryset`"""
+    entity_type, paths = DOCUMENTS[queryset.model]
+    entries = [
+        SearchEntry(
+            entity_type=entity_type, entity_id=row[0],
+            body=normalize(' '.join(str(value) for value in row[1:] if value)),
+        )
+        for row in queryset.values_list('pk', *paths).iterator(chunk_size=2000)
+    ]
+    SearchEntry.objects.bulk_create(
+        entries, batch_size=500,
+        update_conflicts=True, unique_fields=['entity_type', 'entity_id'], update_fields=['body'],
+    )
+    return len(entries)
+
+
+def index_pks(model, pks, chunk_size=1000):
+    """Indexa en bloques los registros `pks` de `model` (p. ej. tras un bulk_create)"""
+    pks = list(pks)
+    for start in range(0, len(pks), chunk_size):
+        index_queryset(model.objects.filter(pk__in=pks[start:start + chunk_size]))
+
+
+def sync_instance(instance, created, changes):
+    """Reindexa `instance` y los documentos que dependen de ella si cambió algún campo indexado"""
+    model = type(instance)
+    if not created and not changes.keys() & set(SOURCE_FIELDS[model]):
+        return
+    if model in DOCUMENTS:
+        index_queryset(model.objects.filter(pk=instance.pk))
+    if not created:
+        for dependent, path in DEPENDENTS.get(model, ()):
+            index_queryset(dependent.objects.filter(**{path: instance.pk}))
+
+
+def remove_instance(instance):
+    model = type(instance)
+    if model in DOCUMENTS:
+        SearchEntry.objects.filter(entity_type=DOCUMENTS[model][0], entity_id=instance.pk).delete()
+
+
+def rebuild(models=None):
+    """
+    Regenera los documentos de `models` (todos los indexables por defecto).
+
+    Returns:
+        dict: {tipo de entidad: documentos escritos}
+    """
+    written = {}
+    with transaction.atomic():
+        for model in models or DOCUMENTS:
+            entity_type = DOCUMENTS[model][0]
+            SearchEntry.objects.filter(entity_type=entity_type).delete()
+            written[entity_type] = index_queryset(model.objects.all())
+    return written
+
+
+def match_expression(tokens):
+    """Subconsulta con los ids de SearchEntry cuyo texto contiene todos los prefijos `tokens`"""
+    if connection.vendor == 'sqlite':
+        query = ' AND '.join(f'"{token}"*' for token in tokens)
+        return RawSQL(
+            'SELECT rowid FROM diagnosis_searchentry_fts WHERE diagnosis_searchentry_fts MATCH %s', (query,)
+        )
+    query = ' & '.join(f'{token}:*' for token in tokens)
+    return RawSQL(
+        "SELECT id FROM diagnosis_searchentry WHERE to_tsvector('simple', body) @@ to_tsquery('simple', %s)",
+        (query,)
+    )
+
+
+def matching_ids(model, terms):
+    """Subconsulta con los pk de `model` que coinciden con todos los términos"""
+    entries = SearchEntry.objects.filter(entity_type=DOCUMENTS[model][0])
+    tokens = tokenize(terms)
+    if tokens:
+        entries = entries.filter(id__in=match_expression(tokens))
+    return entries.values('entity_id')
+
+
+class FullTextSearchFilter(SearchFilter):
+    """SearchFilter sobre el índice de texto completo (mismo parámetro ?search=)"""
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms or queryset.model not in DOCUMENTS or not is_supported():
+            return super().filter_queryset(request, queryset, view)
+        return queryset.filter(pk__in=matching_ids(queryset.model, terms))
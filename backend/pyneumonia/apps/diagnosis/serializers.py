@@ -11,6 +11,8 @@ from .validators import (
     validate_no_sql_injection
 )
 from apps.security.serializers import UserSerializer
+from .annotations import annotated
+from .fieldsets import SparseFieldsetMixin
 
 
 class PatientSerializer(serializers.ModelSerializer):
@@ -87,6 +89,16 @@ class PatientSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
 
+class PatientImportSerializer(PatientSerializer):
+    """Fila de importación masiva: el DNI se valida y se verifica único por lote (ver bulk_import)"""
+
+    class Meta(PatientSerializer.Meta):
+        extra_kwargs = {'dni': {'validators': []}}
+
+    def validate_dni(self, value):
+        return value
+
+
 class XRayImageSerializer(serializers.ModelSerializer):
     """Serializer para XRayImage con validaciones de seguridad"""
     patient_name = serializers.SerializerMethodField()
@@ -163,8 +175,8 @@ class XRayImageSerializer(serializers.ModelSerializer):
         return str(obj.uploaded_by.get_full_name) if obj.uploaded_by else None
     
     def get_has_diagnosis(self, obj):
-        """Verificar si la radiografía tiene un diagnóstico asociado"""
-        return hasattr(obj, 'diagnosis')
+        """Verificar si la radiografía tiene un diagnóstico asociado (anotado por el ViewSet)"""
+        return annotated(obj, 'has_diagnosis', lambda: hasattr(obj, 'diagnosis'))
 
     def create(self, validated_data):
         request = self.context.get('request')
@@ -173,8 +185,29 @@ class XRayImageSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
 
-class DiagnosisResultSerializer(serializers.ModelSerializer):
-    """Serializer para DiagnosisResult con validaciones de seguridad"""
+class DiagnosisResultSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    """Serializer para DiagnosisResult con validaciones de seguridad (admite ?fields= y ?expand=)"""
+    expandable_fields = ('xray_details', 'medical_order')
+    field_sources = {
+        'xray_details': (
+            'xray__uploaded_at', 'xray__image', 'xray__patient__first_name', 'xray__patient__last_name',
+            'xray__patient__dni', 'xray__medical_order__reason',
+        ),
+        'medical_order': (
+            'xray__medical_order__reason', 'xray__medical_order__priority', 'xray__medical_order__status',
+            'xray__medical_order__created_at', 'xray__medical_order__requested_by__first_name',
+            'xray__medical_order__requested_by__last_name',
+        ),
+        'radiologist_review_name': ('radiologist_review__first_name', 'radiologist_review__last_name'),
+        'treating_physician_approval_name': (
+            'treating_physician_approval__first_name', 'treating_physician_approval__last_name',
+        ),
+        'reviewed_by_name': ('reviewed_by__first_name', 'reviewed_by__last_name'),
+        'confidence_percentage': ('confidence',),
+        'is_pneumonia': ('predicted_class',),
+        'requires_attention': ('predicted_class', 'confidence'),
+        'is_fully_reviewed': ('radiologist_review__id', 'treating_physician_approval__id'),
+    }
     xray_id = serializers.PrimaryKeyRelatedField(source='xray', queryset=XRayImage.objects.all(), write_only=True)
     xray_details = serializers.SerializerMethodField(read_only=True)
     radiologist_review_name = serializers.SerializerMethodField()
@@ -297,8 +330,33 @@ class DiagnosisResultSerializer(serializers.ModelSerializer):
         return obj.is_fully_reviewed
 
 
-class MedicalReportSerializer(serializers.ModelSerializer):
-    """Serializer para MedicalReport"""
+class MedicalReportSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    """Serializer para MedicalReport (admite ?fields= y ?expand=)"""
+    expandable_fields = ('patient', 'medical_order', 'diagnosis_info', 'created_by')
+    field_sources = {
+        'patient': (
+            'diagnosis__xray__medical_order__patient__dni', 'diagnosis__xray__medical_order__patient__first_name',
+            'diagnosis__xray__medical_order__patient__last_name',
+            'diagnosis__xray__medical_order__patient__date_of_birth',
+            'diagnosis__xray__medical_order__patient__gender',
+        ),
+        'patient_id': ('diagnosis__xray__medical_order__patient__id',),
+        'medical_order': (
+            'diagnosis__xray__medical_order__order_type', 'diagnosis__xray__medical_order__reason',
+            'diagnosis__xray__medical_order__priority', 'diagnosis__xray__medical_order__status',
+            'diagnosis__xray__medical_order__created_at',
+            'diagnosis__xray__medical_order__requested_by__first_name',
+            'diagnosis__xray__medical_order__requested_by__last_name',
+        ),
+        'medical_order_id': ('diagnosis__xray__medical_order__id',),
+        'xray_id': ('diagnosis__xray__id',),
+        'diagnosis_info': (
+            'diagnosis__predicted_class', 'diagnosis__confidence', 'diagnosis__is_reviewed',
+            'diagnosis__created_at',
+        ),
+        'created_by_name': ('created_by__first_name', 'created_by__last_name'),
+        'received_by_name': ('received_by__first_name', 'received_by__last_name'),
+    }
     created_by = UserSerializer(read_only=True)
     created_by_name = serializers.SerializerMethodField()
     received_by_name = serializers.SerializerMethodField()
@@ -456,7 +514,7 @@ class DiagnosticStatisticsSerializer(serializers.ModelSerializer):
         model = DiagnosticStatistics
         fields = [
             'id', 'user', 'user_name',
-            'period_start', 'period_end',
+            'period_type', 'period_start', 'period_end',
             'total_cases_analyzed', 'total_xrays_reviewed', 'total_reports_generated',
             'normal_cases', 'pneumonia_bacterial_cases', 'pneumonia_viral_cases',
             'average_confidence', 'high_confidence_cases', 'low_confidence_cases',
@@ -586,9 +644,9 @@ class MedicalOrderSerializer(serializers.ModelSerializer):
             return None
 
     def get_has_xray(self, obj):
-        """Verificar si la orden médica tiene una radiografía asociada"""
+        """Verificar si la orden médica tiene una radiografía asociada (anotado por el ViewSet)"""
         try:
-            return XRayImage.objects.filter(medical_order=obj).exists()
+            return annotated(obj, 'has_xray', lambda: XRayImage.objects.filter(medical_order=obj).exists())
         except Exception:
             return False
 
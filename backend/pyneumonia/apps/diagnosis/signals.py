@@ -1,14 +1,44 @@
 """
 Signals para auditoría automática de módulo de diagnóstico
 """
-from django.db.models.signals import post_save, post_delete
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.contrib.auth.models import Group
 from django.dispatch import receiver
+from django.utils import timezone
 from datetime import datetime
 import socket
 from crum import get_current_request
 
-from apps.diagnosis.models import Patient, XRayImage, DiagnosisResult, MedicalReport
-from apps.security.models import AuditUser
+from apps.diagnosis.models import (
+    Patient, MedicalOrder, XRayImage, DiagnosisResult, MedicalReport, DailyActiveUser
+)
+from apps.security.models import AuditUser, User
+from apps.diagnosis.embeddings import invalidate_similarity_index
+from apps.diagnosis.tracking import track_fields, get_changes
+from apps.diagnosis import (
+    system_stats, performance, participation, timeseries, sketches, search, autocomplete, rollups, conditional
+)
+from apps.diagnosis.scope import invalidate_stats_scopes
+from apps.diagnosis.stats_cache import invalidate_for_users
+from apps.diagnosis.bulk_import import patients_imported
+from apps.diagnosis.transitions import records_transitioned
+
+# Datos de usuario que muestran los listados (nombres de solicitante, revisor, autor)
+USER_DISPLAY_FIELDS = ('username', 'first_name', 'last_name', 'email')
+
+
+track_fields(DiagnosisResult, (
+    *performance.DIAGNOSIS_FIELDS, 'radiologist_reviewed_at', 'reviewed_at', 'approved_at',
+))
+track_fields(MedicalReport, performance.REPORT_FIELDS)
+for source_model, source_fields in participation.SOURCE_FIELDS.items():
+    track_fields(source_model, source_fields)
+for source_model in (Patient, XRayImage, DiagnosisResult, MedicalReport):
+    track_fields(source_model, timeseries.source_fields(source_model, include_timestamp=False))
+for source_model, source_fields in search.SOURCE_FIELDS.items():
+    track_fields(source_model, source_fields)
+track_fields(Patient, autocomplete.SOURCE_FIELDS)
+track_fields(User, USER_DISPLAY_FIELDS)
 
 
 def create_audit_record(user, table_name, record_id, action):
@@ -87,6 +117,20 @@ def audit_diagnosis_save(sender, instance, created, **kwargs):
         create_audit_record(request.user, 'DiagnosisResult', instance.id, action)
 
 
+@receiver(post_save, sender=DiagnosisResult)
+def refresh_similarity_index(sender, instance, created, **kwargs):
+    """Los casos revisados por radiólogo forman el índice de similitud: solo cambia al asignar o quitar la revisión"""
+    if 'radiologist_review_id' in get_changes(instance):
+        invalidate_similarity_index()
+
+
+@receiver(post_delete, sender=DiagnosisResult)
+def drop_from_similarity_index(sender, instance, **kwargs):
+    """Un caso revisado eliminado deja de ser un resultado posible"""
+    if instance.radiologist_review_id:
+        invalidate_similarity_index()
+
+
 @receiver(post_delete, sender=DiagnosisResult)
 def audit_diagnosis_delete(sender, instance, **kwargs):
     """Auditar eliminación de diagnósticos"""
@@ -112,3 +156,423 @@ def audit_medical_report_delete(sender, instance, **kwargs):
     request = get_current_request()
     if request and request.user.is_authenticated:
         create_audit_record(request.user, 'MedicalReport', instance.id, 'E')
+
+
+# ==================== ESTADÍSTICAS DEL SISTEMA ====================
+
+@receiver(post_save, sender=Patient)
+def count_patient_save(sender, instance, created, raw=False, **kwargs):
+    """Contabilizar el registro de pacientes en las estadísticas del día"""
+    if created and not raw:
+        system_stats.record(daily_patients_registered=1, total_patients=1)
+        system_stats.mark_active(instance.created_by_id)
+
+
+@receiver(post_delete, sender=Patient)
+def count_patient_delete(sender, instance, **kwargs):
+    system_stats.record(
+        total_patients=-1, daily_patients_registered=-system_stats.created_today(instance.created_at)
+    )
+
+
+@receiver(post_save, sender=XRayImage)
+def count_xray_save(sender, instance, created, raw=False, **kwargs):
+    """Contabilizar radiografías subidas"""
+    if created and not raw:
+        system_stats.record(daily_xrays_uploaded=1, total_xrays=1)
+        system_stats.mark_active(instance.uploaded_by_id)
+
+
+@receiver(post_delete, sender=XRayImage)
+def count_xray_delete(sender, instance, **kwargs):
+    system_stats.record(
+        total_xrays=-1, daily_xrays_uploaded=-system_stats.created_today(instance.uploaded_at)
+    )
+
+
+@receiver(post_save, sender=DiagnosisResult)
+def count_diagnosis_save(sender, instance, created, raw=False, **kwargs):
+    """Contabilizar diagnósticos, cambios de clase/estado y actividad de revisión"""
+    if raw:
+        return
+    changes = get_changes(instance)
+    if created or changes.keys() & {'predicted_class', 'status', 'processing_time'}:
+        system_stats.record_diagnosis_change(instance, created, changes)
+
+    reviewers = (
+        ('radiologist_reviewed_at', instance.radiologist_review_id),
+        ('reviewed_at', instance.reviewed_by_id),
+        ('approved_at', instance.treating_physician_approval_id),
+    )
+    for timestamp_field, user_id in reviewers:
+        if timestamp_field in changes and changes[timestamp_field][1] is not None:
+            system_stats.mark_active(user_id)
+
+
+@receiver(post_delete, sender=DiagnosisResult)
+def count_diagnosis_delete(sender, instance, **kwargs):
+    system_stats.record_diagnosis_delete(instance)
+
+
+@receiver(post_save, sender=MedicalReport)
+def count_medical_report_save(sender, instance, created, raw=False, **kwargs):
+    """Contabilizar reportes generados"""
+    if created and not raw:
+        system_stats.record(daily_reports_generated=1, total_reports=1)
+        system_stats.mark_active(instance.created_by_id)
+
+
+@receiver(post_delete, sender=MedicalReport)
+def count_medical_report_delete(sender, instance, **kwargs):
+    system_stats.record(
+        total_reports=-1, daily_reports_generated=-system_stats.created_today(instance.created_at)
+    )
+
+
+# ==================== MÉTRICAS DE RENDIMIENTO POR USUARIO ====================
+
+@receiver(post_save, sender=DiagnosisResult)
+def update_performance_on_diagnosis_save(sender, instance, created, raw=False, **kwargs):
+    """Actualizar las métricas de radiólogo, revisor y médico que aprueba"""
+    if not raw:
+        performance.record_diagnosis_change(instance, created, get_changes(instance))
+
+
+@receiver(post_delete, sender=DiagnosisResult)
+def update_performance_on_diagnosis_delete(sender, instance, **kwargs):
+    performance.record_diagnosis_delete(instance)
+
+
+@receiver(post_save, sender=MedicalReport)
+def update_performance_on_report_save(sender, instance, created, raw=False, **kwargs):
+    """Actualizar las métricas del autor del reporte (totales y reportes finales)"""
+    if not raw:
+        performance.record_report_change(instance, created, get_changes(instance))
+
+
+@receiver(post_delete, sender=MedicalReport)
+def update_performance_on_report_delete(sender, instance, **kwargs):
+    performance.record_report_delete(instance)
+
+
+# ==================== CONSOLIDACIÓN DE ESTADÍSTICAS ====================
+
+@receiver(post_save, sender=DiagnosisResult)
+@receiver(post_save, sender=MedicalReport)
+def mark_rollup_days_on_save(sender, instance, created, raw=False, **kwargs):
+    """Días de los que salió actividad al reasignar el usuario o la fecha"""
+    if not created and not raw:
+        rollups.mark_pending(rollups.vacated_days(instance, get_changes(instance)))
+
+
+@receiver(post_delete, sender=DiagnosisResult)
+@receiver(post_delete, sender=MedicalReport)
+def mark_rollup_days_on_delete(sender, instance, **kwargs):
+    rollups.mark_pending(rollups.vacated_days(instance))
+
+
+# ==================== ALCANCE DE ESTADÍSTICAS (CACHÉ) ====================
+
+@receiver(m2m_changed, sender=User.groups.through)
+def invalidate_scope_on_membership_change(sender, action, **kwargs):
+    """Altas y bajas de usuarios en grupos cambian los miembros de cada alcance"""
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        invalidate_stats_scopes()
+
+
+@receiver(post_delete, sender=User)
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def invalidate_scope_on_user_or_group_change(sender, **kwargs):
+    """Eliminar usuarios o grupos (y renombrar grupos) altera membresías y grupo principal"""
+    invalidate_stats_scopes()
+
+
+# ==================== ÍNDICE DE PARTICIPACIÓN ====================
+
+@receiver(post_save, sender=Patient)
+@receiver(post_save, sender=MedicalOrder)
+@receiver(post_save, sender=XRayImage)
+@receiver(post_save, sender=DiagnosisResult)
+@receiver(post_save, sender=MedicalReport)
+def sync_participation(sender, instance, created, raw=False, **kwargs):
+    """Regenerar las participaciones del registro cuando cambian los usuarios vinculados"""
+    if raw:
+        return
+    changes = get_changes(instance)
+    if created or changes.keys() & set(participation.SOURCE_FIELDS[sender]):
+        participation.sync_source(instance)
+        if sender is XRayImage and not created:
+            participation.sync_dependents(instance)
+
+
+@receiver(post_delete, sender=Patient)
+@receiver(post_delete, sender=MedicalOrder)
+@receiver(post_delete, sender=XRayImage)
+@receiver(post_delete, sender=DiagnosisResult)
+@receiver(post_delete, sender=MedicalReport)
+def remove_participation(sender, instance, **kwargs):
+    participation.remove_source(instance.pk)
+
+
+# ==================== SERIES DE TIEMPO ====================
+
+@receiver(post_save, sender=Patient)
+@receiver(post_save, sender=XRayImage)
+@receiver(post_save, sender=DiagnosisResult)
+@receiver(post_save, sender=MedicalReport)
+def count_timeseries_save(sender, instance, created, raw=False, **kwargs):
+    """Sumar el registro a su hora (o moverlo de dimensión si cambió su clase/estado)"""
+    if not raw:
+        timeseries.record_change(instance, created, get_changes(instance))
+
+
+@receiver(post_delete, sender=Patient)
+@receiver(post_delete, sender=XRayImage)
+@receiver(post_delete, sender=DiagnosisResult)
+@receiver(post_delete, sender=MedicalReport)
+def count_timeseries_delete(sender, instance, **kwargs):
+    timeseries.record_delete(instance)
+
+
+# ==================== CONTEOS DE DISTINTOS (HYPERLOGLOG) ====================
+
+@receiver(post_save, sender=DailyActiveUser)
+def sketch_active_user(sender, instance, created, raw=False, **kwargs):
+    """La primera actividad del usuario en el día se agrega al sketch de usuarios activos"""
+    if created and not raw:
+        sketches.observe('active_users', instance.user_id, instance.date)
+
+
+@receiver(post_save, sender=Patient)
+@receiver(post_save, sender=MedicalOrder)
+@receiver(post_save, sender=XRayImage)
+@receiver(post_save, sender=DiagnosisResult)
+@receiver(post_save, sender=MedicalReport)
+def sketch_patients_seen(sender, instance, created, raw=False, **kwargs):
+    """Agregar el paciente a los sketches de pacientes atendidos (global y del usuario que actuó)"""
+    if raw:
+        return
+    changes = get_changes(instance)
+    patient_id = None
+    for model, patient_path, user_field, timestamp_field in sketches.PATIENT_SOURCES:
+        if model is not sender:
+            continue
+        user_id = getattr(instance, f'{user_field}_id')
+        timestamp = getattr(instance, timestamp_field)
+        acted = created or (timestamp_field in changes and changes[timestamp_field][1] is not None)
+        if not (acted and user_id and timestamp):
+            continue
+        if patient_id is None:
+            if patient_path in ('pk', 'patient'):
+                patient_id = instance.pk if patient_path == 'pk' else instance.patient_id
+            else:
+                patient_id = sender.objects.filter(pk=instance.pk).values_list(patient_path, flat=True).first()
+        sketches.observe(
+            'patients_seen', patient_id, timezone.localdate(timestamp), scopes=('all', sketches.user_scope(user_id))
+        )
+
+
+# ==================== ÍNDICE DE BÚSQUEDA ====================
+
+@receiver(post_save, sender=Patient)
+@receiver(post_save, sender=MedicalOrder)
+@receiver(post_save, sender=XRayImage)
+@receiver(post_save, sender=DiagnosisResult)
+@receiver(post_save, sender=MedicalReport)
+def sync_search_index(sender, instance, created, raw=False, **kwargs):
+    """Reindexar el documento del registro (y los que incluyen sus datos) si cambió texto indexado"""
+    if not raw:
+        search.sync_instance(instance, created, get_changes(instance))
+
+
+@receiver(post_delete, sender=Patient)
+@receiver(post_delete, sender=MedicalOrder)
+@receiver(post_delete, sender=DiagnosisResult)
+@receiver(post_delete, sender=MedicalReport)
+def remove_search_entry(sender, instance, **kwargs):
+    search.remove_instance(instance)
+
+
+# ==================== AUTOCOMPLETADO DE PACIENTES ====================
+
+@receiver(post_save, sender=Patient)
+def sync_patient_lookup(sender, instance, created, raw=False, **kwargs):
+    """Regenerar las claves de autocompletado si cambió el DNI, el nombre o el estado"""
+    if not raw and (created or get_changes(instance).keys() & set(autocomplete.SOURCE_FIELDS)):
+        autocomplete.sync_patient(instance)
+
+
+@receiver(post_delete, sender=Patient)
+def remove_patient_lookup(sender, instance, **kwargs):
+    autocomplete.remove_patient(instance.pk)
+
+
+# ==================== CACHÉ DE ESTADÍSTICAS ====================
+
+def _linked_user_ids(instance):
+    """Usuarios referenciados directamente por el registro"""
+    return {
+        getattr(instance, field.attname)
+        for field in instance._meta.concrete_fields
+        if field.is_relation and field.related_model is User
+    }
+
+
+@receiver(post_save, sender=Patient)
+@receiver(post_save, sender=MedicalOrder)
+@receiver(post_save, sender=XRayImage)
+@receiver(post_save, sender=DiagnosisResult)
+@receiver(post_save, sender=MedicalReport)
+def invalidate_statistics_cache_on_save(sender, instance, raw=False, **kwargs):
+    """Dejar obsoletas las estadísticas cacheadas de los alcances que incluyen a los participantes"""
+    if not raw:
+        # Las participaciones del registro incluyen vínculos indirectos (p. ej. quién subió la radiografía)
+        invalidate_for_users(_linked_user_ids(instance), source_ids=[instance.pk])
+
+
+@receiver(post_delete, sender=Patient)
+@receiver(post_delete, sender=MedicalOrder)
+@receiver(post_delete, sender=XRayImage)
+@receiver(post_delete, sender=DiagnosisResult)
+@receiver(post_delete, sender=MedicalReport)
+def invalidate_statistics_cache_on_delete(sender, instance, **kwargs):
+    invalidate_for_users(_linked_user_ids(instance))
+
+
+# ==================== GET CONDICIONAL (ETAG) ====================
+
+@receiver(post_save, sender=Patient)
+@receiver(post_save, sender=MedicalOrder)
+@receiver(post_save, sender=XRayImage)
+@receiver(post_save, sender=DiagnosisResult)
+@receiver(post_save, sender=MedicalReport)
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Patient)
+@receiver(post_delete, sender=MedicalOrder)
+@receiver(post_delete, sender=XRayImage)
+@receiver(post_delete, sender=DiagnosisResult)
+@receiver(post_delete, sender=MedicalReport)
+@receiver(post_delete, sender=Group)
+@receiver(post_delete, sender=User)
+def bump_etag_version(sender, raw=False, **kwargs):
+    """Cualquier escritura cambia los ETag de los listados que dependen del modelo"""
+    if not raw:
+        conditional.bump_versions([sender])
+
+
+@receiver(post_save, sender=User)
+def bump_etag_version_on_user_change(sender, instance, created, raw=False, **kwargs):
+    """Solo cambios visibles: el último acceso (last_login) no invalida los listados"""
+    if not raw and not created and get_changes(instance).keys() & set(USER_DISPLAY_FIELDS):
+        conditional.bump_versions([User])
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def bump_etag_version_on_membership_change(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        conditional.bump_versions([User])
+
+
+@receiver(patients_imported)
+def bump_etag_version_on_import(sender, instances, user, **kwargs):
+    conditional.bump_versions([Patient])
+
+
+@receiver(records_transitioned)
+def bump_etag_version_on_transition(sender, instances, user, **kwargs):
+    conditional.bump_versions([sender])
+
+
+# ==================== IMPORTACIÓN MASIVA DE PACIENTES ====================
+# bulk_create no emite post_save: cada receiver aplica en bloque lo que los
+# receivers de post_save harían paciente por paciente.
+
+@receiver(patients_imported)
+def audit_patients_imported(sender, instances, user, import_id, **kwargs):
+    """Un solo registro de auditoría por importación, con su id como registro"""
+    create_audit_record(user, 'Patient', import_id, 'A')
+
+
+@receiver(patients_imported)
+def count_patients_imported(sender, instances, user, **kwargs):
+    system_stats.record(daily_patients_registered=len(instances), total_patients=len(instances))
+    system_stats.mark_active(user.pk)
+    timeseries.record_created(Patient, instances)
+
+
+@receiver(patients_imported)
+def index_patients_imported(sender, instances, user, **kwargs):
+    """Participaciones, índices de búsqueda y autocompletado de los pacientes importados"""
+    participation.add_sources(instances)
+    search.index_pks(Patient, [instance.pk for instance in instances])
+    autocomplete.add_patients(instances)
+
+
+@receiver(patients_imported)
+def sketch_patients_imported(sender, instances, user, **kwargs):
+    values_by_day = {}
+    for instance in instances:
+        values_by_day.setdefault(timezone.localdate(instance.created_at), []).append(instance.pk)
+    for scope in ('all', sketches.user_scope(user.pk)):
+        sketches.observe_many('patients_seen', values_by_day, scope)
+
+
+@receiver(patients_imported)
+def invalidate_statistics_cache_on_import(sender, instances, user, **kwargs):
+    invalidate_for_users({user.pk})
+
+
+# ==================== TRANSICIONES EN BLOQUE ====================
+# Las transiciones se aplican con un UPDATE; cada instancia trae sus cambios en
+# _field_changes y los receivers aplican en bloque lo que haría post_save.
+
+@receiver(records_transitioned, sender=DiagnosisResult)
+def audit_diagnoses_transitioned(sender, instances, user, **kwargs):
+    """Un registro de auditoría por diagnóstico, insertados en una sola operación"""
+    now = datetime.now()
+    hostname = socket.gethostname()
+    AuditUser.objects.bulk_create([
+        AuditUser(
+            usuario=user, tabla='DiagnosisResult', registroid=instance.pk, accion='M',
+            fecha=now.date(), hora=now.time(), estacion=hostname,
+        )
+        for instance in instances
+    ])
+
+
+@receiver(records_transitioned, sender=DiagnosisResult)
+def update_diagnoses_transitioned(sender, instances, user, **kwargs):
+    """Métricas de rendimiento, actividad, participaciones y pacientes atendidos de los diagnósticos"""
+    performance.record_diagnosis_changes(instances)
+    system_stats.mark_active(user.pk)
+
+    role_fields = set(participation.SOURCE_FIELDS[DiagnosisResult])
+    changed_roles = [instance for instance in instances if get_changes(instance).keys() & role_fields]
+    if changed_roles:
+        participation.sync_sources(changed_roles)
+    if any(instance.radiologist_review_id for instance in changed_roles):
+        invalidate_similarity_index()
+    rollups.mark_pending(set().union(*(
+        rollups.vacated_days(instance, get_changes(instance)) for instance in instances
+    )))
+
+    timestamp_fields = {
+        timestamp_field for model, _, user_field, timestamp_field in sketches.PATIENT_SOURCES
+        if model is DiagnosisResult
+    }
+    patients_by_day = {}
+    for instance in instances:
+        for field in timestamp_fields & get_changes(instance).keys():
+            day = timezone.localdate(get_changes(instance)[field][1])
+            patients_by_day.setdefault(day, set()).add(instance.xray.patient_id)
+    for scope in ('all', sketches.user_scope(user.pk)):
+        sketches.observe_many('patients_seen', patients_by_day, scope)
+
+
+@receiver(records_transitioned)
+def invalidate_statistics_cache_on_transition(sender, instances, user, **kwargs):
+    user_ids = {user.pk}
+    for instance in instances:
+        user_ids.update(_linked_user_ids(instance))
+    invalidate_for_users(user_ids, source_ids=[instance.pk for instance in instances])
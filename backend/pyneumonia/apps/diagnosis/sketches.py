@@ -0,0 +1,197 @@
+"""
+Conteos aproximados de valores distintos con HyperLogLog
+
+Cada (métrica, alcance, día) guarda un sketch de 2^p registros de un byte. Los
+eventos de escritura agregan el valor observado (usuario activo, paciente
+atendido) al sketch del día, en bloque al confirmar la transacción: una lectura
+y una escritura para todos los sketches tocados. Para una semana o un mes se
+combinan los sketches diarios con el máximo por registro, así que el costo de
+una consulta depende de la cantidad de días y no del volumen de datos. Error estándar ≈ 1.04/√(2^p)
+(1.6 % con p=12).
+
+El conteo exacto (`exact_count`) recorre las tablas de origen y queda para
+auditorías y para reconstruir los sketches (`rebuild_sketches`).
+"""
+import hashlib
+import math
+from collections import defaultdict
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from apps.core import batching
+from .models import Patient, MedicalOrder, XRayImage, DiagnosisResult, MedicalReport, DistinctSketch
+from . import system_stats
+
+METRICS = ('active_users', 'patients_seen')
+
+# (modelo, ruta al paciente, usuario, fecha de la acción) para "pacientes atendidos"
+PATIENT_SOURCES = (
+    (Patient, 'pk', 'created_by', 'created_at'),
+    (MedicalOrder, 'patient', 'requested_by', 'created_at'),
+    (XRayImage, 'patient', 'uploaded_by', 'uploaded_at'),
+    (DiagnosisResult, 'xray__patient', 'radiologist_review', 'radiologist_reviewed_at'),
+    (DiagnosisResult, 'xray__patient', 'reviewed_by', 'reviewed_at'),
+    (DiagnosisResult, 'xray__patient', 'treating_physician_approval', 'approved_at'),
+    (MedicalReport, 'diagnosis__xray__patient', 'created_by', 'created_at'),
+)
+
+
+def user_scope(user_id):
+    return f'user:{user_id}'
+
+
+class HyperLogLog:
+    """Sketch HyperLogLog con hash de 64 bits y corrección para cardinalidades bajas"""
+
+    def __init__(self, registers=None, precision=None):
+        if registers is not None and len(registers):
+            self.registers = np.frombuffer(bytes(registers), dtype=np.uint8).copy()
+            self.precision = int(math.log2(len(self.registers)))
+        else:
+            self.precision = precision or getattr(settings, 'DISTINCT_SKETCH_PRECISION', 12)
+            self.registers = np.zeros(1 << self.precision, dtype=np.uint8)
+
+    def add(self, value):
+        """Agrega un valor; retorna True si el sketch cambió"""
+        digest = int.from_bytes(hashlib.blake2b(str(value).encode(), digest_size=8).digest(), 'big')
+        index = digest >> (64 - self.precision)
+        remainder = (digest << self.precision) & ((1 << 64) - 1)
+        rank = min(64 - remainder.bit_length() + 1, 64 - self.precision + 1)
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+            return True
+        return False
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def count(self):
+        size = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / size)
+        estimate = alpha * size * size / np.sum(np.ldexp(1.0, -self.registers.astype(np.int32)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * size and zeros:
+            estimate = size * math.log(size / zeros)
+        return int(round(estimate))
+
+    def to_bytes(self):
+        return self.registers.tobytes()
+
+
+def observe(metric, value, day=None, scopes=('all',)):
+    """Agrega `value` al sketch diario de `metric` en cada alcance (al confirmar la transacción)"""
+    day = day or timezone.localdate()
+    batching.add(_apply_observations, *((metric, scope, day, value) for scope in scopes))
+
+
+def _apply_observations(items):
+    observations = defaultdict(set)
+    for metric, scope, day, value in items:
+        observations[(metric, scope, day)].add(value)
+    _merge(observations)
+
+
+def observe_many(metric, values_by_day, scope='all'):
+    """Agrega en bloque {fecha: valores} a los sketches diarios (agregar un valor repetido no cambia nada)"""
+    _merge({(metric, scope, day): values for day, values in values_by_day.items()})
+
+
+def _merge(observations):
+    """Suma {(métrica, alcance, fecha): valores} a sus sketches con una lectura y una escritura en bloque"""
+    observations = {key: values for key, values in observations.items() if values}
+    if not observations:
+        return
+    metrics, scopes, days = (set(parts) for parts in zip(*observations))
+    with transaction.atomic():
+        existing = {
+            (sketch.metric, sketch.scope, sketch.date): sketch
+            for sketch in DistinctSketch.objects.select_for_update().filter(
+                metric__in=metrics, scope__in=scopes, date__in=days
+            )
+        }
+        changed = []
+        for (metric, scope, day), values in observations.items():
+            sketch = existing.get((metric, scope, day))
+            if sketch is None:
+                sketch, _ = DistinctSketch.objects.select_for_update().get_or_create(
+                    metric=metric, scope=scope, date=day, defaults={'registers': HyperLogLog().to_bytes()}
+                )
+            hll = HyperLogLog(sketch.registers)
+            # La mayoría de las observaciones repetidas no cambian ningún registro
+            if any([hll.add(value) for value in values]):
+                sketch.registers = hll.to_bytes()
+                sketch.updated_at = timezone.now()
+                changed.append(sketch)
+        DistinctSketch.objects.bulk_update(changed, ['registers', 'updated_at'])
+
+
+def estimate_count(metric, start, end, scope='all'):
+    """Distintos aproximados de `metric` entre `start` y `end` (inclusive)"""
+    merged = None
+    registers = DistinctSketch.objects.filter(
+        metric=metric, scope=scope, date__gte=start, date__lte=end
+    ).values_list('registers', flat=True)
+    for raw in registers:
+        hll = HyperLogLog(raw)
+        merged = hll if merged is None else merged.merge(hll)
+    return merged.count() if merged is not None else 0
+
+
+def _daily_values(metric, start, end):
+    """{(alcance, fecha): set de valores} calculado sobre las tablas de origen"""
+    daily = defaultdict(set)
+    if metric == 'active_users':
+        for model, user_field, timestamp_field in system_stats.ACTIVITY_SOURCES:
+            rows = model.objects.filter(
+                system_stats.in_days(timestamp_field, start, end), **{f'{user_field}__isnull': False}
+            ).annotate(day=TruncDate(timestamp_field)).values_list(user_field, 'day').distinct().order_by()
+            for user_id, day in rows:
+                daily[('all', day)].add(user_id)
+    elif metric == 'patients_seen':
+        for model, patient_path, user_field, timestamp_field in PATIENT_SOURCES:
+            rows = model.objects.filter(
+                system_stats.in_days(timestamp_field, start, end), **{f'{user_field}__isnull': False}
+            ).annotate(day=TruncDate(timestamp_field)).values_list(
+                patient_path, user_field, 'day'
+            ).distinct().order_by()
+            for patient_id, user_id, day in rows:
+                daily[('all', day)].add(patient_id)
+                daily[(user_scope(user_id), day)].add(patient_id)
+    else:
+        raise ValueError(f'Métrica inválida: {metric}')
+    return daily
+
+
+def exact_count(metric, start, end, scope='all'):
+    """Distintos exactos de `metric` entre `start` y `end` (auditoría)"""
+    values = set()
+    for (value_scope, _), day_values in _daily_values(metric, start, end).items():
+        if value_scope == scope:
+            values |= day_values
+    return len(values)
+
+
+def rebuild_sketches(start, end, metrics=METRICS):
+    """
+    Regenera los sketches diarios de `metrics` entre `start` y `end` desde las tablas de origen.
+
+    Returns:
+        int: Sketches escritos
+    """
+    sketches = []
+    for metric in metrics:
+        for (scope, day), values in _daily_values(metric, start, end).items():
+            hll = HyperLogLog()
+            for value in values:
+                hll.add(value)
+            sketches.append(DistinctSketch(metric=metric, scope=scope, date=day, registers=hll.to_bytes()))
+
+    with transaction.atomic():
+        DistinctSketch.objects.filter(metric__in=metrics, date__gte=start, date__lte=end).delete()
+        DistinctSketch.objects.bulk_create(sketches, batch_size=500)
+    return len(sketches)
@@ -0,0 +1,237 @@
+"""
+Caché de respuestas de estadísticas con stale-while-revalidate
+
+Cada respuesta se guarda bajo (endpoint, alcance, hash del conjunto de miembros,
+parámetros de consulta[, usuario]). Una entrada es fresca durante
+STATS_CACHE_TTL segundos; pasado ese tiempo se sirve igualmente de inmediato y
+se recalcula en segundo plano.
+
+- Coalescencia: el recálculo toma un candado con cache.add(); con N peticiones
+  simultáneas solo una recalcula y las demás sirven la copia existente (o esperan
+  brevemente a que aparezca una vigente, si aún no hay ninguna).
+- Invalidación: cada entrada guarda la firma de las generaciones de su alcance
+  (una por usuario miembro, o la global para el alcance 'all'). Las escrituras
+  incrementan la generación de los usuarios involucrados y la global; una entrada
+  con otra firma ya no se sirve y se recalcula antes de responder.
+- Solo se cachea con una caché compartida (apps.core.cache): con una caché local
+  de cada proceso ni el candado ni las generaciones llegarían a los demás workers.
+- GET condicional: el ETag de cada entrada se calcula una vez al guardarla; si
+  coincide con If-None-Match se responde 304 sin volver a serializar los datos.
+"""
+import functools
+import hashlib
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connections
+from django.http import HttpRequest
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+from apps.core import batching
+from apps.core.cache import is_shared
+from .conditional import data_etag, etag_matches, not_modified
+from .models import Participation
+from .scope import determine_stats_scope
+
+logger = logging.getLogger(__name__)
+
+GLOBAL_GENERATION_KEY = 'stats_cache:gen:all'
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _digest(*parts):
+    return hashlib.sha1('|'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def _user_generation_key(user_id):
+    return f'stats_cache:gen:user:{user_id}'
+
+
+def invalidate_for_users(user_ids, source_ids=()):
+    """
+    Marca como obsoletas las entradas de los alcances que incluyen a `user_ids` (y las globales).
+
+    `source_ids` agrega a los participantes de esos registros según el índice
+    de participación (vínculos indirectos, p. ej. quién subió la radiografía).
+    Se aplica al confirmar la transacción, junto con las demás invalidaciones
+    de la misma, para que un recálculo en paralelo no guarde datos previos a
+    la escritura.
+    """
+    if not is_shared():
+        # Con caché local no se cachean estadísticas (ver cached_statistics)
+        return
+    batching.add(_bump_generations, (set(user_ids), set(source_ids)))
+
+
+def _bump_generations(items):
+    user_ids, source_ids = set(), set()
+    for item_users, item_sources in items:
+        user_ids |= item_users
+        source_ids |= item_sources
+    if source_ids:
+        user_ids.update(Participation.objects.filter(source_id__in=source_ids).values_list('user_id', flat=True))
+    # Cualquier valor distinto del anterior invalida: no hace falta leerlo para incrementarlo
+    generation = time.time_ns()
+    keys = [GLOBAL_GENERATION_KEY, *(_user_generation_key(user_id) for user_id in user_ids if user_id)]
+    cache.set_many({key: generation for key in keys}, None)
+
+
+def generation_signature(scope_info):
+    """Firma de las generaciones de las que depende un alcance"""
+    if scope_info['scope'] == 'all':
+        keys = [GLOBAL_GENERATION_KEY]
+    else:
+        keys = [_user_generation_key(user_id) for user_id in sorted(scope_info['user_ids'])]
+    generations = cache.get_many(keys)
+    return _digest(*(generations.get(key, 0) for key in keys))
+
+
+class _Entry:
+    """Acceso a una entrada de caché y a su candado de recálculo"""
+
+    def __init__(self, key):
+        self.key = key
+        self.lock_key = f'{key}:lock'
+
+    def get(self):
+        entry = cache.get(self.key)
+        # Las entradas guardadas sin ETag (versiones anteriores) se recalculan
+        return entry if entry is not None and 'etag' in entry else None
+
+    def store(self, data, signature):
+        etag = data_etag(data)
+        cache.set(
+            self.key,
+            {
+                'data': data, 'etag': etag, 'signature': signature,
+                'fresh_until': time.time() + _setting('STATS_CACHE_TTL', 30),
+            },
+            _setting('STATS_CACHE_STALE_TTL', 600),
+        )
+        return etag
+
+    def acquire(self):
+        return cache.add(self.lock_key, 1, _setting('STATS_CACHE_LOCK_TIMEOUT', 30))
+
+    def release(self):
+        cache.delete(self.lock_key)
+
+    def wait(self, signature):
+        """Espera a que otra petición termine de calcular la entrada con la firma vigente"""
+        deadline = time.monotonic() + _setting('STATS_CACHE_WAIT', 2.0)
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            entry = self.get()
+            if entry is not None and entry['signature'] == signature:
+                return entry
+        return None
+
+
+def _respond(request, cached, state):
+    """Respuesta desde una entrada de caché (304 si el cliente ya tiene esa versión)"""
+    headers = {'X-Stats-Cache': state, 'ETag': cached['etag']}
+    if etag_matches(request, cached['etag']):
+        return not_modified(cached['etag'], headers)
+    return Response(cached['data'], headers=headers)
+
+
+def _compute(view_func, request, args, kwargs, entry, signature):
+    response = view_func(request, *args, **kwargs)
+    # Solo se cachean respuestas de DRF (las exportaciones en archivo se generan siempre)
+    if response.status_code == 200 and isinstance(response, Response):
+        response['ETag'] = entry.store(response.data, signature)
+    return response
+
+
+def _detached_request(user_id, path, query_params):
+    """
+    Petición GET propia para el recálculo en segundo plano.
+
+    La petición original ya se respondió (y se liberó) cuando el hilo corre;
+    el recálculo solo necesita el usuario (del que sale su alcance) y los
+    parámetros de consulta.
+    """
+    http_request = HttpRequest()
+    http_request.method = 'GET'
+    http_request.path = http_request.path_info = path
+    http_request.GET = query_params
+    request = Request(http_request)
+    request.user = get_user_model()._default_manager.get(pk=user_id)
+    return request
+
+
+def _refresh_in_background(view_func, request, args, kwargs, entry, signature):
+    user_id, path, query_params = request.user.pk, request.path, request.query_params.copy()
+
+    def run():
+        try:
+            _compute(view_func, _detached_request(user_id, path, query_params), args, kwargs, entry, signature)
+        except Exception:
+            logger.exception('Error al recalcular estadísticas en segundo plano (%s)', entry.key)
+        finally:
+            entry.release()
+            connections.close_all()
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+def cached_statistics(endpoint, per_user=False, scoped=True):
+    """
+    Decorador para vistas de estadísticas (debajo de @api_view).
+
+    Args:
+        endpoint: Nombre lógico del endpoint (parte de la clave)
+        per_user: La respuesta incluye datos propios del usuario (p. ej. el dashboard)
+        scoped: La respuesta depende del alcance del usuario; si es False se
+            comparte entre todos y se invalida con la generación global
+    """
+    def decorator(view_func):
+        @functools.wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if not _setting('STATS_CACHE_ENABLED', True) or not is_shared():
+                return view_func(request, *args, **kwargs)
+
+            if scoped:
+                scope_info = determine_stats_scope(request.user)
+            else:
+                scope_info = {'scope': 'all', 'user_ids': set()}
+            members = _digest(*sorted(scope_info['user_ids']))
+            params = _digest(*sorted(request.query_params.lists()))
+            owner = request.user.pk if per_user else '-'
+            entry = _Entry(f"stats_cache:{endpoint}:{scope_info['scope']}:{members}:{params}:{owner}")
+            signature = generation_signature(scope_info)
+
+            cached = entry.get()
+            if cached is not None and cached['signature'] == signature:
+                if cached['fresh_until'] > time.time():
+                    return _respond(request, cached, 'hit')
+                # Vencida pero sin escrituras desde entonces: servir la copia y
+                # recalcular una sola vez en segundo plano
+                if entry.acquire():
+                    _refresh_in_background(view_func, request, args, kwargs, entry, signature)
+                return _respond(request, cached, 'stale')
+
+            # Sin copia, o invalidada por una escritura: se recalcula antes de responder
+            if not entry.acquire():
+                cached = entry.wait(signature)
+                if cached is not None:
+                    return _respond(request, cached, 'hit')
+                return view_func(request, *args, **kwargs)
+            try:
+                response = _compute(view_func, request, args, kwargs, entry, signature)
+            finally:
+                entry.release()
+            if response.has_header('ETag') and etag_matches(request, response['ETag']):
+                return not_modified(response['ETag'], {'X-Stats-Cache': 'miss'})
+            response['X-Stats-Cache'] = 'miss'
+            return response
+        return wrapper
+    return decorator
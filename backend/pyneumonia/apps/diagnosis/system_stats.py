@@ -0,0 +1,468 @@
+"""
+Mantenimiento incremental de SystemStatistics
+
+Cada evento de escritura (alta de paciente, radiografía, diagnóstico o reporte,
+cambios de estado) aporta un incremento sobre la fila del día; los de una misma
+transacción se aplican juntos al confirmarla, con un UPDATE atómico con F().
+Las métricas derivadas (porcentajes, promedios, tasa de éxito) se calculan a
+partir de los contadores base al leer. Al abrir un día nuevo se copian los
+acumulados del día anterior y los días pasados quedan cerrados (is_final).
+
+El recálculo completo (`update_system_statistics`) queda solo para reparación,
+a través del comando `rebuild_system_statistics`. El historial de días sin
+fila se genera en bloque con `backfill_range` (comando `backfill_system_statistics`).
+"""
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from django.db import IntegrityError, connections, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from apps.core import batching
+from .models import (
+    Patient, XRayImage, DiagnosisResult, MedicalReport, SystemStatistics, DailyActiveUser
+)
+from . import sketches
+
+PNEUMONIA_CLASSES = ('PNEUMONIA_BACTERIA', 'PNEUMONIA_BACTERIAL', 'PNEUMONIA_VIRAL')
+
+# Campos que se arrastran de un día al siguiente
+CUMULATIVE_FIELDS = (
+    'total_patients', 'total_xrays', 'total_diagnoses', 'total_reports',
+    'normal_diagnoses', 'pneumonia_diagnoses',
+    'processing_time_total', 'processing_time_samples',
+)
+
+DERIVED_FIELDS = (
+    'normal_percentage', 'pneumonia_percentage', 'average_system_response_time', 'api_success_rate',
+)
+
+# Contador diario -> acumulado al que suma
+DAILY_TOTALS = {
+    'daily_patients_registered': 'total_patients',
+    'daily_xrays_uploaded': 'total_xrays',
+    'daily_diagnoses_made': 'total_diagnoses',
+    'daily_reports_generated': 'total_reports',
+}
+
+# (modelo, usuario, fecha de la acción) que cuentan como actividad del usuario
+ACTIVITY_SOURCES = (
+    (Patient, 'created_by', 'created_at'),
+    (XRayImage, 'uploaded_by', 'uploaded_at'),
+    (DiagnosisResult, 'radiologist_review', 'radiologist_reviewed_at'),
+    (DiagnosisResult, 'reviewed_by', 'reviewed_at'),
+    (DiagnosisResult, 'treating_physician_approval', 'approved_at'),
+    (MedicalReport, 'created_by', 'created_at'),
+)
+
+
+def class_counter(predicted_class):
+    """Contador de distribución al que pertenece una clase predicha (o None)"""
+    if predicted_class == 'NORMAL':
+        return 'normal_diagnoses'
+    if predicted_class in PNEUMONIA_CLASSES:
+        return 'pneumonia_diagnoses'
+    return None
+
+
+def created_today(timestamp):
+    """1 si el registro se creó hoy (sus contadores diarios siguen abiertos), 0 si no"""
+    return int(timestamp is not None and timezone.localdate(timestamp) == timezone.localdate())
+
+
+def finalize_days(before):
+    """Cierra los días anteriores a `before`, guardando sus métricas derivadas"""
+    open_days = list(SystemStatistics.objects.filter(date__lt=before, is_final=False))
+    for stats in open_days:
+        stats.apply_derived_metrics()
+        stats.is_final = True
+    if open_days:
+        SystemStatistics.objects.bulk_update(open_days, [*DERIVED_FIELDS, 'is_final'])
+    return len(open_days)
+
+
+def open_day(target_date):
+    """
+    Fila del día, creándola si no existe. Retorna (estadísticas, recalculada).
+
+    Los acumulados se toman del último día registrado; si no hay historial se
+    hace un único recálculo completo para sembrar la serie (que ya incluye el
+    evento en curso, por eso se informa con `recalculada`).
+    """
+    stats = SystemStatistics.objects.filter(date=target_date).first()
+    if stats is not None:
+        return stats, False
+
+    previous = SystemStatistics.objects.filter(date__lt=target_date).order_by('-date').first()
+    if previous is None:
+        return update_system_statistics(target_date), True
+
+    finalize_days(target_date)
+    try:
+        with transaction.atomic():
+            stats = SystemStatistics.objects.create(
+                date=target_date,
+                **{name: getattr(previous, name) for name in CUMULATIVE_FIELDS}
+            )
+    except IntegrityError:
+        # Otro proceso abrió el día en paralelo
+        stats = SystemStatistics.objects.get(date=target_date)
+    return stats, False
+
+
+def record(target_date=None, **deltas):
+    """
+    Acumula incrementos sobre la fila del día (hoy por defecto).
+
+    Los incrementos de la transacción se suman y se aplican con un solo UPDATE
+    por día al confirmarla (apps.core.batching).
+
+    Ejemplo: record(daily_xrays_uploaded=1, total_xrays=1)
+    """
+    deltas = {name: value for name, value in deltas.items() if value}
+    if deltas:
+        batching.add(_apply_records, (target_date or timezone.localdate(), deltas))
+
+
+def _apply_records(items):
+    by_day = defaultdict(Counter)
+    for target_date, deltas in items:
+        by_day[target_date].update(deltas)
+    for target_date, deltas in by_day.items():
+        _apply_day(target_date, {name: value for name, value in deltas.items() if value})
+
+
+def _apply_day(target_date, deltas):
+    """Incrementos atómicos con F() sobre la fila del día"""
+    if not deltas:
+        return
+    updates = {name: F(name) + value for name, value in deltas.items()}
+    day = SystemStatistics.objects.filter(date=target_date, is_final=False)
+    if day.update(**updates):
+        return
+    if SystemStatistics.objects.filter(date=target_date).exists():
+        # Día cerrado: solo se modifica mediante reparación explícita
+        return
+    _, recalculated = open_day(target_date)
+    if not recalculated:
+        day.update(**updates)
+
+
+def mark_active(user_id, target_date=None):
+    """Registra actividad del usuario en el día; solo la primera vez suma a active_users_today"""
+    if not user_id:
+        return
+    target_date = target_date or timezone.localdate()
+    _, created = DailyActiveUser.objects.get_or_create(date=target_date, user_id=user_id)
+    if created:
+        record(target_date, active_users_today=1)
+
+
+def _diagnosis_state(predicted_class, status, processing_time):
+    """Aporte de un diagnóstico a los contadores de distribución y de tiempos"""
+    state = {'normal_diagnoses': 0, 'pneumonia_diagnoses': 0}
+    counter = class_counter(predicted_class)
+    if counter:
+        state[counter] = 1
+    sampled = status == 'completed' and processing_time is not None
+    state['processing_time_total'] = processing_time if sampled else 0.0
+    state['processing_time_samples'] = int(sampled)
+    state['daily_completed_diagnoses'] = int(status == 'completed')
+    return state
+
+
+def record_diagnosis_change(instance, created, changes):
+    """Traduce el alta o una transición de un diagnóstico en incrementos del día"""
+    fields = ('predicted_class', 'status', 'processing_time')
+    current = [getattr(instance, name) for name in fields]
+    new_state = _diagnosis_state(*current)
+    if created:
+        old_state = dict.fromkeys(new_state, 0)
+    else:
+        previous = [changes[name][0] if name in changes else value for name, value in zip(fields, current)]
+        old_state = _diagnosis_state(*previous)
+
+    deltas = {name: new_state[name] - old_state[name] for name in new_state}
+    # La tasa de éxito del día solo considera diagnósticos creados ese día
+    if not created_today(instance.created_at):
+        deltas.pop('daily_completed_diagnoses')
+    if created:
+        deltas.update(daily_diagnoses_made=1, total_diagnoses=1)
+    record(**deltas)
+
+
+def record_diagnosis_delete(instance):
+    """Retira un diagnóstico eliminado de los acumulados (y del día si se creó hoy)"""
+    state = _diagnosis_state(instance.predicted_class, instance.status, instance.processing_time)
+    today = created_today(instance.created_at)
+    state['daily_completed_diagnoses'] *= today
+    record(
+        total_diagnoses=-1, daily_diagnoses_made=-today,
+        **{name: -value for name, value in state.items()}
+    )
+
+
+def read_day(target_date):
+    """
+    Estadísticas del día con métricas derivadas calculadas en memoria.
+
+    Un día pasado sin fila se calcula desde las tablas de origen sin guardarlo
+    (el historial se genera con `backfill_system_statistics`).
+    """
+    if target_date == timezone.localdate():
+        stats, _ = open_day(target_date)
+    else:
+        stats = SystemStatistics.objects.filter(date=target_date).first()
+        if stats is None:
+            return compute_day(target_date)
+    if not stats.is_final:
+        stats.apply_derived_metrics()
+    return stats
+
+
+def update_system_statistics(target_date):
+    """
+    Recalcula desde cero las estadísticas del sistema para una fecha (reparación)
+
+    Args:
+        target_date: Fecha para la cual calcular estadísticas
+    """
+    # Rango de fechas para el día
+    start_of_day = timezone.make_aware(datetime.combine(target_date, datetime.min.time()))
+    end_of_day = timezone.make_aware(datetime.combine(target_date, datetime.max.time()))
+    in_day = Q(created_at__gte=start_of_day, created_at__lte=end_of_day)
+    until_day = Q(created_at__lte=end_of_day)
+
+    # ==================== CONTADORES ====================
+    patients = Patient.objects.aggregate(
+        daily=Count('pk', filter=in_day), total=Count('pk', filter=until_day)
+    )
+    xrays = XRayImage.objects.aggregate(
+        daily=Count('pk', filter=Q(uploaded_at__gte=start_of_day, uploaded_at__lte=end_of_day)),
+        total=Count('pk', filter=Q(uploaded_at__lte=end_of_day)),
+    )
+    reports = MedicalReport.objects.aggregate(
+        daily=Count('pk', filter=in_day), total=Count('pk', filter=until_day)
+    )
+    completed_with_time = until_day & Q(status='completed', processing_time__isnull=False)
+    diagnoses = DiagnosisResult.objects.aggregate(
+        daily=Count('pk', filter=in_day),
+        daily_completed=Count('pk', filter=in_day & Q(status='completed')),
+        total=Count('pk', filter=until_day),
+        normal=Count('pk', filter=until_day & Q(predicted_class='NORMAL')),
+        pneumonia=Count('pk', filter=until_day & Q(predicted_class__in=PNEUMONIA_CLASSES)),
+        time_total=Sum('processing_time', filter=completed_with_time),
+        time_samples=Count('pk', filter=completed_with_time),
+    )
+
+    # ==================== USUARIOS ACTIVOS ====================
+    # Usuarios que realizaron alguna acción en el día (una consulta por fuente, sin joins)
+    active_user_ids = set()
+    for model, user_field, timestamp_field in ACTIVITY_SOURCES:
+        active_user_ids.update(model.objects.filter(
+            in_days(timestamp_field, target_date, target_date), **{f'{user_field}__isnull': False}
+        ).values_list(user_field, flat=True).distinct().order_by())
+    DailyActiveUser.objects.bulk_create(
+        [DailyActiveUser(date=target_date, user_id=user_id) for user_id in active_user_ids],
+        ignore_conflicts=True,
+    )
+    # bulk_create no emite signals: los usuarios se agregan también al sketch del día
+    sketches.observe_many('active_users', {target_date: active_user_ids})
+
+    # ==================== ACTUALIZAR ESTADÍSTICAS ====================
+    stats = SystemStatistics(
+        date=target_date,
+        daily_patients_registered=patients['daily'],
+        daily_xrays_uploaded=xrays['daily'],
+        daily_diagnoses_made=diagnoses['daily'],
+        daily_reports_generated=reports['daily'],
+        daily_completed_diagnoses=diagnoses['daily_completed'],
+        total_patients=patients['total'],
+        total_xrays=xrays['total'],
+        total_diagnoses=diagnoses['total'],
+        total_reports=reports['total'],
+        normal_diagnoses=diagnoses['normal'],
+        pneumonia_diagnoses=diagnoses['pneumonia'],
+        processing_time_total=diagnoses['time_total'] or 0.0,
+        processing_time_samples=diagnoses['time_samples'],
+        active_users_today=DailyActiveUser.objects.filter(date=target_date).count(),
+        is_final=target_date < timezone.localdate(),
+    ).apply_derived_metrics()
+
+    defaults = {
+        field.name: getattr(stats, field.name)
+        for field in SystemStatistics._meta.concrete_fields
+        if field.name not in ('id', 'date', 'created_at', 'updated_at')
+    }
+    stats, _ = SystemStatistics.objects.update_or_create(date=target_date, defaults=defaults)
+    return stats
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, datetime.min.time()))
+
+
+def in_days(field, start, end):
+    return Q(**{f'{field}__gte': _day_start(start), f'{field}__lt': _day_start(end + timedelta(days=1))})
+
+
+def _diagnosis_counters():
+    completed_with_time = Q(status='completed', processing_time__isnull=False)
+    return {
+        'normal_diagnoses': Count('pk', filter=Q(predicted_class='NORMAL')),
+        'pneumonia_diagnoses': Count('pk', filter=Q(predicted_class__in=PNEUMONIA_CLASSES)),
+        'processing_time_total': Sum('processing_time', filter=completed_with_time),
+        'processing_time_samples': Count('pk', filter=completed_with_time),
+    }
+
+
+def _totals_before(start):
+    """Acumulados al cierre del día anterior a `start`"""
+    before = _day_start(start)
+    totals = Counter()
+    for model, field, counter in (
+        (Patient, 'created_at', 'total_patients'),
+        (XRayImage, 'uploaded_at', 'total_xrays'),
+        (MedicalReport, 'created_at', 'total_reports'),
+    ):
+        totals[counter] = model.objects.filter(**{f'{field}__lt': before}).count()
+    diagnoses = DiagnosisResult.objects.filter(created_at__lt=before).aggregate(
+        total_diagnoses=Count('pk'), **_diagnosis_counters()
+    )
+    totals.update({name: value for name, value in diagnoses.items() if value})
+    return totals
+
+
+def collect_days(start, end):
+    """
+    Aportes diarios de [start, end] con una consulta agrupada por día para cada métrica.
+
+    Returns:
+        tuple: ({fecha: Counter de incrementos del día}, {fecha: set de usuarios activos})
+    """
+    daily = defaultdict(Counter)
+    for model, field, counter in (
+        (Patient, 'created_at', 'daily_patients_registered'),
+        (XRayImage, 'uploaded_at', 'daily_xrays_uploaded'),
+        (MedicalReport, 'created_at', 'daily_reports_generated'),
+    ):
+        rows = model.objects.filter(in_days(field, start, end)).annotate(
+            day=TruncDate(field)
+        ).values('day').annotate(total=Count('pk')).order_by()
+        for row in rows:
+            daily[row['day']][counter] += row['total']
+
+    rows = DiagnosisResult.objects.filter(in_days('created_at', start, end)).annotate(day=TruncDate('created_at')).values('day').annotate(
+        daily_diagnoses_made=Count('pk'),
+        daily_completed_diagnoses=Count('pk', filter=Q(status='completed')),
+        **_diagnosis_counters(),
+    ).order_by()
+    for row in rows:
+        daily[row.pop('day')].update({name: value for name, value in row.items() if value})
+
+    active = defaultdict(set)
+    for model, user_field, timestamp_field in ACTIVITY_SOURCES:
+        rows = model.objects.filter(
+            in_days(timestamp_field, start, end), **{f'{user_field}__isnull': False}
+        ).annotate(day=TruncDate(timestamp_field)).values_list(user_field, 'day').distinct().order_by()
+        for user_id, day in rows:
+            active[day].add(user_id)
+    return daily, active
+
+
+def _build_day(day, counters, totals, active_users, today):
+    """Fila (sin guardar) de un día a partir de sus aportes y los acumulados del día anterior"""
+    for daily_field, total_field in DAILY_TOTALS.items():
+        totals[total_field] += counters[daily_field]
+    for name in ('normal_diagnoses', 'pneumonia_diagnoses', 'processing_time_total', 'processing_time_samples'):
+        totals[name] += counters[name]
+    return SystemStatistics(
+        date=day,
+        daily_completed_diagnoses=counters['daily_completed_diagnoses'],
+        active_users_today=active_users,
+        is_final=day < today,
+        **{name: counters[name] for name in DAILY_TOTALS},
+        **{name: totals[name] for name in CUMULATIVE_FIELDS},
+    ).apply_derived_metrics()
+
+
+def compute_day(target_date):
+    """Estadísticas de un día calculadas desde las tablas de origen, sin guardarlas"""
+    daily, active = collect_days(target_date, target_date)
+    return _build_day(
+        target_date, daily[target_date], _totals_before(target_date),
+        len(active[target_date]), timezone.localdate(),
+    )
+
+
+def _collect_chunk(bounds):
+    try:
+        return collect_days(*bounds)
+    finally:
+        # Cada hilo usa su propia conexión
+        connections.close_all()
+
+
+def backfill_range(start, end, workers=4, chunk_days=31, stdout=None):
+    """
+    Calcula y guarda las estadísticas de todos los días entre `start` y `end` (inclusive).
+
+    El rango se divide en bloques de `chunk_days` que se consultan en paralelo;
+    los acumulados se obtienen sumando los aportes diarios sobre los totales
+    previos a `start`, y todas las filas se escriben con un único upsert.
+
+    Returns:
+        int: Días escritos
+    """
+    chunks = []
+    chunk_start = start
+    while chunk_start <= end:
+        chunk_end = min(chunk_start + timedelta(days=chunk_days - 1), end)
+        chunks.append((chunk_start, chunk_end))
+        chunk_start = chunk_end + timedelta(days=1)
+
+    if workers > 1 and len(chunks) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_collect_chunk, chunks))
+    else:
+        results = [collect_days(*bounds) for bounds in chunks]
+
+    daily, active = defaultdict(Counter), defaultdict(set)
+    for chunk_daily, chunk_active in results:
+        daily.update(chunk_daily)
+        active.update(chunk_active)
+    if stdout:
+        stdout.write(f'{len(chunks)} bloques consultados')
+
+    DailyActiveUser.objects.bulk_create(
+        [DailyActiveUser(date=day, user_id=user_id) for day, user_ids in active.items() for user_id in user_ids],
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+    sketches.observe_many('active_users', active)
+    active_counts = dict(
+        DailyActiveUser.objects.filter(date__gte=start, date__lte=end).values('date').annotate(
+            total=Count('pk')
+        ).order_by().values_list('date', 'total')
+    )
+
+    totals = _totals_before(start)
+    today = timezone.localdate()
+    rows = []
+    day = start
+    while day <= end:
+        rows.append(_build_day(day, daily[day], totals, active_counts.get(day, 0), today))
+        day += timedelta(days=1)
+
+    update_fields = [
+        field.name for field in SystemStatistics._meta.concrete_fields
+        if field.name not in ('id', 'date', 'created_at')
+    ]
+    with transaction.atomic():
+        SystemStatistics.objects.bulk_create(
+            rows, batch_size=500, update_conflicts=True, unique_fields=['date'], update_fields=update_fields,
+        )
+    return len(rows)
@@ -1,3 +1,1654 @@
-from django.test import TestCase
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+import uuid
+from datetime import date, timedelta
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from asgiref.sync import async_to_sync
+from django.db import connection, transaction
+from django.db.models import Q, Sum
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.pagination import PageNumberPagination
+from apps.core.pagination import PageOrKeysetPagination
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+
+from apps.security.models import User, AuditUser
+from .models import Patient, MedicalOrder, XRayImage, DiagnosisResult, MedicalReport
+from .views import dashboard_overview_view, timeseries_view
+from .scope import determine_stats_scope
+from .demographics import years_before, demographic_cube, summarize
+from .models import (
+    MetricCounter, SystemStatistics, DistinctSketch, UserPerformanceMetrics, DiagnosticStatistics, RollupPendingDay,
+    Participation, PatientLookupKey,
+)
+from .sketches import HyperLogLog, rebuild_sketches, estimate_count, exact_count
+from .system_stats import backfill_range, update_system_statistics
+from . import (
+    timeseries, role_metrics, search, autocomplete, bulk_import, embeddings, system_stats, performance, rollups,
+    participation, stats_cache,
+)
+
+
+# Caché local del proceso: los módulos con invalidación no cachean y las pruebas
+# de conteo de consultas miden solo las consultas de la vista
+LOCAL_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+# Caché compartida sin Redis (tabla de la migración core.0001_cache_table)
+SHARED_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'pyneumonia_cache'}}
+
+
+def create_user(username, group_name=None, **extra):
+    user = User.objects.create_user(
+        username=username, email=f'{username}@pyneumonia.test', password='x',
+        first_name=username.title(), last_name='Test', **extra
+    )
+    if group_name:
+        group, _ = Group.objects.get_or_create(name=group_name)
+        user.groups.add(group)
+    return user
+
+
+@override_settings(CACHES=LOCAL_CACHE, STATS_CACHE_ENABLED=False)
+class DashboardQueryCountTests(TestCase):
+    """El dashboard debe costar un número fijo de consultas por rol, sin importar el volumen"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.radiologist = create_user('radiologo', 'Radiólogos')
+        cls.physician = create_user('medico', 'Médicos')
+        cls.receptionist = create_user('recepcion', 'Recepcionistas')
+        cls.other = create_user('otro', 'Auditores')
+        cls.admin = create_user('admin', is_superuser=True, is_staff=True)
+
+        for index in range(3):
+            patient = Patient.objects.create(
+                dni=f'17100340{index}{index}', first_name='Paciente', last_name=f'N{index}',
+                date_of_birth=date(1980 + index, 1, 1), gender='F', created_by=cls.receptionist,
+            )
+            order = MedicalOrder.objects.create(patient=patient, requested_by=cls.physician, reason='Tos')
+            xray = XRayImage.objects.create(
+                patient=patient, medical_order=order, image='xrays/test.png', uploaded_by=cls.receptionist
+            )
+            diagnosis = DiagnosisResult.objects.create(
+                xray=xray, predicted_class='PNEUMONIA_VIRAL', class_id=3, confidence='0.800',
+                radiologist_review=cls.radiologist, severity='moderate', reviewed_by=cls.physician,
+            )
+            MedicalReport.objects.create(
+                diagnosis=diagnosis, title='Reporte', findings='-', impression='-',
+                recommendations='-', created_by=cls.physician,
+            )
+
+    def setUp(self):
+        # El alcance se cachea entre peticiones; cada prueba mide el camino sin caché
+        cache.clear()
+
+    def get_dashboard(self, user):
+        request = APIRequestFactory().get('/api/diagnosis/statistics/dashboard/')
+        force_authenticate(request, user=user)
+        response = dashboard_overview_view(request)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def assert_dashboard_queries(self, user, expected):
+        with self.assertNumQueries(expected):
+            return self.get_dashboard(user)
+
+    def test_radiologist_query_count(self):
+        data = self.assert_dashboard_queries(self.radiologist, 7)
+        self.assertEqual(data['group_specific_metrics']['my_reviews'], 3)
+        self.assertEqual(data['summary']['total_diagnoses'], 3)
+
+    def test_physician_query_count(self):
+        data = self.assert_dashboard_queries(self.physician, 8)
+        self.assertEqual(data['group_specific_metrics']['orders_requested'], 3)
+        self.assertEqual(data['group_specific_metrics']['reports_generated'], 3)
+
+    def test_receptionist_query_count(self):
+        data = self.assert_dashboard_queries(self.receptionist, 8)
+        self.assertEqual(data['group_specific_metrics']['patients_with_pending_xrays'], 3)
+        # Generar el reporte completa la orden
+        self.assertEqual(data['group_specific_metrics']['orders_pending'], 0)
+        self.assertEqual(data['group_specific_metrics']['orders_today'], 3)
+
+    def test_generic_group_query_count(self):
+        data = self.assert_dashboard_queries(self.other, 7)
+        self.assertEqual(data['summary']['total_diagnoses'], 0)
+
+    def test_admin_query_count(self):
+        data = self.assert_dashboard_queries(self.admin, 8)
+        self.assertEqual(data['group_specific_metrics']['total_users'], 5)
+        self.assertEqual(data['group_specific_metrics']['users_without_group'], 1)
+        self.assertEqual(data['disease_stats']['pneumonia_cases'], 3)
+
+    def test_role_bound_by_group_id(self):
+        group = self.other.groups.get()
+        with override_settings(DASHBOARD_ROLE_GROUPS={'physician': [group.pk]}):
+            data = self.assert_dashboard_queries(self.other, 8)
+        self.assertIn('orders_requested', data['group_specific_metrics'])
+
+    def test_registered_metric_adds_no_query(self):
+        metrics = role_metrics.ROLE_METRICS['radiologist']
+        self.addCleanup(metrics.pop, 'normal_cases')
+        role_metrics.register_role_metrics('radiologist', {
+            'normal_cases': role_metrics.count('diagnoses', predicted_class='NORMAL'),
+        })
+        data = self.assert_dashboard_queries(self.radiologist, 7)
+        self.assertEqual(data['group_specific_metrics']['normal_cases'], 0)
+
+    @override_settings(STATS_ASYNC_WORKERS=0, STATS_CACHE_ENABLED=False)
+    def test_async_dashboard_matches_sync(self):
+        for user in (self.radiologist, self.physician, self.receptionist, self.other, self.admin):
+            self.client.force_login(user)
+            self.async_client.force_login(user)
+            sync_data = self.client.get('/api/diagnosis/statistics/dashboard/').json()
+            response = async_to_sync(self.async_client.get)('/api/diagnosis/statistics/dashboard/async/')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json(), sync_data)
+
+    def test_async_dashboard_requires_authentication(self):
+        response = async_to_sync(self.async_client.get)('/api/diagnosis/statistics/dashboard/async/')
+        self.assertEqual(response.status_code, 403)
+
+
+class StatsScopeCacheTests(TestCase):
+    """El alcance se resuelve sin consultar grupos una vez cacheado y se invalida al cambiar membresías"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.radiologist = create_user('radiologo', 'Radiólogos')
+        cls.colleague = create_user('colega', 'Radiólogos')
+        cls.newcomer = create_user('nuevo')
+
+    def setUp(self):
+        cache.clear()
+
+    def scope_queries(self, user):
+        """Alcance del usuario y todas las consultas que costó (incluidas las de la caché)"""
+        with CaptureQueriesContext(connection) as context:
+            scope_info = determine_stats_scope(user)
+        return scope_info, context.captured_queries
+
+    def fast_cache(self):
+        # La caché local hace de Redis: compartida y sin consultas por lectura
+        return mock.patch('apps.diagnosis.scope.is_fast_shared', return_value=True)
+
+    @override_settings(CACHES=LOCAL_CACHE)
+    def test_cached_scope_runs_no_queries(self):
+        with self.fast_cache():
+            scope_info, queries = self.scope_queries(self.radiologist)
+            self.assertEqual(len(queries), 2)
+            cached_info, queries = self.scope_queries(self.radiologist)
+        self.assertEqual(queries, [])
+        self.assertEqual(cached_info, scope_info)
+        self.assertEqual(scope_info['scope'], 'group')
+        self.assertEqual(scope_info['user_ids'], {self.radiologist.id, self.colleague.id})
+        self.assertEqual(scope_info['primary_group'], 'Radiólogos')
+
+    @override_settings(CACHES=SHARED_CACHE)
+    def test_database_cache_is_not_used(self):
+        # Leer versión y entrada de la tabla costaría lo mismo que calcular el alcance
+        for _ in range(2):
+            scope_info, queries = self.scope_queries(self.radiologist)
+            self.assertEqual(len(queries), 2)
+        self.assertEqual(scope_info['user_ids'], {self.radiologist.id, self.colleague.id})
+
+    @override_settings(CACHES=LOCAL_CACHE)
+    def test_membership_change_invalidates_scope(self):
+        self.enterContext(self.fast_cache())
+        determine_stats_scope(self.radiologist)
+        self.newcomer.groups.add(Group.objects.get(name='Radiólogos'))
+        scope_info = determine_stats_scope(self.radiologist)
+        self.assertIn(self.newcomer.id, scope_info['user_ids'])
+
+        self.colleague.groups.clear()
+        self.assertNotIn(self.colleague.id, determine_stats_scope(self.radiologist)['user_ids'])
+
+    @override_settings(CACHES=LOCAL_CACHE)
+    def test_process_local_cache_is_not_used(self):
+        determine_stats_scope(self.radiologist)
+        # Sin m2m_changed: otro worker no vería la invalidación
+        User.groups.through.objects.filter(user=self.colleague).delete()
+        self.assertNotIn(self.colleague.id, determine_stats_scope(self.radiologist)['user_ids'])
+
+
+class PatientDemographicsTests(TestCase):
+    """La distribución demográfica sale de una sola consulta y respeta los años bisiestos"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('registro')
+        births = [date(2016, 2, 29), date(2006, 2, 28), date(1990, 6, 1), date(1950, 1, 1)]
+        for index, born in enumerate(births):
+            patient = Patient.objects.create(
+                dni=f'09100340{index}{index}', first_name='Paciente', last_name=f'D{index}',
+                date_of_birth=born, gender='M' if index % 2 else 'F', created_by=cls.user,
+                is_active=index != 3,
+            )
+            if index == 2:
+                XRayImage.objects.create(patient=patient, image='xrays/test.png', uploaded_by=cls.user)
+
+    def test_years_before_leap_day(self):
+        self.assertEqual(years_before(date(2024, 2, 29), 18), date(2006, 2, 28))
+        self.assertEqual(years_before(date(2024, 2, 29), 4), date(2020, 2, 29))
+
+    def test_single_query_summary(self):
+        with self.assertNumQueries(1):
+            cube = demographic_cube(Patient.objects.all(), today=date(2024, 2, 29))
+        summary = summarize(cube)
+        self.assertEqual(summary['total_patients'], 4)
+        self.assertEqual(summary['inactive_patients'], 1)
+        # Nacido el 28/02/2006: cumple 18 el 28/02/2024 y pasa a '19-35'
+        self.assertEqual(summary['age_distribution'], {'0-18': 1, '19-35': 2, '36-50': 0, '51-65': 0, '65+': 1})
+        self.assertEqual(summary['patients_with_xrays'], 1)
+        self.assertEqual(summary['total_xrays'], 1)
+        self.assertEqual(summary['avg_xrays_per_patient'], 0.25)
+
+    def test_boundary_ages_keep_original_cutoffs(self):
+        expected = {
+            17: '0-18', 18: '19-35', 19: '19-35', 35: '36-50', 36: '36-50',
+            50: '51-65', 64: '51-65', 65: '65+', 66: '65+',
+        }
+        for age in expected:
+            Patient.objects.create(
+                dni=f'0920{age:04d}00', first_name='Borde', last_name=f'Edad {age}',
+                date_of_birth=date(2024 - age, 1, 1), gender='F', created_by=self.user,
+            )
+        cube = demographic_cube(Patient.objects.filter(first_name='Borde'), today=date(2024, 6, 15))
+        distribution = summarize(cube)['age_distribution']
+        for label in set(expected.values()):
+            with self.subTest(label=label):
+                self.assertEqual(distribution[label], list(expected.values()).count(label))
+        # El día del cumpleaños ya cuenta en el rango siguiente
+        cube = demographic_cube(Patient.objects.filter(last_name='Edad 18'), today=date(2024, 1, 1))
+        self.assertEqual(summarize(cube)['age_distribution']['19-35'], 1)
+
+
+class MetricCounterTests(TestCase):
+    """Los contadores horarios siguen a las escrituras y coinciden con una reconstrucción completa"""
+
+    def counters(self):
+        return sorted(MetricCounter.objects.filter(count__gt=0).values_list('metric', 'bucket', 'dimension', 'count'))
+
+    def test_incremental_matches_rebuild(self):
+        user = create_user('contador')
+        with self.captureOnCommitCallbacks(execute=True):
+            patient = Patient.objects.create(
+                dni='1710034065', first_name='Serie', last_name='Tiempo',
+                date_of_birth=date(1990, 1, 1), gender='F', created_by=user,
+            )
+            diagnoses = []
+            for index in range(3):
+                xray = XRayImage.objects.create(patient=patient, image='xrays/test.png', uploaded_by=user)
+                diagnoses.append(DiagnosisResult.objects.create(
+                    xray=xray, predicted_class='NORMAL', class_id=1, confidence='0.900',
+                ))
+        with self.captureOnCommitCallbacks(execute=True):
+            diagnoses[0].predicted_class = 'PNEUMONIA_VIRAL'
+            diagnoses[0].status = 'error'
+            diagnoses[0].save()
+            diagnoses[1].delete()
+
+        incremental = self.counters()
+        timeseries.rebuild()
+        self.assertEqual(incremental, self.counters())
+
+        points = timeseries.series(
+            'diagnoses', 'month', timeseries.hour_bucket(patient.created_at), patient.created_at + timedelta(hours=1),
+            by_dimension=True,
+        )
+        self.assertEqual(
+            [(point['dimension'], point['count']) for point in points], [('NORMAL', 1), ('PNEUMONIA_VIRAL', 1)]
+        )
+
+        request = APIRequestFactory().get('/api/diagnosis/statistics/timeseries/', {'metric': 'xray_uploads'})
+        force_authenticate(request, user=user)
+        response = timeseries_view(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['total'], 3)
+
+    def test_migration_backfills_existing_rows(self):
+        from importlib import import_module
+        from django.db.migrations.loader import MigrationLoader
+        migration = import_module('apps.diagnosis.migrations.0012_metric_counter')
+
+        user = create_user('contador_migracion')
+        with self.captureOnCommitCallbacks(execute=True):
+            patient = Patient.objects.create(
+                dni='1710034066', first_name='Serie', last_name='Migrada',
+                date_of_birth=date(1990, 1, 1), gender='M', created_by=user,
+            )
+            XRayImage.objects.create(patient=patient, image='xrays/test.png', uploaded_by=user)
+        expected = self.counters()
+
+        MetricCounter.objects.all().delete()
+        migration.backfill_counters(MigrationLoader(connection).project_state().apps, None)
+        self.assertEqual(self.counters(), expected)
+        self.assertIn('xray_uploads', {row[0] for row in expected})
+
+
+class SystemStatisticsBackfillTests(TestCase):
+    """El backfill por rango coincide con el recálculo día por día"""
+
+    def snapshot(self):
+        fields = [field.name for field in SystemStatistics._meta.concrete_fields
+                  if field.name not in ('id', 'created_at', 'updated_at')]
+        return list(SystemStatistics.objects.order_by('date').values_list(*fields))
+
+    def test_backfill_matches_daily_recompute(self):
+        user = create_user('historial')
+        today = timezone.localdate()
+        for offset in range(4):
+            patient = Patient.objects.create(
+                dni=f'170003406{offset}', first_name='Historial', last_name=f'H{offset}',
+                date_of_birth=date(1990, 1, 1), gender='F', created_by=user,
+            )
+            xray = XRayImage.objects.create(patient=patient, image='xrays/test.png', uploaded_by=user)
+            diagnosis = DiagnosisResult.objects.create(
+                xray=xray, predicted_class='NORMAL' if offset % 2 else 'PNEUMONIA_VIRAL', class_id=1,
+                confidence='0.900', processing_time=1.5 * (offset + 1),
+            )
+            moment = timezone.now() - timedelta(days=offset * 2)
+            Patient.objects.filter(pk=patient.pk).update(created_at=moment)
+            XRayImage.objects.filter(pk=xray.pk).update(uploaded_at=moment)
+            DiagnosisResult.objects.filter(pk=diagnosis.pk).update(created_at=moment)
+        SystemStatistics.objects.all().delete()
+
+        start = today - timedelta(days=7)
+        self.assertEqual(backfill_range(start, today, workers=1, chunk_days=3), 8)
+        backfilled = self.snapshot()
+
+        for offset in range(8):
+            update_system_statistics(start + timedelta(days=offset))
+        self.assertEqual(backfilled, self.snapshot())
+
+
+class DistinctSketchTests(TestCase):
+    """Sketches HyperLogLog: precisión, unión y coincidencia con la reconstrucción exacta"""
+
+    def test_estimate_and_merge(self):
+        first, second = HyperLogLog(), HyperLogLog()
+        for value in range(20000):
+            first.add(value)
+        for value in range(10000, 30000):
+            second.add(value)
+        self.assertAlmostEqual(first.count(), 20000, delta=20000 * 0.05)
+        self.assertAlmostEqual(first.merge(second).count(), 30000, delta=30000 * 0.05)
+        self.assertEqual(HyperLogLog(first.to_bytes()).count(), first.count())
+
+    def test_incremental_matches_rebuild(self):
+        user = create_user('sketch')
+        today = timezone.localdate()
+        with self.captureOnCommitCallbacks(execute=True):
+            for index in range(3):
+                patient = Patient.objects.create(
+                    dni=f'180003406{index}', first_name='Sketch', last_name=f'S{index}',
+                    date_of_birth=date(1990, 1, 1), gender='F', created_by=user,
+                )
+                XRayImage.objects.create(patient=patient, image='xrays/test.png', uploaded_by=user)
+
+        def registers():
+            return sorted(
+                (sketch.metric, sketch.scope, sketch.date, bytes(sketch.registers))
+                for sketch in DistinctSketch.objects.all()
+            )
+
+        incremental = registers()
+        self.assertEqual(estimate_count('patients_seen', today, today), 3)
+        rebuild_sketches(today, today)
+        self.assertEqual(incremental, registers())
+        self.assertEqual(exact_count('patients_seen', today, today, f'user:{user.pk}'), 3)
+
+
+class StreamingExportTests(TestCase):
+    """La exportación respeta los filtros del listado y se emite en streaming"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_user('exportador', is_superuser=True, is_staff=True)
+        for index, gender in enumerate('FFM'):
+            Patient.objects.create(
+                dni=f'190003406{index}', first_name='Export', last_name=f'E{index}',
+                date_of_birth=date(1990, 1, 1), gender=gender, created_by=cls.admin,
+            )
+
+    def export(self, **params):
+        # Cliente completo: los permisos por grupo leen la petición actual desde el middleware
+        client = APIClient()
+        client.force_authenticate(user=self.admin)
+        response = client.get('/api/diagnosis/patients/export/', params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content)
+
+    def test_csv_honors_filters(self):
+        lines = self.export(gender='F').decode().splitlines()
+        self.assertEqual(lines[0].split(',')[:3], ['id', 'dni', 'first_name'])
+        self.assertEqual(len(lines), 3)
+
+    def test_gzip_ndjson(self):
+        rows = [json.loads(line) for line in gzip.decompress(self.export(export_format='ndjson', gzip='true')).splitlines()]
+        self.assertEqual(sorted(row['dni'] for row in rows), ['1900034060', '1900034061', '1900034062'])
+
+    def test_csv_neutralizes_formulas(self):
+        Patient.objects.create(
+            dni='1900034063', first_name='=HYPERLINK("http://x.test","abrir")', last_name='@SUM(A1)',
+            phone='-2+3', date_of_birth=date(1990, 1, 1), gender='M', created_by=self.admin,
+        )
+        rows = {row['dni']: row for row in csv.DictReader(io.StringIO(self.export().decode()))}
+        self.assertEqual(rows['1900034063']['first_name'], '\'=HYPERLINK("http://x.test","abrir")')
+        self.assertEqual(rows['1900034063']['last_name'], "'@SUM(A1)")
+        self.assertEqual(rows['1900034063']['phone'], "'-2+3")
+        self.assertEqual(rows['1900034060']['first_name'], 'Export')
+
+        ndjson = [json.loads(line) for line in self.export(export_format='ndjson').splitlines()]
+        self.assertIn('-2+3', {row['phone'] for row in ndjson})
+
+
+@override_settings(CACHES=SHARED_CACHE)
+class ConditionalGetTests(TestCase):
+    """ETag en listados y estadísticas: 304 mientras los datos no cambien"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_user('etag', is_superuser=True, is_staff=True)
+        cls.radiologist = create_user('etag_radiologo')
+        cls.patient = Patient.objects.create(
+            dni='1100034060', first_name='Etag', last_name='Cond',
+            date_of_birth=date(1990, 1, 1), gender='F', created_by=cls.admin,
+        )
+        cls.order = MedicalOrder.objects.create(patient=cls.patient, requested_by=cls.admin, reason='Control')
+        xray = XRayImage.objects.create(patient=cls.patient, image='xrays/test.png', uploaded_by=cls.admin)
+        cls.diagnosis = DiagnosisResult.objects.create(
+            xray=xray, predicted_class='NORMAL', class_id=1, confidence='0.900', radiologist_review=cls.radiologist,
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.admin)
+
+    def assert_revalidates(self, url, change):
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        etag = first['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # Las versiones de datos cambian al confirmar la escritura
+        with self.captureOnCommitCallbacks(execute=True):
+            change()
+        second = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(second['ETag'], etag)
+
+    def test_list(self):
+        def rename():
+            self.patient.first_name = 'Renombrado'
+            self.patient.save()
+        self.assert_revalidates('/api/diagnosis/patients/', rename)
+
+    def test_reviewer_name_changes_etag(self):
+        def rename_reviewer():
+            self.radiologist.first_name = 'Renombrada'
+            self.radiologist.save()
+        self.assert_revalidates('/api/diagnosis/results/', rename_reviewer)
+
+    def test_annotation_changes_etag(self):
+        def upload_for_order():
+            XRayImage.objects.create(
+                patient=self.patient, medical_order=self.order, image='xrays/test.png', uploaded_by=self.admin
+            )
+        self.assert_revalidates('/api/diagnosis/medical-orders/', upload_for_order)
+
+    def test_last_login_keeps_etag(self):
+        first = self.client.get('/api/diagnosis/results/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.radiologist.last_login = timezone.now()
+            self.radiologist.save()
+        self.assertEqual(self.client.get('/api/diagnosis/results/', HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+
+    def test_not_modified_skips_database(self):
+        etag = self.client.get('/api/diagnosis/results/')['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/diagnosis/results/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse([query['sql'] for query in queries if 'diagnosis_' in query['sql']])
+
+    @override_settings(CACHES=LOCAL_CACHE)
+    def test_process_local_cache_hashes_data(self):
+        def rename():
+            self.patient.first_name = 'Local'
+            self.patient.save()
+        self.assert_revalidates('/api/diagnosis/patients/', rename)
+
+    def test_statistics(self):
+        def register():
+            Patient.objects.create(
+                dni='1100034061', first_name='Otro', last_name='Cond',
+                date_of_birth=date(1980, 1, 1), gender='M', created_by=self.admin,
+            )
+        self.assert_revalidates('/api/diagnosis/statistics/patients/', register)
+
+
+@override_settings(CACHES=SHARED_CACHE)
+class StatsCacheTests(TestCase):
+    """Caché de estadísticas: stale-while-revalidate, coalescencia e invalidación por escrituras"""
+
+    URL = '/api/diagnosis/statistics/patients/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_user('cache_stats', is_superuser=True, is_staff=True)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.admin)
+
+    def register(self, dni, signals=True):
+        patient = Patient(
+            dni=dni, first_name='Cache', last_name='Stats',
+            date_of_birth=date(1990, 1, 1), gender='F', created_by=self.admin,
+        )
+        if not signals:
+            # Sin señales: el dato cambia pero ninguna generación se incrementa
+            return Patient.objects.bulk_create([patient])
+        with self.captureOnCommitCallbacks(execute=True):
+            patient.save()
+
+    def test_write_recomputes_before_responding(self):
+        first = self.client.get(self.URL)
+        self.assertEqual(first['X-Stats-Cache'], 'miss')
+        self.assertEqual(self.client.get(self.URL)['X-Stats-Cache'], 'hit')
+
+        self.register('1300000001')
+        second = self.client.get(self.URL, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second['X-Stats-Cache'], 'miss')
+        self.assertEqual(second.data['total_patients'], first.data['total_patients'] + 1)
+
+    @override_settings(STATS_CACHE_TTL=0)
+    def test_expired_entry_is_served_and_refreshed_once(self):
+        first = self.client.get(self.URL)
+        self.register('1300000002', signals=False)
+
+        with mock.patch.object(stats_cache.threading, 'Thread') as thread:
+            responses = [self.client.get(self.URL) for _ in range(3)]
+        self.assertEqual([response['X-Stats-Cache'] for response in responses], ['stale'] * 3)
+        self.assertEqual({response.data['total_patients'] for response in responses}, {first.data['total_patients']})
+        thread.assert_called_once()
+
+        # El recálculo arma su propia petición a partir del usuario y los parámetros
+        with mock.patch.object(stats_cache.connections, 'close_all'):
+            thread.call_args.kwargs['target']()
+        with mock.patch.object(stats_cache.threading, 'Thread'):
+            refreshed = self.client.get(self.URL)
+        self.assertEqual(refreshed['X-Stats-Cache'], 'stale')
+        self.assertEqual(refreshed.data['total_patients'], first.data['total_patients'] + 1)
+
+    @override_settings(STATS_CACHE_WAIT=0.1)
+    def test_concurrent_request_does_not_wait_for_invalidated_copy(self):
+        first = self.client.get(self.URL)
+        self.register('1300000003')
+
+        # Otra petición tiene el candado: la copia invalidada no sirve y se calcula sin guardar
+        with mock.patch.object(stats_cache._Entry, 'acquire', return_value=False):
+            response = self.client.get(self.URL)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Stats-Cache', response)
+        self.assertEqual(response.data['total_patients'], first.data['total_patients'] + 1)
+
+    @override_settings(CACHES=LOCAL_CACHE)
+    def test_process_local_cache_is_not_used(self):
+        self.assertNotIn('X-Stats-Cache', self.client.get(self.URL))
+        self.assertNotIn('X-Stats-Cache', self.client.get(self.URL))
+
+
+@override_settings(CACHES=LOCAL_CACHE)
+class ListQueryCountTests(TestCase):
+    """Los listados cuestan las mismas consultas con 1 o 100 filas por página"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_user('listados', is_superuser=True, is_staff=True)
+        cls.physician = create_user('medico_listados', 'Médicos')
+        patients = Patient.objects.bulk_create(
+            Patient(
+                dni=f'{1200000000 + index}', first_name='Paciente', last_name=f'L{index}',
+                date_of_birth=date(1980, 1, 1), gender='M', created_by=cls.physician,
+            )
+            for index in range(100)
+        )
+        orders = MedicalOrder.objects.bulk_create(
+            MedicalOrder(patient=patient, requested_by=cls.physician, reason='Control') for patient in patients
+        )
+        xrays = XRayImage.objects.bulk_create(
+            XRayImage(
+                patient=order.patient, medical_order=order, image='xrays/test.png', uploaded_by=cls.physician
+            )
+            for order in orders
+        )
+        diagnoses = DiagnosisResult.objects.bulk_create(
+            DiagnosisResult(
+                xray=xray, predicted_class='NORMAL', class_id=0, confidence='0.900', status='completed',
+                radiologist_review=cls.admin, reviewed_by=cls.physician, treating_physician_approval=cls.physician,
+            )
+            for xray in xrays
+        )
+        MedicalReport.objects.bulk_create(
+            MedicalReport(
+                diagnosis=diagnosis, title='Reporte', findings='-', impression='-', recommendations='-',
+                created_by=cls.physician, received_by=cls.admin,
+            )
+            for diagnosis in diagnoses
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.admin)
+
+    def count_queries(self, url, page_size):
+        with mock.patch.object(PageNumberPagination, 'page_size', page_size):
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), page_size)
+        return len(context.captured_queries)
+
+    def assert_constant_queries(self, url):
+        self.assertEqual(self.count_queries(url, 1), self.count_queries(url, 100), url)
+
+    def test_xrays(self):
+        self.assert_constant_queries('/api/diagnosis/xrays/')
+
+    def test_results(self):
+        self.assert_constant_queries('/api/diagnosis/results/')
+
+    def test_medical_reports(self):
+        self.assert_constant_queries('/api/diagnosis/medical-reports/')
+
+    def test_medical_orders(self):
+        self.assert_constant_queries('/api/diagnosis/medical-orders/')
+
+    def assert_sparse_fields_match(self, url):
+        with mock.patch.object(PageNumberPagination, 'page_size', 100):
+            full = self.client.get(url).data['results']
+        for name in full[0]:
+            sparse_url = f'{url}?fields={name}'
+            self.assert_constant_queries(sparse_url)
+            with mock.patch.object(PageNumberPagination, 'page_size', 100):
+                sparse = self.client.get(sparse_url).data['results']
+            self.assertEqual([row[name] for row in sparse], [row[name] for row in full], name)
+            self.assertLessEqual(set(sparse[0]), {'id', name})
+
+    def test_sparse_results(self):
+        self.assert_sparse_fields_match('/api/diagnosis/results/')
+
+    def test_sparse_medical_reports(self):
+        self.assert_sparse_fields_match('/api/diagnosis/medical-reports/')
+
+    def test_sparse_fields_narrow_query(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/diagnosis/results/?fields=status&expand=medical_order,unknown')
+        self.assertEqual(set(response.data['results'][0]), {'id', 'status', 'medical_order'})
+        select = next(query['sql'] for query in context.captured_queries if 'LIMIT' in query['sql'])
+        self.assertNotIn('diagnosis_patient', select)
+        self.assertNotIn('"raw_response"', select)
+
+    def test_annotated_values(self):
+        with mock.patch.object(PageNumberPagination, 'page_size', 1):
+            order = self.client.get('/api/diagnosis/medical-orders/').data['results'][0]
+            xray = self.client.get('/api/diagnosis/xrays/').data['results'][0]
+        self.assertTrue(order['has_xray'])
+        self.assertTrue(xray['has_diagnosis'])
+
+
+@override_settings(CACHES=LOCAL_CACHE)
+class KeysetPaginationTests(TestCase):
+    """Paginación por cursor: recorre todas las filas (incluso con empates) sin COUNT"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_user('cursor', is_superuser=True, is_staff=True)
+        patient = Patient.objects.create(
+            dni='1300000000', first_name='Cursor', last_name='Keyset',
+            date_of_birth=date(1990, 1, 1), gender='F', created_by=cls.admin,
+        )
+        XRayImage.objects.bulk_create(
+            XRayImage(patient=patient, image='xrays/test.png', uploaded_by=cls.admin) for _ in range(7)
+        )
+        # Empates en uploaded_at: el desempate lo decide el id
+        XRayImage.objects.update(uploaded_at=timezone.now())
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.admin)
+
+    def test_walks_all_rows_without_count(self):
+        expected = [str(pk) for pk in XRayImage.objects.order_by('-uploaded_at', '-id').values_list('pk', flat=True)]
+        seen = []
+        url = '/api/diagnosis/xrays/?pagination=cursor'
+        with mock.patch.object(PageOrKeysetPagination, 'page_size', 3):
+            while url:
+                with CaptureQueriesContext(connection) as context:
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertNotIn('count', response.data)
+                self.assertFalse(any('COUNT(*)' in query['sql'] for query in context.captured_queries))
+                seen += [row['id'] for row in response.data['results']]
+                url = response.data['next']
+        self.assertEqual(seen, expected)
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get('/api/diagnosis/xrays/?cursor=no-valido').status_code, 404)
+
+    def test_page_number_is_default(self):
+        self.assertEqual(self.client.get('/api/diagnosis/xrays/').data['count'], 7)
+
+
+class FullTextSearchTests(TestCase):
+    """Búsqueda indexada: prefijos, sin distinguir tildes, y el índice sigue a las ediciones"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_user('buscador', is_superuser=True, is_staff=True)
+        cls.jose = Patient.objects.create(
+            dni='1400000001', first_name='José', last_name='Pérez',
+            date_of_birth=date(1990, 1, 1), gender='M', created_by=cls.admin,
+        )
+        cls.other = Patient.objects.create(
+            dni='1400000002', first_name='Josefina', last_name='Núñez',
+            date_of_birth=date(1990, 1, 1), gender='F', created_by=cls.admin,
+        )
+        cls.order = MedicalOrder.objects.create(patient=cls.jose, requested_by=cls.admin, reason='Fiebre y tos')
+        xray = XRayImage.objects.create(
+            patient=cls.jose, medical_order=cls.order, image='xrays/test.png', uploaded_by=cls.admin
+        )
+        diagnosis = DiagnosisResult.objects.create(
+            xray=xray, predicted_class='PNEUMONIA_BACTERIAL', class_id=2, confidence='0.900',
+        )
+        MedicalReport.objects.create(
+            diagnosis=diagnosis, title='Control', findings='Consolidación en lóbulo inferior derecho',
+            impression='Neumonía', recommendations='-', created_by=cls.admin,
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.admin)
+
+    def search(self, resource, term):
+        response = self.client.get(f'/api/diagnosis/{resource}/', {'search': term})
+        self.assertEqual(response.status_code, 200)
+        return response.data['results']
+
+    def test_accent_insensitive_prefix(self):
+        self.assertEqual([row['id'] for row in self.search('patients', 'jose per')], [str(self.jose.pk)])
+        self.assertEqual(len(self.search('patients', 'JOS')), 2)
+        self.assertEqual(len(self.search('results', 'perez 14000')), 1)
+
+    def test_report_text(self):
+        self.assertEqual(len(self.search('medical-reports', 'consolidacion lobul')), 1)
+        self.assertEqual(self.search('medical-reports', 'derrame'), [])
+
+    def test_index_follows_edits(self):
+        self.jose.last_name = 'Ortega'
+        self.jose.save()
+        self.assertEqual(self.search('patients', 'perez'), [])
+        self.assertEqual(len(self.search('medical-orders', 'ortega')), 1)
+        self.order.delete()
+        self.assertEqual(self.search('medical-orders', 'ortega'), [])
+
+    def test_rebuild(self):
+        search.SearchEntry.objects.all().delete()
+        self.assertEqual(search.rebuild()['patient'], 2)
+        self.assertEqual(len(self.search('patients', 'nunez')), 1)
+
+    def test_migration_indexes_existing_rows(self):
+        from importlib import import_module
+        from django.db.migrations.loader import MigrationLoader
+        migration = import_module('apps.diagnosis.migrations.0015_search_entry')
+
+        search.SearchEntry.objects.all().delete()
+        migration.backfill_search_index(MigrationLoader(connection).project_state().apps, None)
+        self.assertEqual(len(self.search('patients', 'JOS')), 2)
+        self.assertEqual(len(self.search('results', 'perez 14000')), 1)
+        self.assertEqual(len(self.search('medical-reports', 'consolidacion')), 1)
+
+
+@override_settings(CACHES=LOCAL_CACHE)
+class PatientAutocompleteTests(TestCase):
+    """Autocompletado por prefijo de DNI o apellido, en memoria y sobre la base de datos"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_user('recepcion', is_superuser=True, is_staff=True)
+        cls.perez = Patient.objects.create(
+            dni='1500000001', first_name='Ana', last_name='Pérez Gómez',
+            date_of_birth=date(1990, 1, 1), gender='F', created_by=cls.admin,
+        )
+        Patient.objects.create(
+            dni='1500000002', first_name='Luis', last_name='Peña',
+            date_of_birth=date(1990, 1, 1), gender='M', created_by=cls.admin,
+        )
+
+    def setUp(self):
+        # La caché local hace de Redis: incr() atómico
+        self.enterContext(mock.patch.object(autocomplete, 'has_atomic_incr', return_value=True))
+        cache.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            autocomplete.rebuild()
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.admin)
+
+    def suggest(self, query, **params):
+        response = self.client.get('/api/diagnosis/patients/autocomplete/', {'q': query, **params})
+        self.assertEqual(response.status_code, 200)
+        return [row['dni'] for row in response.data]
+
+    def test_prefixes(self):
+        for in_memory in (True, False):
+            with self.subTest(in_memory=in_memory), self.settings(PATIENT_AUTOCOMPLETE_IN_MEMORY=in_memory):
+                self.assertEqual(self.suggest('PE'), ['1500000002', '1500000001'])
+                self.assertEqual(self.suggest('perez  go'), ['1500000001'])
+                self.assertEqual(self.suggest('gom'), ['1500000001'])
+                self.assertEqual(self.suggest('15000', limit=1), ['1500000001'])
+                self.assertEqual(self.suggest(''), [])
+
+    def test_memory_index_follows_writes(self):
+        self.assertEqual(self.suggest('pena'), ['1500000002'])
+        index = autocomplete.get_index()
+        self.perez.last_name = 'Zambrano'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.perez.save()
+        self.assertIs(autocomplete.get_index(), index)
+        self.assertEqual(self.suggest('zam'), ['1500000001'])
+        self.assertEqual(self.suggest('perez'), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.perez.soft_delete()
+        self.assertEqual(self.suggest('zam'), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            Patient.objects.filter(dni='1500000002').delete()
+        self.assertEqual(self.suggest('pe'), [])
+
+    def test_generation_changes_at_commit(self):
+        generation = autocomplete._generation()
+        self.perez.last_name = 'Zambrano'
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.perez.save()
+        # Otro proceso que recargue antes del commit no debe quedar con la generación nueva
+        self.assertEqual(autocomplete._generation(), generation)
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(autocomplete._generation(), generation)
+        self.assertEqual(self.suggest('zam'), ['1500000001'])
+
+    def test_interleaved_writer_reloads_index(self):
+        index = autocomplete.get_index()
+        # Otro worker publica su cambio: la generación siguiente ya no es la del índice cargado
+        cache.incr(autocomplete.GENERATION_KEY)
+        self.perez.last_name = 'Zambrano'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.perez.save()
+        self.assertIsNot(autocomplete.get_index(), index)
+        self.assertEqual(self.suggest('zam'), ['1500000001'])
+
+    def test_cache_without_atomic_incr_uses_database(self):
+        from apps.core.cache import has_atomic_incr
+        # Caché por proceso: la generación no llega a los demás workers; tabla de
+        # caché: dos escrituras concurrentes pueden publicar la misma generación
+        for caches in (LOCAL_CACHE, SHARED_CACHE):
+            with self.subTest(backend=caches['default']['BACKEND']), self.settings(CACHES=caches), \
+                    mock.patch.object(autocomplete, 'has_atomic_incr', has_atomic_incr):
+                self.assertFalse(autocomplete.uses_memory_index())
+                self.perez.last_name = 'Zambrano'
+                self.perez.save()
+                self.assertEqual(self.suggest('zam'), ['1500000001'])
+                self.assertEqual(self.suggest('perez'), [])
+
+    def test_migration_backfills_existing_rows(self):
+        from importlib import import_module
+        from django.db.migrations.loader import MigrationLoader
+        PatientLookupKey.objects.all().delete()
+        migration = import_module('apps.diagnosis.migrations.0016_patient_lookup_key')
+        migration.backfill_lookup_keys(MigrationLoader(connection).project_state().apps, None)
+        with self.settings(PATIENT_AUTOCOMPLETE_IN_MEMORY=False):
+            self.assertEqual(self.suggest('pe'), ['1500000002', '1500000001'])
+
+
+def valid_dni(prefix):
+    """Completa 9 dígitos con su dígito verificador"""
+    total = sum(value - 9 if value >= 10 else value for value in (int(d) * c for d, c in zip(prefix, [2, 1] * 5)))
+    return f'{prefix}{(10 - total % 10) % 10}'
+
+
+class BulkPatientImportTests(TestCase):
+    """Importación por lotes: mismas reglas que el alta individual y reporte por fila"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_user('importador', is_superuser=True, is_staff=True)
+        Patient.objects.create(
+            dni=valid_dni('170000000'), first_name='Ya', last_name='Existe',
+            date_of_birth=date(1980, 1, 1), gender='F', created_by=cls.admin,
+        )
+
+    def test_batch_dni_validation_matches_validator(self):
+        from django.core.exceptions import ValidationError
+        from .models import validate_ecuadorian_dni
+        samples = [valid_dni(f'{p:02d}{t}{n:06d}') for p in (0, 1, 24, 25) for t in (3, 6, 7) for n in (0, 4821)]
+        samples += [sample[:9] + str((int(sample[9]) + 1) % 10) for sample in samples]
+        samples += ['123', '17000000AB', '17-000 0000']
+        errors = bulk_import.dni_errors(samples)
+        for position, dni in enumerate(samples):
+            try:
+                validate_ecuadorian_dni(dni)
+                expected = None
+            except ValidationError as exc:
+                expected = exc.messages[0]
+            self.assertEqual(errors.get(position), expected, dni)
+
+    def test_import_reports_row_errors(self):
+        rows = [
+            'dni,first_name,last_name,date_of_birth,gender,email',
+            f'{valid_dni("170000001")},josé,pérez,1990-05-01,M,',
+            f'{valid_dni("170000002")[:9]}0,Ana,Mora,1990-05-01,F,',
+            f'{valid_dni("170000000")},Otra,Vez,1990-05-01,F,',
+            f'{valid_dni("090000003")},Luis,Peña,1985-01-01,M,luis@correo',
+            f'{valid_dni("090000004")},Eva,Ruiz,1985-01-01,F,eva@correo.ec',
+            f'{valid_dni("090000004")},Eva,Duplicada,1985-01-01,F,',
+        ]
+        upload = SimpleUploadedFile('pacientes.csv', '\n'.join(rows).encode())
+        client = APIClient()
+        client.force_authenticate(user=self.admin)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.post('/api/diagnosis/patients/import/', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        report = response.data
+        self.assertEqual((report['total'], report['created']), (6, 2))
+        self.assertEqual([error['row'] for error in report['errors']], [3, 4, 5, 7])
+
+        self.assertEqual(Patient.objects.get(dni=valid_dni('170000001')).last_name, 'Pérez')
+        self.assertEqual(len(client.get('/api/diagnosis/patients/', {'search': 'jose perez'}).data['results']), 1)
+        self.assertEqual(client.get('/api/diagnosis/patients/autocomplete/', {'q': 'ruiz'}).data[0]['full_name'], 'Eva Ruiz')
+        self.assertEqual(
+            list(AuditUser.objects.filter(tabla='Patient', accion='A').values_list('registroid', flat=True)),
+            [uuid.UUID(report['import_id'])],
+        )
+        self.assertEqual(SystemStatistics.objects.get(date=timezone.localdate()).total_patients, 3)
+
+    def test_dry_run_inserts_nothing(self):
+        lines = [json.dumps({'dni': valid_dni('170000005'), 'first_name': 'A', 'last_name': 'B',
+                             'date_of_birth': '1990-01-01', 'gender': 'F'}), '{no es json']
+        upload = SimpleUploadedFile('pacientes.ndjson', '\n'.join(lines).encode())
+        client = APIClient()
+        client.force_authenticate(user=self.admin)
+        report = client.post('/api/diagnosis/patients/import/', {'file': upload, 'dry_run': 'true'}, format='multipart').data
+        self.assertEqual((report['valid'], report['created'], report['errors'][0]['row']), (1, 0, 2))
+        self.assertFalse(Patient.objects.filter(dni=valid_dni('170000005')).exists())
+
+
+class BulkTransitionTests(TestCase):
+    """Transiciones en bloque: un UPDATE para los que cumplen la precondición y reporte del resto"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_user('firmante', is_superuser=True, is_staff=True)
+        patient = Patient.objects.create(
+            dni='1600000000', first_name='Bloque', last_name='Transicion',
+            date_of_birth=date(1990, 1, 1), gender='F', created_by=cls.admin,
+        )
+        cls.orders, cls.diagnoses = [], []
+        for index in range(4):
+            order = MedicalOrder.objects.create(patient=patient, requested_by=cls.admin, reason='Control')
+            xray = XRayImage.objects.create(
+                patient=patient, medical_order=order, image='xrays/test.png', uploaded_by=cls.admin
+            )
+            cls.orders.append(order)
+            cls.diagnoses.append(DiagnosisResult.objects.create(
+                xray=xray, predicted_class='NORMAL', class_id=1, confidence='0.900',
+                status='error' if index == 3 else 'completed',
+            ))
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.admin)
+
+    def post(self, url, payload):
+        response = self.client.post(url, payload, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data
+
+    def test_radiologist_review_skips_failed_preconditions(self):
+        ids = [str(diagnosis.pk) for diagnosis in self.diagnoses] + ['no-es-un-id']
+        with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as context:
+            result = self.post('/api/diagnosis/results/bulk-radiologist-review/', {'ids': ids, 'severity': 'mild'})
+        self.assertEqual(result['transitioned'], ids[:3])
+        self.assertEqual(
+            [(item['id'], item['reason']) for item in result['skipped']],
+            [(ids[3], 'precondition_failed'), (ids[4], 'not_found')],
+        )
+        updates = [query['sql'] for query in context.captured_queries if query['sql'].startswith('UPDATE "diagnosis_diagnosisresult"')]
+        self.assertEqual(len(updates), 1)
+
+        reviewed = DiagnosisResult.objects.filter(radiologist_review=self.admin)
+        self.assertEqual(reviewed.count(), 3)
+        self.assertTrue(all(row.updated_at >= row.radiologist_reviewed_at for row in reviewed))
+        self.assertEqual(self.admin.performance_metrics.total_diagnoses_lifetime, 3)
+        self.assertEqual(AuditUser.objects.filter(tabla='DiagnosisResult', accion='M').count(), 3)
+
+        again = self.post('/api/diagnosis/results/bulk-radiologist-review/', {'ids': ids[:1], 'severity': 'mild'})
+        self.assertEqual(again['transitioned'], [])
+
+    def test_mark_reviewed_and_order_status(self):
+        DiagnosisResult.objects.filter(pk=self.diagnoses[0].pk).update(is_reviewed=True)
+        ids = [str(diagnosis.pk) for diagnosis in self.diagnoses[:2]]
+        result = self.post('/api/diagnosis/results/bulk-mark-reviewed/', {'ids': ids})
+        self.assertEqual(result['transitioned'], ids[1:])
+
+        MedicalOrder.objects.filter(pk=self.orders[0].pk).update(status='cancelled')
+        order_ids = [str(order.pk) for order in self.orders]
+        result = self.post('/api/diagnosis/medical-orders/bulk-update-status/', {'ids': order_ids, 'status': 'completed'})
+        self.assertEqual(result['transitioned'], order_ids[1:])
+        self.assertEqual(MedicalOrder.objects.filter(status='completed', completed_date__isnull=False).count(), 3)
+
+    def test_invalid_payload(self):
+        response = self.client.post('/api/diagnosis/medical-orders/bulk-update-status/', {'ids': [], 'status': 'completed'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class FastRendererTests(TestCase):
+    """FastJSONRenderer produce el mismo documento que JSONRenderer"""
+
+    def test_same_document_as_json_renderer(self):
+        from decimal import Decimal
+        from django.utils.translation import gettext_lazy
+        from rest_framework.renderers import JSONRenderer
+        from apps.core.renderers import FastJSONRenderer, FastJSONParser
+
+        moment = timezone.now().replace(microsecond=0)
+        data = {
+            'id': uuid.uuid4(), 'confidence': Decimal('0.912'), 'created_at': moment, 'date': date(2024, 5, 1),
+            'label': gettext_lazy('Paciente'), 'nested': [{'n': 1, 'ok': True, 'none': None}],
+        }
+        fast = FastJSONRenderer().render(data, 'application/json', {})
+        self.assertEqual(json.loads(fast), json.loads(JSONRenderer().render(data, 'application/json', {})))
+        self.assertEqual(FastJSONParser().parse(io.BytesIO(fast)), json.loads(fast))
+
+    def test_diagnosis_list_uses_fast_renderer(self):
+        admin = create_user('renderer', is_superuser=True, is_staff=True)
+        client = APIClient()
+        client.force_authenticate(user=admin)
+        response = client.get('/api/diagnosis/results/', HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(type(response.accepted_renderer).__name__, 'FastJSONRenderer')
+
+
+class PatientTimelineTests(TestCase):
+    """Línea de tiempo del paciente: orden cronológico, consultas constantes y cursor"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_user('historia', is_superuser=True, is_staff=True)
+        cls.patient = Patient.objects.create(
+            dni='1700000000', first_name='Linea', last_name='Tiempo',
+            date_of_birth=date(1980, 1, 1), gender='M', created_by=cls.admin,
+        )
+        cls.start = timezone.now() - timedelta(days=30)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.admin)
+
+    def add_visits(self, count):
+        """Cada visita: orden, radiografía, diagnóstico y reporte, una hora después de la anterior"""
+        offset = MedicalOrder.objects.filter(patient=self.patient).count()
+        for index in range(offset, offset + count):
+            moment = self.start + timedelta(days=index)
+            order = MedicalOrder.objects.create(patient=self.patient, requested_by=self.admin, reason='Control')
+            xray = XRayImage.objects.create(
+                patient=self.patient, medical_order=order, image='xrays/test.png', uploaded_by=self.admin
+            )
+            diagnosis = DiagnosisResult.objects.create(
+                xray=xray, predicted_class='NORMAL', class_id=1, confidence='0.900', status='completed'
+            )
+            report = MedicalReport.objects.create(
+                diagnosis=diagnosis, title='Control', findings='-', impression='-',
+                recommendations='-', created_by=self.admin,
+            )
+            MedicalOrder.objects.filter(pk=order.pk).update(created_at=moment)
+            XRayImage.objects.filter(pk=xray.pk).update(uploaded_at=moment + timedelta(hours=1))
+            DiagnosisResult.objects.filter(pk=diagnosis.pk).update(created_at=moment + timedelta(hours=2))
+            MedicalReport.objects.filter(pk=report.pk).update(created_at=moment + timedelta(hours=3))
+
+    def get(self, params=None):
+        response = self.client.get(f'/api/diagnosis/patients/{self.patient.pk}/timeline/', params or {})
+        self.assertEqual(response.status_code, 200, getattr(response, 'data', None))
+        return response.json()
+
+    def test_chronological_order_and_constant_queries(self):
+        self.add_visits(1)
+        with CaptureQueriesContext(connection) as short:
+            self.get()
+        self.add_visits(5)
+        with CaptureQueriesContext(connection) as long:
+            data = self.get()
+
+        self.assertEqual(len(short.captured_queries), len(long.captured_queries))
+        self.assertEqual(data['patient']['dni'], self.patient.dni)
+        self.assertEqual(len(data['events']), 24)
+        self.assertEqual([event['type'] for event in data['events'][:4]], ['order', 'xray', 'diagnosis', 'report'])
+        timestamps = [event['timestamp'] for event in data['events']]
+        self.assertEqual(timestamps, sorted(timestamps))
+        self.assertTrue(data['events'][1]['image'].startswith('http://testserver/'))
+
+    def test_cursor_walks_all_events(self):
+        self.add_visits(3)
+        full = [event['id'] for event in self.get()['events']]
+        seen, data = [], self.get({'pagination': 'cursor', 'page_size': 5})
+        while True:
+            seen.extend(event['id'] for event in data['events'])
+            if not data['next']:
+                break
+            data = self.client.get(data['next']).json()
+        self.assertEqual(seen, full)
+
+        response = self.client.get(f'/api/diagnosis/patients/{self.patient.pk}/timeline/', {'cursor': 'x'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_events_follow_group_permissions(self):
+        from django.contrib.auth.models import Permission
+        from apps.security.models import Menu, Module, GroupModulePermission
+        self.add_visits(2)
+        receptionist = create_user('ventanilla', 'Recepcionistas')
+        module = Module.objects.create(url='/patients', name='Pacientes', menu=Menu.objects.create(name='Clínica', icon='x'))
+        grant = GroupModulePermission.objects.create(group=receptionist.groups.get(), module=module)
+        grant.permissions.set(Permission.objects.filter(codename__in=['view_patient', 'view_medicalorder']))
+
+        self.client.force_authenticate(user=receptionist)
+        events = self.get()['events']
+        self.assertEqual({event['type'] for event in events}, {'order'})
+        self.assertEqual(len(events), 2)
+        response = self.client.get('/api/diagnosis/results/')
+        self.assertEqual(response.status_code, 403)
+
+
+class SimilarityIndexTests(TestCase):
+    """Índices de casos similares: exactitud de IVF-PQ y casos revisados después de precalcularlo"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_user('similitud', is_superuser=True, is_staff=True)
+        cls.patient = Patient.objects.create(
+            dni='1800000000', first_name='Casos', last_name='Similares',
+            date_of_birth=date(1975, 1, 1), gender='F', created_by=cls.admin,
+        )
+
+    def reviewed_case(self, vector):
+        xray = XRayImage.objects.create(
+            patient=self.patient, image='xrays/test.png', uploaded_by=self.admin,
+            embedding=embeddings.encode_embedding(vector),
+        )
+        return DiagnosisResult.objects.create(
+            xray=xray, predicted_class='NORMAL', class_id=1, confidence='0.900',
+            status='completed', radiologist_review=self.admin,
+        )
+
+    def test_chunked_nearest_matches_full_distances(self):
+        rng = np.random.default_rng(1)
+        data, centroids = rng.normal(size=(300, 16)), rng.normal(size=(40, 16))
+        expected = embeddings._squared_distances(data, centroids).argmin(axis=1)
+        np.testing.assert_array_equal(embeddings._nearest(data, centroids, chunk_size=7), expected)
+        with mock.patch.object(embeddings, 'DISTANCE_BLOCK_CELLS', 100):
+            np.testing.assert_array_equal(embeddings._nearest(data, centroids), expected)
+
+    def test_ivf_pq_shortlist_contains_query(self):
+        rng = np.random.default_rng(2)
+        vectors = rng.normal(size=(1500, embeddings.EMBEDDING_DIM))
+        ids = [str(position) for position in range(len(vectors))]
+        index = embeddings.IVFPQIndex(8, n_probe=8).train(vectors, iterations=5).add(ids, vectors)
+        found = sum(
+            str(position) in {case_id for case_id, _ in index.search(vectors[position], k=20)}
+            for position in range(0, 1500, 50)
+        )
+        self.assertGreaterEqual(found, 28)
+
+    def test_cases_reviewed_after_build_are_searchable(self):
+        rng = np.random.default_rng(3)
+        vectors = rng.normal(size=(6, embeddings.EMBEDDING_DIM))
+        indexed = [self.reviewed_case(vector) for vector in vectors[:5]]
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(SIMILARITY_INDEX_PATH=os.path.join(directory, 'index.npz')):
+            ids, stored = embeddings.load_reviewed_vectors()
+            embeddings.IVFPQIndex(2, n_probe=2).train(stored, iterations=3).add(ids, stored).save(
+                embeddings.index_path()
+            )
+            embeddings.invalidate_similarity_index()
+            self.assertEqual(len(embeddings.get_similarity_index()), 5)
+
+            late = self.reviewed_case(vectors[5])
+            results = embeddings.find_similar_cases(vectors[5], k=3)
+            self.assertEqual(results[0][0], str(late.pk))
+            self.assertAlmostEqual(results[0][1], 1.0, places=2)
+            self.assertIn(str(indexed[0].pk), dict(embeddings.find_similar_cases(vectors[0], k=3)))
+        embeddings.invalidate_similarity_index()
+
+    def test_index_reloads_only_when_review_changes(self):
+        rng = np.random.default_rng(4)
+        case = self.reviewed_case(rng.normal(size=embeddings.EMBEDDING_DIM))
+        with mock.patch('apps.diagnosis.signals.invalidate_similarity_index') as invalidate:
+            case.radiologist_notes = 'Sin cambios en la revisión'
+            case.severity = 'moderate'
+            case.save()
+            invalidate.assert_not_called()
+            case.radiologist_review = None
+            case.save()
+            self.assertEqual(invalidate.call_count, 1)
+            case.radiologist_review = self.admin
+            case.save()
+            case.delete()
+            self.assertEqual(invalidate.call_count, 3)
+
+    def test_similar_without_embedding_is_a_conflict(self):
+        xray = XRayImage.objects.create(patient=self.patient, image='xrays/test.png', uploaded_by=self.admin)
+        diagnosis = DiagnosisResult.objects.create(
+            xray=xray, predicted_class='NORMAL', class_id=1, confidence='0.900', status='completed',
+        )
+        client = APIClient()
+        client.force_authenticate(user=self.admin)
+        with mock.patch.object(embeddings, 'compute_embedding') as compute:
+            response = client.get(f'/api/diagnosis/results/{diagnosis.pk}/similar/')
+        self.assertEqual(response.status_code, 409)
+        compute.assert_not_called()
+        xray.refresh_from_db()
+        self.assertIsNone(xray.embedding)
+
+
+class IncrementalSystemStatisticsTests(TestCase):
+    """Los contadores incrementales del día coinciden con el recálculo completo"""
+
+    COUNTERS = (
+        *system_stats.DAILY_TOTALS, *system_stats.CUMULATIVE_FIELDS, 'daily_completed_diagnoses',
+    )
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('contador')
+
+    def create_diagnosis(self, dni, predicted_class, **extra):
+        with self.captureOnCommitCallbacks(execute=True):
+            patient = Patient.objects.create(
+                dni=dni, first_name='Conteo', last_name='Diario',
+                date_of_birth=date(1990, 1, 1), gender='F', created_by=self.user,
+            )
+            xray = XRayImage.objects.create(patient=patient, image='xrays/test.png', uploaded_by=self.user)
+            return DiagnosisResult.objects.create(
+                xray=xray, predicted_class=predicted_class, class_id=1, confidence='0.900', **extra
+            )
+
+    def counters(self, day):
+        return SystemStatistics.objects.filter(date=day).values(*self.COUNTERS).get()
+
+    def test_incremental_counters_match_recompute(self):
+        today = timezone.localdate()
+        old = self.create_diagnosis('1700000001', 'NORMAL', status='completed', processing_time=2.0)
+        yesterday = timezone.now() - timedelta(days=1)
+        Patient.objects.filter(pk=old.xray.patient_id).update(created_at=yesterday)
+        XRayImage.objects.filter(pk=old.xray_id).update(uploaded_at=yesterday)
+        DiagnosisResult.objects.filter(pk=old.pk).update(created_at=yesterday)
+        SystemStatistics.objects.all().delete()
+        update_system_statistics(today - timedelta(days=1))
+
+        diagnosis = self.create_diagnosis('1700000002', 'PNEUMONIA_VIRAL')
+        diagnosis.status, diagnosis.processing_time = 'completed', 3.5
+        removed = self.create_diagnosis('1700000003', 'NORMAL')
+        # Los contadores se aplican al confirmar la transacción
+        with self.captureOnCommitCallbacks(execute=True):
+            diagnosis.save()
+            removed.delete()
+
+        incremental = self.counters(today)
+        self.assertEqual(incremental['pneumonia_diagnoses'], 1)
+        self.assertEqual(incremental['processing_time_samples'], 2)
+        update_system_statistics(today)
+        self.assertEqual(incremental, self.counters(today))
+
+    def test_past_day_without_row_is_computed_not_saved(self):
+        self.create_diagnosis('1700000001', 'NORMAL', status='completed', processing_time=2.0)
+        yesterday = timezone.localdate() - timedelta(days=1)
+        SystemStatistics.objects.filter(date=yesterday).delete()
+        stats = system_stats.read_day(yesterday)
+        self.assertFalse(SystemStatistics.objects.filter(date=yesterday).exists())
+        self.assertEqual(stats.total_diagnoses, 0)
+
+        tomorrow_view = system_stats.read_day(timezone.localdate() + timedelta(days=1))
+        self.assertEqual(tomorrow_view.total_diagnoses, 1)
+        self.assertEqual(tomorrow_view.normal_diagnoses, 1)
+        self.assertFalse(SystemStatistics.objects.filter(date__gt=timezone.localdate()).exists())
+
+    def test_migration_seeds_existing_rows(self):
+        from importlib import import_module
+        from django.apps import apps as django_apps
+        migration = import_module('apps.diagnosis.migrations.0008_incremental_system_statistics')
+
+        self.create_diagnosis('1700000001', 'NORMAL', status='completed', processing_time=2.0)
+        self.create_diagnosis('1700000002', 'PNEUMONIA_BACTERIA', status='completed', processing_time=4.0)
+        today = timezone.localdate()
+        update_system_statistics(today)
+        expected = self.counters(today)
+        SystemStatistics.objects.update(
+            normal_diagnoses=0, pneumonia_diagnoses=0, processing_time_total=0.0,
+            processing_time_samples=0, daily_completed_diagnoses=0,
+        )
+        migration.seed_counters(django_apps, None)
+        self.assertEqual(self.counters(today), expected)
+
+
+class IncrementalUserPerformanceTests(TestCase):
+    """Las métricas incrementales de rendimiento parten del historial del usuario"""
+
+    FIELDS = (*performance.COUNTER_FIELDS, *performance.DERIVED_FIELDS, 'class_counts')
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.radiologist = create_user('radiologo')
+        cls.patient = Patient.objects.create(
+            dni='1700000001', first_name='Historial', last_name='Radiologo',
+            date_of_birth=date(1990, 1, 1), gender='M', created_by=cls.radiologist,
+        )
+
+    def review(self, predicted_class='NORMAL', confidence='0.900'):
+        xray = XRayImage.objects.create(patient=self.patient, image='xrays/test.png', uploaded_by=self.radiologist)
+        return DiagnosisResult.objects.create(
+            xray=xray, predicted_class=predicted_class, class_id=1, confidence=confidence,
+            status='completed', processing_time=2.0, radiologist_review=self.radiologist,
+            radiologist_reviewed_at=timezone.now(),
+        )
+
+    def metrics(self):
+        return UserPerformanceMetrics.objects.filter(user=self.radiologist).values(*self.FIELDS).get()
+
+    def rebuilt(self):
+        performance.rebuild_user_performance_metrics([self.radiologist.pk])
+        return self.metrics()
+
+    def test_first_event_without_row_seeds_from_history(self):
+        self.review(confidence='0.800')
+        self.review('PNEUMONIA_VIRAL', confidence='0.600')
+        UserPerformanceMetrics.objects.all().delete()
+
+        self.review(confidence='0.700')
+        incremental = self.metrics()
+        self.assertEqual(incremental['total_diagnoses_lifetime'], 3)
+        self.assertEqual(incremental, self.rebuilt())
+
+    def test_migration_seeds_accumulators(self):
+        from importlib import import_module
+        from django.db.migrations.loader import MigrationLoader
+        migration = import_module('apps.diagnosis.migrations.0009_incremental_user_performance')
+
+        self.review(confidence='0.800')
+        self.review(confidence='0.600')
+        expected = self.rebuilt()
+        UserPerformanceMetrics.objects.update(
+            confidence_sum=0, completed_diagnoses_lifetime=0, processing_time_sum=0.0,
+            processing_time_samples=0, final_reports_lifetime=0, class_counts={},
+        )
+        migration.seed_accumulators(MigrationLoader(connection).project_state().apps, None)
+        self.assertEqual(self.metrics(), expected)
+
+    def test_view_rebuilds_row_without_activity(self):
+        self.review()
+        UserPerformanceMetrics.objects.filter(user=self.radiologist).update(
+            last_activity_date=None, total_diagnoses_lifetime=0
+        )
+        client = APIClient()
+        client.force_authenticate(user=self.radiologist)
+        response = client.get('/api/diagnosis/statistics/user-performance/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['total_diagnoses_lifetime'], 1)
+
+
+class DiagnosticRollupTests(TestCase):
+    """La consolidación incremental coincide con la completa tras eliminar o mover actividad"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.radiologist = create_user('consolidador')
+        cls.patient = Patient.objects.create(
+            dni='1700000001', first_name='Periodo', last_name='Consolidado',
+            date_of_birth=date(1990, 1, 1), gender='F', created_by=cls.radiologist,
+        )
+
+    def review(self, reviewed_at):
+        xray = XRayImage.objects.create(patient=self.patient, image='xrays/test.png', uploaded_by=self.radiologist)
+        return DiagnosisResult.objects.create(
+            xray=xray, predicted_class='NORMAL', class_id=1, confidence='0.900', status='completed',
+            radiologist_review=self.radiologist, radiologist_reviewed_at=reviewed_at,
+        )
+
+    def snapshot(self):
+        return sorted(DiagnosticStatistics.objects.values_list(
+            'user_id', 'period_type', 'period_start', 'period_end', *rollups.COUNT_FIELDS
+        ))
+
+    def assert_incremental_matches_full(self):
+        result = rollups.run_rollup()
+        self.assertIsNotNone(result['window'])
+        incremental = self.snapshot()
+        rollups.run_rollup(full=True)
+        self.assertEqual(incremental, self.snapshot())
+        self.assertFalse(RollupPendingDay.objects.exists())
+
+    def test_deleted_and_moved_activity_leaves_old_periods(self):
+        now = timezone.now()
+        deleted = self.review(now - timedelta(days=120))
+        moved = self.review(now - timedelta(days=60))
+        self.review(now)
+        rollups.run_rollup(full=True)
+        self.assertEqual(DiagnosticStatistics.objects.filter(period_type='month').count(), 3)
+
+        deleted.delete()
+        self.assert_incremental_matches_full()
+
+        moved.radiologist_reviewed_at = now - timedelta(hours=1)
+        moved.save()
+        self.assert_incremental_matches_full()
+        self.assertEqual(DiagnosticStatistics.objects.filter(period_type='month').count(), 1)
+
+
+class ParticipationScopeTests(TestCase):
+    """Los querysets por participación coinciden con los filtros por joins que reemplazan"""
+
+    LEGACY_FILTERS = {
+        DiagnosisResult: lambda ids: (
+            Q(radiologist_review__id__in=ids) | Q(reviewed_by__id__in=ids)
+            | Q(treating_physician_approval__id__in=ids) | Q(xray__uploaded_by__id__in=ids)
+        ),
+        Patient: lambda ids: (
+            Q(xrays__uploaded_by__id__in=ids) | Q(xrays__diagnosis__radiologist_review__id__in=ids)
+            | Q(xrays__diagnosis__reviewed_by__id__in=ids)
+            | Q(xrays__diagnosis__treating_physician_approval__id__in=ids)
+            | Q(medical_orders__requested_by__id__in=ids) | Q(created_by__id__in=ids)
+        ),
+        XRayImage: lambda ids: (
+            Q(uploaded_by__id__in=ids) | Q(diagnosis__radiologist_review__id__in=ids)
+            | Q(diagnosis__reviewed_by__id__in=ids) | Q(diagnosis__treating_physician_approval__id__in=ids)
+        ),
+        MedicalReport: lambda ids: Q(created_by__id__in=ids) | Q(received_by__id__in=ids),
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [create_user(f'participante{index}') for index in range(4)]
+        first, second, third, fourth = cls.users
+        cls.diagnoses, cls.xrays, cls.orders, cls.reports = [], [], [], []
+        roles = [
+            (first, second, None, third), (second, None, third, None),
+            (third, first, None, None), (None, None, None, first),
+        ]
+        for index, (creator, radiologist, reviewer, approver) in enumerate(roles):
+            patient = Patient.objects.create(
+                dni=f'170000000{index}', first_name='Alcance', last_name=f'P{index}',
+                date_of_birth=date(1990, 1, 1), gender='F', created_by=creator,
+            )
+            order = MedicalOrder.objects.create(patient=patient, requested_by=cls.users[(index + 1) % 4], reason='Control')
+            xray = XRayImage.objects.create(
+                patient=patient, medical_order=order, image='xrays/test.png', uploaded_by=cls.users[(index + 2) % 4]
+            )
+            diagnosis = DiagnosisResult.objects.create(
+                xray=xray, predicted_class='NORMAL', class_id=1, confidence='0.900', status='completed',
+                radiologist_review=radiologist, reviewed_by=reviewer, treating_physician_approval=approver,
+            )
+            report = MedicalReport.objects.create(
+                diagnosis=diagnosis, title='Alcance', findings='-', impression='-',
+                recommendations='-', created_by=creator or fourth,
+            )
+            cls.orders.append(order)
+            cls.xrays.append(xray)
+            cls.diagnoses.append(diagnosis)
+            cls.reports.append(report)
+
+    def assert_equivalent(self):
+        scopes = [{self.users[0].pk}, {self.users[1].pk, self.users[2].pk}, {self.users[3].pk}]
+        for user_ids in scopes:
+            for model, legacy in self.LEGACY_FILTERS.items():
+                with self.subTest(model=model.__name__, user_ids=user_ids):
+                    self.assertEqual(
+                        set(participation.participant_scoped(model, user_ids).values_list('pk', flat=True)),
+                        set(model.objects.filter(legacy(user_ids)).values_list('pk', flat=True)),
+                    )
+
+    def test_signals_keep_index_equivalent(self):
+        self.assert_equivalent()
+
+        diagnosis = self.diagnoses[0]
+        diagnosis.radiologist_review, diagnosis.treating_physician_approval = self.users[3], None
+        diagnosis.save()
+        xray = self.xrays[1]
+        xray.uploaded_by = self.users[0]
+        xray.save()
+        order = self.orders[2]
+        order.requested_by = self.users[3]
+        order.save()
+        report = self.reports[3]
+        report.received_by = self.users[2]
+        report.save()
+        self.diagnoses[2].delete()
+        self.assert_equivalent()
+
+    def test_migration_backfills_existing_rows(self):
+        from importlib import import_module
+        from django.db.migrations.loader import MigrationLoader
+        migration = import_module('apps.diagnosis.migrations.0011_participation')
+        fields = ('entity_type', 'entity_id', 'user_id', 'role', 'source_id')
+        expected = sorted(Participation.objects.values_list(*fields))
+
+        Participation.objects.all().delete()
+        migration.backfill_participation(MigrationLoader(connection).project_state().apps, None)
+        self.assertEqual(sorted(Participation.objects.values_list(*fields)), expected)
+        self.assert_equivalent()
+
+
+@override_settings(CACHES=LOCAL_CACHE)
+class DeferredWritesTests(TestCase):
+    """Contadores, sketches e invalidaciones se aplican en bloque al confirmar la transacción"""
+
+    DERIVED_TABLES = ('diagnosis_systemstatistics', 'diagnosis_metriccounter', 'diagnosis_distinctsketch')
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('diferido')
+        cls.radiologist = create_user('diferido_radiologo')
+
+    def create_patient(self, dni):
+        return Patient.objects.create(
+            dni=dni, first_name='Diferido', last_name='Lote',
+            date_of_birth=date(1990, 1, 1), gender='F', created_by=self.user,
+        )
+
+    def create_diagnosis(self, dni):
+        xray = XRayImage.objects.create(patient=self.create_patient(dni), image='xrays/test.png', uploaded_by=self.user)
+        return DiagnosisResult.objects.get(pk=DiagnosisResult.objects.create(
+            xray=xray, predicted_class='NORMAL', class_id=1, confidence='0.900', status='completed',
+        ).pk)
+
+    def review(self, diagnosis):
+        diagnosis.radiologist_review = self.radiologist
+        diagnosis.radiologist_reviewed_at = timezone.now()
+        diagnosis.save()
+
+    def derived_writes(self, queries):
+        return [
+            query['sql'] for query in queries
+            if query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))
+            and any(table in query['sql'] for table in self.DERIVED_TABLES)
+        ]
+
+    def test_save_defers_derived_writes_to_commit(self):
+        # Primera actividad del día (abre la fila del día y las del usuario)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.review(self.create_diagnosis('1400000001'))
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with CaptureQueriesContext(connection) as created:
+                self.create_patient('1400000002')
+            self.assertLessEqual(len(created), 8)
+            self.assertEqual(self.derived_writes(created.captured_queries), [])
+        self.assertEqual(len(callbacks), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            diagnosis = self.create_diagnosis('1400000003')
+        with self.captureOnCommitCallbacks(execute=True):
+            with CaptureQueriesContext(connection) as reviewed:
+                self.review(diagnosis)
+            self.assertLessEqual(len(reviewed), 8)
+            self.assertEqual(self.derived_writes(reviewed.captured_queries), [])
+
+        self.assertEqual(SystemStatistics.objects.get(date=timezone.localdate()).total_patients, 3)
+        self.assertEqual(estimate_count('patients_seen', timezone.localdate(), timezone.localdate(),
+                                        f'user:{self.radiologist.pk}'), 2)
+
+    def test_writes_in_one_transaction_are_combined(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_patient('1400000011')
+        with CaptureQueriesContext(connection) as queries:
+            with self.captureOnCommitCallbacks(execute=True):
+                for index in range(3):
+                    self.create_patient(f'140000002{index}')
+        counter_writes = [
+            sql for sql in self.derived_writes(queries.captured_queries) if 'diagnosis_metriccounter' in sql
+        ]
+        self.assertEqual(len(counter_writes), 1)
+        self.assertEqual(
+            MetricCounter.objects.filter(metric='patients_registered').aggregate(total=Sum('count'))['total'], 4
+        )
+
+    def test_rolled_back_savepoint_discards_its_writes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_patient('1400000041')
+            with self.assertRaises(ValueError), transaction.atomic():
+                self.create_patient('1400000042')
+                raise ValueError
+        self.assertEqual(Patient.objects.count(), 1)
+        self.assertEqual(SystemStatistics.objects.get(date=timezone.localdate()).total_patients, 1)
+        self.assertEqual(
+            MetricCounter.objects.filter(metric='patients_registered').aggregate(total=Sum('count'))['total'], 1
+        )
+
+    def test_unchanged_fields_skip_derived_receivers(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            diagnosis = self.create_diagnosis('1400000051')
+        with self.captureOnCommitCallbacks(execute=True):
+            with CaptureQueriesContext(connection) as saved:
+                diagnosis.radiologist_notes = 'Sin cambios en campos derivados'
+                diagnosis.save()
+        # Antes de confirmar, solo el UPDATE del diagnóstico
+        self.assertEqual(len(saved), 1)
@@ -0,0 +1,130 @@
+"""
+Línea de tiempo de un paciente (historia clínica en una sola respuesta)
+
+Órdenes, radiografías, diagnósticos y reportes del paciente como eventos
+{type, id, timestamp, ...campos} en orden cronológico. Cada tipo es una sola
+consulta con values() (sin instanciar modelos), así que la línea de tiempo
+cuesta cuatro consultas sin importar el largo de la historia.
+
+Con paginación por cursor (ver apps.core.pagination) cada tipo lee solo las
+`page_size + 1` filas siguientes a la posición del cursor (timestamp, tipo, id)
+y las cuatro secuencias se intercalan con heapq.merge.
+
+Cada tipo exige el permiso view_<modelo> de su endpoint (ver
+`permission_codename`): los tipos sin permiso no se consultan.
+"""
+import heapq
+import uuid
+
+from django.core.files.storage import default_storage
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from apps.core.pagination import keyset_condition, encode_cursor, decode_cursor
+from .models import MedicalOrder, XRayImage, DiagnosisResult, MedicalReport
+
+# (tipo, modelo, ruta al paciente, campo de fecha, {clave de salida: ruta ORM})
+SOURCES = (
+    ('order', MedicalOrder, 'patient', 'created_at', {
+        'status': 'status', 'priority': 'priority', 'order_type': 'order_type', 'reason': 'reason',
+        'requested_by': 'requested_by__username',
+    }),
+    ('xray', XRayImage, 'patient', 'uploaded_at', {
+        'medical_order_id': 'medical_order_id', 'image': 'image', 'view_position': 'view_position',
+        'quality': 'quality', 'is_analyzed': 'is_analyzed', 'uploaded_by': 'uploaded_by__username',
+    }),
+    ('diagnosis', DiagnosisResult, 'xray__patient', 'created_at', {
+        'xray_id': 'xray_id', 'predicted_class': 'predicted_class', 'confidence': 'confidence',
+        'status': 'status', 'severity': 'severity', 'is_reviewed': 'is_reviewed',
+        'radiologist_review': 'radiologist_review__username',
+        'treating_physician_approval': 'treating_physician_approval__username',
+    }),
+    ('report', MedicalReport, 'diagnosis__xray__patient', 'created_at', {
+        'diagnosis_id': 'diagnosis_id', 'title': 'title', 'status': 'status', 'impression': 'impression',
+        'created_by': 'created_by__username',
+    }),
+)
+
+EVENT_TYPES = [source[0] for source in SOURCES]
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def permission_codename(rank):
+    """Permiso que exige el endpoint del tipo `rank` (view_<modelo>)"""
+    return f'view_{SOURCES[rank][1]._meta.model_name}'
+
+
+def encode_position(position):
+    """Cursor opaco de la posición (timestamp, rango, id) del último evento"""
+    return encode_cursor(position)
+
+
+def decode_position(token):
+    """
+    Posición (timestamp, rango, id) de un cursor de la línea de tiempo.
+
+    Raises:
+        ValueError: si el cursor no es válido
+    """
+    timestamp, rank, event_id = decode_cursor(token, 3)
+    timestamp = parse_datetime(timestamp)
+    rank = int(rank)
+    if timestamp is None or not 0 <= rank < len(SOURCES):
+        raise ValueError(token)
+    return timestamp, rank, uuid.UUID(event_id)
+
+
+def _after(rank, timestamp_field, position):
+    """Filas de la fuente `rank` posteriores al cursor (timestamp, rango, id)"""
+    timestamp, cursor_rank, event_id = position
+    if rank > cursor_rank:
+        return Q(**{f'{timestamp_field}__gte': timestamp})
+    if rank < cursor_rank:
+        return Q(**{f'{timestamp_field}__gt': timestamp})
+    return keyset_condition((timestamp_field, 'id'), (timestamp, event_id))
+
+
+def _events(rank, patient_id, position=None, limit=None, request=None):
+    event_type, model, patient_path, timestamp_field, fields = SOURCES[rank]
+    queryset = model.objects.filter(**{patient_path: patient_id})
+    if position is not None:
+        queryset = queryset.filter(_after(rank, timestamp_field, position))
+    queryset = queryset.order_by(timestamp_field, 'id').values('id', timestamp_field, *fields.values())
+    if limit is not None:
+        queryset = queryset[:limit]
+
+    for row in queryset:
+        event = {'type': event_type, 'id': row['id'], 'timestamp': row[timestamp_field]}
+        event.update((name, row[path]) for name, path in fields.items())
+        if event_type == 'xray' and event['image']:
+            url = default_storage.url(event['image'])
+            event['image'] = request.build_absolute_uri(url) if request is not None else url
+        yield (event['timestamp'], rank, event['id']), event
+
+
+def patient_timeline(patient_id, position=None, limit=None, request=None, ranks=None):
+    """
+    Eventos del paciente en orden cronológico.
+
+    Args:
+        position: (timestamp, rango del tipo, id) del último evento visto, o None
+        limit: Máximo de eventos; se leen `limit + 1` por tipo para saber si hay más
+        ranks: Tipos a incluir (rangos en SOURCES); None para todos
+
+    Returns:
+        tuple: (eventos, posición del último evento si hay más, si no None)
+    """
+    per_source = limit + 1 if limit is not None else None
+    merged = heapq.merge(*(
+        list(_events(rank, patient_id, position, per_source, request))
+        for rank in (range(len(SOURCES)) if ranks is None else ranks)
+    ), key=lambda item: item[0])
+
+    events, last_key = [], None
+    for key, event in merged:
+        if limit is not None and len(events) == limit:
+            return events, last_key
+        events.append(event)
+        last_key = key
+    return events, None
@@ -0,0 +1,160 @@
+"""
+Series de tiempo pre-agregadas por hora
+
+Cada métrica se cuenta en MetricCounter por (hora UTC, métrica, dimensión). Los
+contadores se ajustan con signals al crear, modificar o eliminar registros de
+origen (en bloque al confirmar cada transacción), y las consultas de tendencia
+agregan las horas del rango pedido a día/semana/mes: leen tantas filas como
+horas con actividad, sin importar el tamaño de las tablas de origen.
+"""
+from collections import Counter
+from datetime import timezone as dt_timezone
+
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Trunc, TruncHour
+
+from apps.core import batching
+from .models import Patient, XRayImage, DiagnosisResult, MedicalReport, MetricCounter
+
+GRANULARITIES = ('hour', 'day', 'week', 'month')
+
+# métrica: (modelo, campo de fecha, campo de dimensión o None, condición {campo: valor})
+METRICS = {
+    'patients_registered': (Patient, 'created_at', 'gender', {}),
+    'xray_uploads': (XRayImage, 'uploaded_at', None, {}),
+    'diagnoses': (DiagnosisResult, 'created_at', 'predicted_class', {}),
+    'diagnosis_errors': (DiagnosisResult, 'created_at', None, {'status': 'error'}),
+    'reports': (MedicalReport, 'created_at', 'status', {}),
+}
+
+
+def source_fields(model, include_timestamp=True):
+    """Campos de `model` de los que dependen sus contadores"""
+    fields = set()
+    for metric_model, timestamp_field, dimension, condition in METRICS.values():
+        if metric_model is not model:
+            continue
+        if include_timestamp:
+            fields.add(timestamp_field)
+        if dimension:
+            fields.add(dimension)
+        fields.update(condition)
+    return tuple(sorted(fields))
+
+
+def hour_bucket(value):
+    return value.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def contributions(model, values):
+    """Counter {(métrica, hora, dimensión): 1} que aporta un registro de `model` con `values`"""
+    result = Counter()
+    for metric, (metric_model, timestamp_field, dimension, condition) in METRICS.items():
+        if metric_model is not model or values.get(timestamp_field) is None:
+            continue
+        if any(values.get(field) != expected for field, expected in condition.items()):
+            continue
+        label = (values.get(dimension) or '') if dimension else ''
+        result[(metric, hour_bucket(values[timestamp_field]), label)] += 1
+    return result
+
+
+def _increment(metric, bucket, dimension, amount):
+    lookup = {'metric': metric, 'bucket': bucket, 'dimension': dimension}
+    if MetricCounter.objects.filter(**lookup).update(count=F('count') + amount):
+        return
+    counter, created = MetricCounter.objects.get_or_create(**lookup, defaults={'count': amount})
+    if not created:
+        MetricCounter.objects.filter(pk=counter.pk).update(count=F('count') + amount)
+
+
+def apply_deltas(deltas):
+    """Acumula los incrementos; los de la transacción se aplican juntos al confirmarla"""
+    if any(deltas.values()):
+        batching.add(_apply_batch, deltas)
+
+
+def _apply_batch(items):
+    deltas = Counter()
+    for item in items:
+        deltas.update(item)
+    with transaction.atomic():
+        for (metric, bucket, dimension), amount in deltas.items():
+            if amount:
+                _increment(metric, bucket, dimension, amount)
+
+
+def record_change(instance, created, changes):
+    """Ajusta los contadores tras guardar `instance` (resta su aporte previo si cambió)"""
+    model = type(instance)
+    current = {field: getattr(instance, field) for field in source_fields(model)}
+    deltas = contributions(model, current)
+    if not created:
+        previous = {**current, **{field: old for field, (old, _) in changes.items() if field in current}}
+        if previous == current:
+            return
+        deltas.subtract(contributions(model, previous))
+    apply_deltas(deltas)
+
+
+def record_created(model, instances):
+    """Suma en bloque el aporte de registros recién creados (una actualización por contador)"""
+    deltas = Counter()
+    for instance in instances:
+        deltas.update(contributions(model, {field: getattr(instance, field) for field in source_fields(model)}))
+    apply_deltas(deltas)
+
+
+def record_delete(instance):
+    model = type(instance)
+    values = {field: getattr(instance, field) for field in source_fields(model)}
+    apply_deltas(Counter({key: -amount for key, amount in contributions(model, values).items()}))
+
+
+def series(metric, granularity, start, end, dimension=None, by_dimension=False):
+    """
+    Serie de `metric` entre `start` (inclusive) y `end` (exclusivo) agregada por `granularity`.
+
+    Args:
+        dimension: Restringe la serie a un valor de la dimensión
+        by_dimension: Devuelve un punto por (período, dimensión)
+
+    Returns:
+        list[dict]: [{'period': datetime, ['dimension': str,] 'count': int}, ...]
+    """
+    queryset = MetricCounter.objects.filter(metric=metric, bucket__gte=start, bucket__lt=end)
+    if dimension is not None:
+        queryset = queryset.filter(dimension=dimension)
+    group = ('period', 'dimension') if by_dimension else ('period',)
+    return list(
+        queryset.annotate(period=Trunc('bucket', granularity)).values(*group).annotate(
+            count=Sum('count')
+        ).order_by(*group)
+    )
+
+
+def rebuild(stdout=None):
+    """
+    Recalcula todos los contadores desde las tablas de origen (una consulta agrupada por métrica).
+
+    Returns:
+        int: Filas de contadores generadas
+    """
+    rows = []
+    for metric, (model, timestamp_field, dimension, condition) in METRICS.items():
+        grouped = model.objects.filter(**condition, **{f'{timestamp_field}__isnull': False}).annotate(
+            hour=TruncHour(timestamp_field, tzinfo=dt_timezone.utc)
+        ).values('hour', *([dimension] if dimension else [])).annotate(total=Count('pk')).order_by()
+        for row in grouped:
+            rows.append(MetricCounter(
+                metric=metric, bucket=row['hour'],
+                dimension=(row[dimension] or '') if dimension else '', count=row['total'],
+            ))
+        if stdout:
+            stdout.write(f'{metric}: {len(grouped)} horas con actividad')
+
+    with transaction.atomic():
+        MetricCounter.objects.all().delete()
+        MetricCounter.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
@@ -0,0 +1,50 @@
+"""
+Seguimiento de cambios de campos entre carga y guardado
+
+Permite que los receivers de post_save sepan qué transición ocurrió (por ejemplo
+status 'analyzing' -> 'completed') sin volver a consultar la base de datos.
+"""
+from django.db.models.signals import post_init, pre_save
+
+# Campos seguidos por modelo; varios módulos pueden registrar campos del mismo modelo
+_tracked_fields = {}
+
+
+def _snapshot(instance):
+    # Se lee __dict__ para no disparar consultas sobre campos diferidos (.only()/.defer())
+    return {name: instance.__dict__.get(name) for name in _tracked_fields[type(instance)]}
+
+
+def _remember(sender, instance, **kwargs):
+    instance._tracked_state = _snapshot(instance)
+
+
+def _diff(sender, instance, raw=False, **kwargs):
+    current = _snapshot(instance)
+    if instance._state.adding:
+        previous = dict.fromkeys(current)
+    else:
+        previous = getattr(instance, '_tracked_state', current)
+    instance._field_changes = {
+        name: (previous.get(name), value)
+        for name, value in current.items() if previous.get(name) != value
+    }
+    instance._tracked_state = current
+
+
+def track_fields(model, fields):
+    """
+    Registra campos de `model` cuyo cambio se quiere conocer en post_save.
+
+    En pre_save se calcula el diff contra el estado cargado y se deja en
+    `instance._field_changes`; después se toma una nueva instantánea para que
+    guardados sucesivos de la misma instancia no repitan la transición.
+    """
+    _tracked_fields.setdefault(model, set()).update(fields)
+    post_init.connect(_remember, sender=model, dispatch_uid=f'track_init_{model._meta.label}')
+    pre_save.connect(_diff, sender=model, dispatch_uid=f'track_save_{model._meta.label}')
+
+
+def get_changes(instance):
+    """Cambios del último guardado: {campo: (valor_anterior, valor_nuevo)}"""
+    return getattr(instance, '_field_changes', {})
@@ -0,0 +1,116 @@
+"""
+Transiciones de flujo de trabajo en bloque (órdenes y diagnósticos)
+
+Una transición recibe una lista de ids y la aplica a todos los que cumplen su
+precondición:
+    1. Una consulta carga los registros pedidos (dentro del queryset de la vista)
+       con la precondición anotada como `eligible`.
+    2. Un solo UPDATE ... WHERE id IN (...) AND <precondición> escribe solo las
+       columnas de la transición (y updated_at, que update() no actualiza).
+    3. Si otra petición cambió alguna fila entre ambas consultas, el UPDATE la
+       omite; en ese caso se consulta qué filas quedaron con los valores escritos.
+
+update() no emite post_save, así que se envía `records_transitioned` con las
+instancias ya actualizadas en memoria y sus cambios en `_field_changes` (el
+mismo formato de apps.diagnosis.tracking); los receivers de
+apps.diagnosis.signals aplican en bloque auditoría, métricas y participaciones.
+"""
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import BooleanField, Case, Value, When
+from django.dispatch import Signal
+from django.utils import timezone
+
+MAX_IDS = 500
+
+# Enviado con instances=[...] (con _field_changes) y user=User tras una transición en bloque
+records_transitioned = Signal()
+
+# Estados de orden médica desde los que se puede pasar a cada estado
+ORDER_STATUS_TRANSITIONS = {
+    'pending': ('in_progress',),
+    'in_progress': ('pending',),
+    'completed': ('pending', 'in_progress'),
+    'cancelled': ('pending', 'in_progress'),
+}
+
+NOT_FOUND = 'not_found'
+PRECONDITION_FAILED = 'precondition_failed'
+CONCURRENT_CHANGE = 'concurrent_change'
+
+
+def parse_ids(value):
+    """
+    Lista de ids del cuerpo de la petición, sin duplicados y en el orden recibido.
+
+    Raises:
+        ValidationError: si no es una lista no vacía de hasta MAX_IDS elementos
+    """
+    if not isinstance(value, list) or not value:
+        raise ValidationError('ids debe ser una lista no vacía')
+    if len(value) > MAX_IDS:
+        raise ValidationError(f'Se permiten como máximo {MAX_IDS} ids por petición')
+    return list(dict.fromkeys(str(item) for item in value))
+
+
+def _valid_pks(model, ids):
+    valid = {}
+    for raw in ids:
+        try:
+            valid[raw] = model._meta.pk.to_python(raw)
+        except ValidationError:
+            continue
+    return valid
+
+
+def apply_transition(queryset, ids, precondition, values, user):
+    """
+    Aplica `values` a los registros `ids` de `queryset` que cumplen `precondition` (Q).
+
+    Returns:
+        dict: {'transitioned': [ids], 'skipped': [{'id', 'reason'}]} en el orden recibido
+    """
+    model = queryset.model
+    pks = _valid_pks(model, ids)
+    values = {**values, 'updated_at': timezone.now()}
+
+    with transaction.atomic():
+        candidates = {
+            str(instance.pk): instance
+            for instance in queryset.filter(pk__in=list(pks.values())).annotate(
+                eligible=Case(When(precondition, then=Value(True)), default=Value(False), output_field=BooleanField())
+            )
+        }
+        eligible = [instance for instance in candidates.values() if instance.eligible]
+        eligible_pks = [instance.pk for instance in eligible]
+
+        updated = model.objects.filter(pk__in=eligible_pks).filter(precondition).update(**values) if eligible else 0
+        if updated != len(eligible):
+            written = set(model.objects.filter(pk__in=eligible_pks, **values).values_list('pk', flat=True))
+            eligible = [instance for instance in eligible if instance.pk in written]
+
+        for instance in eligible:
+            changes = {}
+            for field, value in values.items():
+                attname = model._meta.get_field(field).attname
+                new = value.pk if hasattr(value, 'pk') else value
+                old = getattr(instance, attname)
+                if old != new:
+                    changes[attname] = (old, new)
+                setattr(instance, field, value)
+            instance._field_changes = changes
+        if eligible:
+            records_transitioned.send(sender=model, instances=eligible, user=user)
+
+    transitioned = {str(instance.pk) for instance in eligible}
+    skipped = []
+    for raw in ids:
+        instance = candidates.get(str(pks[raw])) if raw in pks else None
+        if instance is None:
+            skipped.append({'id': raw, 'reason': NOT_FOUND})
+        elif str(instance.pk) not in transitioned:
+            skipped.append({'id': raw, 'reason': PRECONDITION_FAILED if not instance.eligible else CONCURRENT_CHANGE})
+    return {
+        'transitioned': [raw for raw in ids if raw in pks and str(pks[raw]) in transitioned],
+        'skipped': skipped,
+    }
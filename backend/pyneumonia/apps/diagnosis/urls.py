@@ -5,7 +5,8 @@ Compatible con Next.js frontend
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .viewsets import (
-    PatientViewSet, XRayImageViewSet, DiagnosisResultViewSet, MedicalReportViewSet, MedicalOrderViewSet
+    PatientViewSet, XRayImageViewSet, DiagnosisResultViewSet, MedicalReportViewSet, MedicalOrderViewSet,
+    DiagnosticStatisticsViewSet
 )
 from .views import (
     analyze_xray_view, 
@@ -14,8 +15,11 @@ from .views import (
     xray_statistics_view,
     user_performance_view,
     system_statistics_view,
+    timeseries_view,
+    distinct_counts_view,
     dashboard_overview_view
 )
+from .async_views import dashboard_overview_async_view
 
 app_name = 'diagnosis'
 
@@ -26,6 +30,7 @@ router.register(r'xrays', XRayImageViewSet, basename='xrayimage')
 router.register(r'results', DiagnosisResultViewSet, basename='diagnosisresult')
 router.register(r'medical-reports', MedicalReportViewSet, basename='medicalreport')
 router.register(r'medical-orders', MedicalOrderViewSet, basename='medicalorder')
+router.register(r'diagnostic-statistics', DiagnosticStatisticsViewSet, basename='diagnosticstatistics')
 
 urlpatterns = [
     # Vista para analizar radiografías con IA
@@ -37,7 +42,10 @@ urlpatterns = [
     path('statistics/xrays/', xray_statistics_view, name='xray-statistics'),
     path('statistics/user-performance/', user_performance_view, name='user-performance'),
     path('statistics/system/', system_statistics_view, name='system-statistics'),
+    path('statistics/timeseries/', timeseries_view, name='statistics-timeseries'),
+    path('statistics/distinct/', distinct_counts_view, name='statistics-distinct'),
     path('statistics/dashboard/', dashboard_overview_view, name='dashboard-overview'),
+    path('statistics/dashboard/async/', dashboard_overview_async_view, name='dashboard-overview-async'),
     
     # Incluir rutas del router
     path('', include(router.urls)),
@@ -2,33 +2,66 @@ from rest_framework import viewsets, status
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.exceptions import NotFound
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 from rest_framework.parsers import MultiPartParser, FormParser
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import SearchFilter, OrderingFilter
-from django.db.models import Q
+from django.db.models import Q, Count, Prefetch
+from django.core.exceptions import ValidationError
+from django.utils import timezone
+from django.contrib.auth.models import Group
 from django.contrib.auth import get_user_model
 from django.utils.translation import gettext_lazy as _
+import csv
 import requests
-from .models import Patient, XRayImage, DiagnosisResult, MedicalReport, MedicalOrder
+from .models import Patient, XRayImage, DiagnosisResult, MedicalReport, MedicalOrder, DiagnosticStatistics
 from .serializers import (
-    PatientSerializer, XRayImageSerializer, DiagnosisResultSerializer, MedicalReportSerializer, MedicalOrderSerializer
+    PatientSerializer, XRayImageSerializer, DiagnosisResultSerializer, MedicalReportSerializer, MedicalOrderSerializer,
+    DiagnosticStatisticsSerializer
 )
 from apps.security.mixins.api_mixins import ActionPermissionMixin
+from .scope import determine_stats_scope
+from .exports import StreamingExportMixin
+from .conditional import ConditionalGetMixin
+from .annotations import AnnotatedQuerysetMixin, exists
+from .search import FullTextSearchFilter
+from .autocomplete import suggest, DEFAULT_LIMIT as AUTOCOMPLETE_LIMIT
+from .bulk_import import IMPORT_FORMATS, guess_format, open_upload, parse_rows, import_patients
+from .transitions import ORDER_STATUS_TRANSITIONS, parse_ids, apply_transition
+from .timeline import (
+    patient_timeline, encode_position, decode_position, permission_codename, EVENT_TYPES,
+    DEFAULT_PAGE_SIZE as TIMELINE_PAGE_SIZE, MAX_PAGE_SIZE as TIMELINE_MAX_PAGE_SIZE,
+)
+
+# Modelos cuyas escrituras cambian los listados clínicos (relaciones anidadas,
+# anotaciones, nombres de usuarios y grupos mostrados)
+CLINICAL_ETAG_MODELS = (Patient, MedicalOrder, XRayImage, DiagnosisResult, MedicalReport, get_user_model(), Group)
 
 
-class PatientViewSet(ActionPermissionMixin, viewsets.ModelViewSet):
+class PatientViewSet(ActionPermissionMixin, ConditionalGetMixin, StreamingExportMixin, viewsets.ModelViewSet):
     queryset = Patient.objects.filter(is_active=True).order_by('-created_at')
     serializer_class = PatientSerializer
+    etag_models = CLINICAL_ETAG_MODELS
     permission_classes = [IsAuthenticated]
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    filter_backends = [DjangoFilterBackend, FullTextSearchFilter, OrderingFilter]
     filterset_fields = ['is_active', 'gender', 'blood_type']
     search_fields = ['first_name', 'last_name', 'dni', 'email']
     ordering_fields = ['created_at', 'last_name', 'first_name']
+    export_fields = (
+        'id', 'dni', 'first_name', 'last_name', 'date_of_birth', 'gender', 'phone', 'email',
+        'blood_type', 'is_active', 'created_by__username', 'created_at', 'updated_at',
+    )
+    export_filename = 'pacientes'
 
     permission_map = {
         'list': 'view_patient',
         'retrieve': 'view_patient',
+        'export': 'view_patient',
+        'autocomplete': 'view_patient',
+        'timeline': 'view_patient',
         'create': 'add_patient',
+        'bulk_import': 'add_patient',
         'update': 'change_patient',
         'partial_update': 'change_patient',
         'destroy': 'delete_patient',
@@ -48,10 +81,97 @@ class PatientViewSet(ActionPermissionMixin, viewsets.ModelViewSet):
             )
         serializer.save()
 
+    @action(detail=False, methods=['get'])
+    def autocomplete(self, request):
+        """Primeros pacientes activos cuyo DNI o apellido empieza con ?q= (sin paginar)"""
+        try:
+            limit = int(request.query_params.get('limit', AUTOCOMPLETE_LIMIT))
+        except ValueError:
+            return Response({'error': _('limit debe ser un número entero')}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(suggest(request.query_params.get('q', ''), limit))
+
+    def _timeline_ranks(self, request):
+        """Tipos de evento cuyo permiso view_<modelo> tiene el grupo activo (el mismo que exige su endpoint)"""
+        codenames = {permission_codename(rank): rank for rank in range(len(EVENT_TYPES))}
+        if request.user.is_superuser:
+            return list(codenames.values())
+        granted = set(request.user.get_group_session().groupmodulepermission_set.filter(
+            permissions__codename__in=codenames
+        ).values_list('permissions__codename', flat=True))
+        return [rank for codename, rank in codenames.items() if codename in granted]
+
+    @action(detail=True, methods=['get'])
+    def timeline(self, request, pk=None):
+        """
+        Historia del paciente (órdenes, radiografías, diagnósticos y reportes) en orden cronológico.
+
+        Solo incluye los tipos de evento que el grupo activo puede ver en su propio endpoint.
+
+        Query params:
+            - pagination=cursor o cursor=<token>: paginar por cursor ({next, events})
+            - page_size: eventos por página en modo cursor (1-200, por defecto 50)
+        """
+        patient = self.get_object()
+        paginate = request.query_params.get('pagination') == 'cursor' or 'cursor' in request.query_params
+        position = limit = None
+        if paginate:
+            try:
+                limit = max(1, min(int(request.query_params.get('page_size', TIMELINE_PAGE_SIZE)),
+                                   TIMELINE_MAX_PAGE_SIZE))
+            except ValueError:
+                return Response({'error': _('page_size debe ser un número entero')}, status=status.HTTP_400_BAD_REQUEST)
+            token = request.query_params.get('cursor')
+            if token:
+                try:
+                    position = decode_position(token)
+                except (ValueError, TypeError):
+                    raise NotFound('Cursor inválido')
+
+        events, next_position = patient_timeline(patient.pk, position, limit, request, self._timeline_ranks(request))
+        data = {
+            'patient': {'id': patient.pk, 'dni': patient.dni, 'full_name': patient.get_full_name()},
+            'events': events,
+        }
+        if paginate:
+            next_link = None
+            if next_position is not None:
+                url = remove_query_param(request.build_absolute_uri(), 'pagination')
+                next_link = replace_query_param(url, 'cursor', encode_position(next_position))
+            data = {'next': next_link, **data}
+        return Response(data)
+
+    @action(detail=False, methods=['post'], url_path='import', parser_classes=[MultiPartParser, FormParser])
+    def bulk_import(self, request):
+        """
+        Importación masiva desde un archivo CSV o NDJSON (campo `file`).
+
+        Parámetros: import_format (csv | ndjson; por defecto según la extensión),
+        dry_run=true para solo validar. Responde el reporte por fila.
+        """
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'error': _('Debe adjuntar un archivo en el campo file')}, status=status.HTTP_400_BAD_REQUEST)
+        import_format = request.data.get('import_format') or guess_format(upload.name)
+        if import_format not in IMPORT_FORMATS:
+            return Response(
+                {'error': f"Formato inválido. Opciones: {', '.join(IMPORT_FORMATS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        dry_run = str(request.data.get('dry_run', '')).lower() == 'true'
+        try:
+            report = import_patients(parse_rows(open_upload(upload), import_format), request.user, dry_run=dry_run)
+        except (UnicodeDecodeError, csv.Error):
+            return Response({'error': _('El archivo no es texto UTF-8 válido')}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(report)
 
-class XRayImageViewSet(ActionPermissionMixin, viewsets.ModelViewSet):
-    queryset = XRayImage.objects.select_related('patient', 'uploaded_by').order_by('-uploaded_at')
+
+class XRayImageViewSet(ActionPermissionMixin, ConditionalGetMixin, AnnotatedQuerysetMixin, viewsets.ModelViewSet):
+    queryset = XRayImage.objects.order_by('-uploaded_at')
     serializer_class = XRayImageSerializer
+    select_related_fields = ('patient', 'uploaded_by')
+    keyset_fields = ('-uploaded_at', '-id')
+    annotations = {'has_diagnosis': exists(DiagnosisResult, 'xray')}
+    etag_models = CLINICAL_ETAG_MODELS
     permission_classes = [IsAuthenticated]
     parser_classes = [MultiPartParser, FormParser]
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
@@ -100,7 +220,7 @@ class XRayImageViewSet(ActionPermissionMixin, viewsets.ModelViewSet):
     def patient_xrays(self, request, patient_id=None):
         """Obtener todas las radiografías de un paciente específico"""
         try:
-            xrays = self.queryset.filter(patient_id=patient_id)
+            xrays = self.get_queryset().filter(patient_id=patient_id)
             
             # Aplicar filtros adicionales
             is_analyzed = request.query_params.get('is_analyzed')
@@ -125,7 +245,7 @@ class XRayImageViewSet(ActionPermissionMixin, viewsets.ModelViewSet):
     def unassigned_patient_xrays(self, request, patient_id=None):
         """Obtener radiografías de un paciente que NO tienen orden médica asignada"""
         try:
-            xrays = self.queryset.filter(
+            xrays = self.get_queryset().filter(
                 patient_id=patient_id,
                 medical_order__isnull=True  # Solo las que no tienen orden médica
             )
@@ -207,21 +327,28 @@ class XRayImageViewSet(ActionPermissionMixin, viewsets.ModelViewSet):
 
         
 
-class DiagnosisResultViewSet(ActionPermissionMixin, viewsets.ModelViewSet):
+class DiagnosisResultViewSet(ActionPermissionMixin, ConditionalGetMixin, AnnotatedQuerysetMixin, StreamingExportMixin, viewsets.ModelViewSet):
 
-    queryset = DiagnosisResult.objects.select_related('xray__patient', 'radiologist_review', 'treating_physician_approval').order_by('-created_at')
+    queryset = DiagnosisResult.objects.order_by('-created_at')
     serializer_class = DiagnosisResultSerializer
+    select_related_fields = (
+        'xray__patient', 'xray__medical_order__requested_by',
+        'radiologist_review', 'treating_physician_approval', 'reviewed_by',
+    )
+    keyset_fields = ('-created_at', '-id')
+    etag_models = CLINICAL_ETAG_MODELS
     permission_classes = [IsAuthenticated]
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    filter_backends = [DjangoFilterBackend, FullTextSearchFilter, OrderingFilter]
     filterset_fields = ['predicted_class', 'status', 'severity', 'xray']
     search_fields = ['predicted_class', 'xray__patient__first_name', 'xray__patient__last_name', 'xray__patient__dni']
     ordering_fields = ['created_at', 'confidence']
-
-    def get_queryset(self):
-        queryset = super().get_queryset()
-        # Incluir diagnósticos relacionados con órdenes médicas
-        queryset = queryset.select_related('xray__medical_order')
-        return queryset
+    export_fields = (
+        'id', 'xray_id', 'xray__patient__dni', 'xray__medical_order_id', 'predicted_class', 'confidence',
+        'severity', 'status', 'processing_time', 'is_reviewed', 'radiologist_review__username',
+        'reviewed_by__username', 'treating_physician_approval__username', 'created_at',
+        'radiologist_reviewed_at', 'reviewed_at', 'approved_at',
+    )
+    export_filename = 'diagnosticos'
 
     permission_map = {
         'list': 'view_diagnosisresult',
@@ -233,7 +360,11 @@ class DiagnosisResultViewSet(ActionPermissionMixin, viewsets.ModelViewSet):
         'mark_reviewed': 'change_diagnosisresult',
         'radiologist_review': 'change_diagnosisresult',
         'physician_approval': 'change_diagnosisresult',
+        'bulk_mark_reviewed': 'change_diagnosisresult',
+        'bulk_radiologist_review': 'change_diagnosisresult',
         'by_my_orders': 'view_diagnosisresult',
+        'similar': 'view_diagnosisresult',
+        'export': 'view_diagnosisresult',
     }
 
     def perform_update(self, serializer):
@@ -361,6 +492,97 @@ class DiagnosisResultViewSet(ActionPermissionMixin, viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+    @action(detail=False, methods=['post'], url_path='bulk-mark-reviewed')
+    def bulk_mark_reviewed(self, request):
+        """Marcar como revisados los diagnósticos `ids` que aún no lo están"""
+        is_physician = request.user.groups.filter(name='Médicos').exists()
+        if not (is_physician or request.user.is_staff or request.user.is_superuser):
+            return Response({'error': _('Solo médicos pueden revisar diagnósticos')}, status=status.HTTP_403_FORBIDDEN)
+        try:
+            ids = parse_ids(request.data.get('ids'))
+        except ValidationError as e:
+            return Response({'error': e.messages[0]}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(apply_transition(
+            self.get_queryset(), ids, Q(is_reviewed=False),
+            {'is_reviewed': True, 'reviewed_by': request.user, 'reviewed_at': timezone.now()},
+            request.user,
+        ))
+
+    @action(detail=False, methods=['post'], url_path='bulk-radiologist-review')
+    def bulk_radiologist_review(self, request):
+        """Revisión radiológica de varios diagnósticos completados que aún no tienen revisión"""
+        try:
+            ids = parse_ids(request.data.get('ids'))
+        except ValidationError as e:
+            return Response({'error': e.messages[0]}, status=status.HTTP_400_BAD_REQUEST)
+        severity = request.data.get('severity')
+        if not severity:
+            return Response(
+                {'error': _('La severidad es obligatoria en la revisión radiológica')},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if severity not in dict(DiagnosisResult.SEVERITY_CHOICES):
+            return Response({'error': _('Severidad inválida')}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(apply_transition(
+            self.get_queryset(), ids, Q(status='completed', radiologist_review__isnull=True),
+            {
+                'radiologist_review': request.user, 'radiologist_reviewed_at': timezone.now(),
+                'severity': severity, 'radiologist_notes': request.data.get('notes', ''),
+            },
+            request.user,
+        ))
+
+    @action(detail=True, methods=['get'])
+    def similar(self, request, pk=None):
+        """
+        Casos confirmados por radiólogo más parecidos a la radiografía de este diagnóstico.
+
+        Query params:
+            - k: número de casos a retornar (1-50, por defecto 10)
+
+        Responde 409 si la radiografía todavía no tiene embedding.
+        """
+        from .embeddings import decode_embeddings, find_similar_cases
+
+        try:
+            k = max(1, min(int(request.query_params.get('k', 10)), 50))
+        except ValueError:
+            return Response({'error': _('El parámetro k debe ser un número entero')}, status=status.HTTP_400_BAD_REQUEST)
+
+        diagnosis = self.get_object()
+        xray = diagnosis.xray
+
+        # El embedding se calcula al analizar la radiografía o con build_similarity_index
+        if xray.embedding is None:
+            return Response(
+                {'error': _('La radiografía no tiene embedding; ejecute build_similarity_index')},
+                status=status.HTTP_409_CONFLICT
+            )
+
+        query = decode_embeddings([xray.embedding])[0]
+        matches = find_similar_cases(query, k=k, exclude_id=diagnosis.id)
+
+        similarity_by_id = {str(case_id): score for case_id, score in matches}
+        cases = {
+            str(case['id']): case
+            for case in DiagnosisResult.objects.filter(id__in=similarity_by_id.keys()).values(
+                'id', 'xray_id', 'predicted_class', 'confidence', 'severity',
+                'radiologist_notes', 'radiologist_reviewed_at', 'created_at'
+            )
+        }
+
+        results = []
+        for case_id, score in matches:
+            case = cases.get(str(case_id))
+            if case is None:
+                continue
+            case['similarity'] = round(score, 4)
+            results.append(case)
+
+        return Response({'diagnosis': str(diagnosis.id), 'k': k, 'results': results})
+
     @action(detail=False, methods=['get'], url_path='by-my-orders')
     def by_my_orders(self, request):
         """
@@ -408,10 +630,25 @@ class DiagnosisResultViewSet(ActionPermissionMixin, viewsets.ModelViewSet):
 
 
 
-class MedicalReportViewSet(ActionPermissionMixin, viewsets.ModelViewSet):
+class MedicalReportViewSet(ActionPermissionMixin, ConditionalGetMixin, AnnotatedQuerysetMixin, viewsets.ModelViewSet):
+    queryset = MedicalReport.objects.order_by('-created_at')
     serializer_class = MedicalReportSerializer
+    select_related_fields = (
+        'diagnosis__xray__medical_order__patient',
+        'diagnosis__xray__medical_order__requested_by',
+        'created_by',
+        'received_by',
+    )
+    # UserSerializer incluye los grupos del autor con sus conteos de usuarios y módulos
+    prefetch_related_fields = (
+        Prefetch('created_by__groups', queryset=Group.objects.annotate(
+            user_count=Count('user', distinct=True),
+            module_count=Count('groupmodulepermission', distinct=True),
+        )),
+    )
+    etag_models = CLINICAL_ETAG_MODELS
     permission_classes = [IsAuthenticated]
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    filter_backends = [DjangoFilterBackend, FullTextSearchFilter, OrderingFilter]
     search_fields = ['title', 'findings', 'impression']
     ordering_fields = ['created_at', 'updated_at']
 
@@ -429,15 +666,10 @@ class MedicalReportViewSet(ActionPermissionMixin, viewsets.ModelViewSet):
 
     def get_queryset(self):
         """
-        Optimizar queries con select_related para evitar N+1
+        Relaciones declaradas en select_related_fields (ver apps.diagnosis.annotations)
         También permite filtrar por paciente y orden médica
         """
-        queryset = MedicalReport.objects.select_related(
-            'diagnosis__xray__medical_order__patient',
-            'diagnosis__xray__medical_order__requested_by',
-            'created_by',
-            'received_by'
-        ).order_by('-created_at')
+        queryset = super().get_queryset()
         # ...existing code...
         patient_id = self.request.query_params.get('patient', None)
         if patient_id:
@@ -532,24 +764,34 @@ class MedicalReportViewSet(ActionPermissionMixin, viewsets.ModelViewSet):
             )
 
 
-class MedicalOrderViewSet(ActionPermissionMixin, viewsets.ModelViewSet):
+class MedicalOrderViewSet(ActionPermissionMixin, ConditionalGetMixin, AnnotatedQuerysetMixin, StreamingExportMixin, viewsets.ModelViewSet):
     """ViewSet para órdenes médicas"""
-    queryset = MedicalOrder.objects.select_related('patient', 'requested_by').order_by('-created_at')
+    queryset = MedicalOrder.objects.order_by('-created_at')
     serializer_class = MedicalOrderSerializer
+    select_related_fields = ('patient', 'requested_by')
+    annotations = {'has_xray': exists(XRayImage, 'medical_order')}
+    etag_models = CLINICAL_ETAG_MODELS
     permission_classes = [IsAuthenticated]
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    filter_backends = [DjangoFilterBackend, FullTextSearchFilter, OrderingFilter]
     filterset_fields = ['patient', 'status', 'priority', 'requested_by']
     search_fields = ['patient__first_name', 'patient__last_name', 'patient__dni', 'reason']
     ordering_fields = ['created_at', 'priority', 'status']
+    export_fields = (
+        'id', 'patient_id', 'patient__dni', 'requested_by__username', 'order_type', 'reason',
+        'priority', 'status', 'created_at', 'scheduled_date', 'completed_date',
+    )
+    export_filename = 'ordenes_medicas'
 
     permission_map = {
         'list': 'view_medicalorder',
         'retrieve': 'view_medicalorder',
+        'export': 'view_medicalorder',
         'create': 'add_medicalorder',
         'update': 'change_medicalorder',
         'partial_update': 'change_medicalorder',
         'destroy': 'delete_medicalorder',
         'update_status': 'change_medicalorder',
+        'bulk_update_status': 'change_medicalorder',
     }
 
     def perform_create(self, serializer):
@@ -594,3 +836,60 @@ class MedicalOrderViewSet(ActionPermissionMixin, viewsets.ModelViewSet):
                 {'error': _('Error al actualizar el estado de la orden')},
                 status=status.HTTP_400_BAD_REQUEST
             )
+
+    @action(detail=False, methods=['post'], url_path='bulk-update-status')
+    def bulk_update_status(self, request):
+        """Cambiar el estado de varias órdenes (solo las que están en un estado de origen permitido)"""
+        try:
+            ids = parse_ids(request.data.get('ids'))
+        except ValidationError as e:
+            return Response({'error': e.messages[0]}, status=status.HTTP_400_BAD_REQUEST)
+        new_status = request.data.get('status')
+        if new_status not in ORDER_STATUS_TRANSITIONS:
+            return Response(
+                {'error': _('Estado inválido. Valores permitidos: %(statuses)s') % {'statuses': ', '.join(ORDER_STATUS_TRANSITIONS)}},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        values = {'status': new_status}
+        if new_status == 'completed':
+            values['completed_date'] = timezone.now()
+        elif new_status == 'in_progress':
+            values['scheduled_date'] = timezone.now()
+        return Response(apply_transition(
+            self.get_queryset(), ids, Q(status__in=ORDER_STATUS_TRANSITIONS[new_status]), values, request.user
+        ))
+
+
+class DiagnosticStatisticsViewSet(ActionPermissionMixin, ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    Estadísticas de diagnóstico por usuario y período (día, semana, mes).
+
+    Solo lectura: las filas las escribe el comando rollup_diagnostic_statistics.
+    Filtros: user, period_type, period_start__gte, period_end__lte...
+    """
+    queryset = DiagnosticStatistics.objects.select_related('user').order_by('-period_start', 'user_id')
+    serializer_class = DiagnosticStatisticsSerializer
+    etag_models = (get_user_model(),)
+    permission_classes = [IsAuthenticated]
+    filter_backends = [DjangoFilterBackend, OrderingFilter]
+    filterset_fields = {
+        'user': ['exact'],
+        'period_type': ['exact'],
+        'period_start': ['exact', 'gte', 'lte'],
+        'period_end': ['exact', 'gte', 'lte'],
+    }
+    ordering_fields = ['period_start', 'total_cases_analyzed', 'average_confidence']
+
+    permission_map = {
+        'list': 'view_diagnosticstatistics',
+        'retrieve': 'view_diagnosticstatistics',
+    }
+
+    def get_queryset(self):
+        """Restringir al alcance del usuario (todas, su grupo o solo las propias)"""
+        queryset = super().get_queryset()
+        scope_info = determine_stats_scope(self.request.user)
+        if scope_info['scope'] != 'all':
+            queryset = queryset.filter(user_id__in=scope_info['user_ids'])
+        return queryset
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-19 01:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('security', '0002_alter_audituser_registroid'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='audituser',
+            index=models.Index(fields=['-fecha', '-hora', '-id'], name='security_au_fecha_2f35da_idx'),
+        ),
+    ]
@@ -191,4 +191,8 @@ class AuditUser(models.Model):
     class Meta:
         verbose_name = 'Auditoria Usuario '
         verbose_name_plural = 'Auditorias Usuarios'
-        ordering = ('-fecha', 'hora')
\ No newline at end of file
+        ordering = ('-fecha', 'hora')
+        indexes = [
+            # Paginación por cursor (keyset)
+            models.Index(fields=['-fecha', '-hora', '-id']),
+        ]
\ No newline at end of file
@@ -93,11 +93,15 @@ class GroupSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'user_count', 'module_count']
     
     def get_user_count(self, obj):
-        """Obtener cantidad de usuarios en el grupo"""
+        """Obtener cantidad de usuarios en el grupo (usa la anotación user_count si existe)"""
+        if hasattr(obj, 'user_count'):
+            return obj.user_count
         return obj.user_set.count()
     
     def get_module_count(self, obj):
-        """Obtener cantidad de módulos asignados"""
+        """Obtener cantidad de módulos asignados (usa la anotación module_count si existe)"""
+        if hasattr(obj, 'module_count'):
+            return obj.module_count
         return obj.groupmodulepermission_set.count()
     
     def validate_name(self, value):
@@ -456,3 +456,4 @@ class AuditUserViewSet(viewsets.ReadOnlyModelViewSet):
     search_fields = ['usuario__username', 'usuario__first_name', 'usuario__last_name', 'tabla', 'estacion']
     ordering_fields = ['id', 'fecha', 'hora', 'tabla', 'accion']
     ordering = ['-fecha', '-hora']
+    keyset_fields = ('-fecha', '-hora', '-id')
@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 
 from pathlib import Path
 import os
+import importlib.util
 from dotenv import load_dotenv
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -170,6 +171,12 @@ CORS_ALLOW_HEADERS = [
     'x-requested-with',
 ]
 
+# Interfaz navegable de DRF (HTML): solo en desarrollo salvo que se habilite explícitamente
+API_BROWSABLE = os.environ.get('API_BROWSABLE', str(DEBUG)).lower() == 'true'
+
+# Content type application/msgpack para clientes internos (requiere el paquete msgpack)
+MSGPACK_AVAILABLE = importlib.util.find_spec('msgpack') is not None
+
 # REST Framework Configuration
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
@@ -178,12 +185,15 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.SessionAuthentication',
     ],
+    # JSON con orjson (si está instalado); MessagePack y la interfaz navegable son opcionales
     'DEFAULT_RENDERER_CLASSES': [
-        'rest_framework.renderers.JSONRenderer',
-        'rest_framework.renderers.BrowsableAPIRenderer',
+        'apps.core.renderers.FastJSONRenderer',
+        *(['apps.core.renderers.MessagePackRenderer'] if MSGPACK_AVAILABLE else []),
+        *(['rest_framework.renderers.BrowsableAPIRenderer'] if API_BROWSABLE else []),
     ],
     'DEFAULT_PARSER_CLASSES': [
-        'rest_framework.parsers.JSONParser',
+        'apps.core.renderers.FastJSONParser',
+        *(['apps.core.renderers.MessagePackParser'] if MSGPACK_AVAILABLE else []),
         'rest_framework.parsers.MultiPartParser',
         'rest_framework.parsers.FormParser',
     ],
@@ -192,7 +202,8 @@ REST_FRAMEWORK = {
         'rest_framework.filters.SearchFilter',
         'rest_framework.filters.OrderingFilter',
     ],
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    # Por número de página; por cursor a pedido en los ViewSets con keyset_fields
+    'DEFAULT_PAGINATION_CLASS': 'apps.core.pagination.PageOrKeysetPagination',
     'PAGE_SIZE': 20,
     'DEFAULT_SCHEMA_CLASS': 'rest_framework.schemas.coreapi.AutoSchema',
     'EXCEPTION_HANDLER': 'rest_framework.views.exception_handler',
@@ -237,3 +248,62 @@ ROBOFLOW_API_KEY = os.environ.get('ROBOFLOW_API_KEY', '')
 ROBOFLOW_API_URL = os.environ.get('ROBOFLOW_API_URL', 'https://detect.roboflow.com')
 ROBOFLOW_MODEL_ID = os.environ.get('ROBOFLOW_MODEL_ID', '')
 
+
+# Búsqueda de casos similares (embeddings de radiografías)
+SIMILARITY_INDEX_PATH = os.environ.get('SIMILARITY_INDEX_PATH', os.path.join(BASE_DIR, 'var', 'similarity_index.npz'))
+SIMILARITY_BRUTE_FORCE_MAX = 50_000  # Por encima de este tamaño se usa el índice IVF-PQ precalculado
+SIMILARITY_INDEX_TTL = 300  # Segundos antes de recargar el índice en memoria
+
+# Caché: las invalidaciones (alcances, estadísticas, ETags, autocompletado) deben
+# verse en todos los workers, así que esos módulos solo cachean con una caché
+# compartida. Redis si se define REDIS_URL (requiere el paquete redis); si no, la
+# local de cada proceso y esos módulos calculan siempre.
+# La tabla 'pyneumonia_cache' (migración core.0001_cache_table) sirve como caché
+# compartida sin Redis, pero cada lectura es una consulta (el alcance de
+# estadísticas no se cachea en ella) y cada escritura clínica agrega las de
+# generaciones y versiones: editar solo el teléfono de un paciente pasa de 2 a 17
+# sentencias, con 3 transacciones más sobre la tabla de caché.
+REDIS_URL = os.environ.get('REDIS_URL', '')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Alcance de estadísticas (grupos y miembros) cacheado; se invalida con signals de membresía
+STATS_SCOPE_CACHE_TIMEOUT = 600
+
+# Caché de respuestas de estadísticas (stale-while-revalidate)
+STATS_CACHE_ENABLED = True
+STATS_CACHE_TTL = 30  # Segundos en que una respuesta se considera fresca
+STATS_CACHE_STALE_TTL = 600  # Segundos que se conserva para servirla mientras se recalcula
+STATS_CACHE_LOCK_TIMEOUT = 30  # Duración máxima del candado de recálculo
+STATS_CACHE_WAIT = 2.0  # Espera máxima por un cálculo en curso cuando no hay copia
+
+# Vistas asíncronas de estadísticas: hilos para consultas concurrentes (0 = en serie)
+STATS_ASYNC_WORKERS = 8
+
+# Rol del dashboard según el grupo principal del usuario: {rol: [id o nombre exacto del grupo]}
+DASHBOARD_ROLE_GROUPS = {
+    'radiologist': ['Radiólogos'],
+    'physician': ['Médicos'],
+    'reception': ['Recepcionistas'],
+}
+
+# Autocompletado de pacientes: índice de prefijos en memoria por proceso (False = rango sobre la BD)
+PATIENT_AUTOCOMPLETE_IN_MEMORY = True
+PATIENT_AUTOCOMPLETE_TTL = 300  # Segundos antes de recargar el índice aunque no cambie la generación
+
+# Series de tiempo pre-agregadas: rango máximo (en días) de una consulta
+TIMESERIES_MAX_RANGE_DAYS = 3 * 366
+
+# Sketches HyperLogLog de conteos distintos: 2^p registros por día (p=12 -> 4 KB, error ~1.6 %)
+DISTINCT_SKETCH_PRECISION = 12